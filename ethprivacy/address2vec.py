@@ -1,48 +1,51 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import os
-from tqdm import tqdm
+import copy
 
-from .distance_calculation import get_rank
+from .distance_calculation import rank_metrics, query_distances
 from .tornado_mixer import get_deposit_indices
+from .histogram_cube import HistogramCube
+from .schema import EventColumns
 
 def show_patterns(events_df, addresses, gas_bins=50, hour_bins=24, figsize=(15,3), show_kde=False, log_gas=False):
-    """Show side channels distribution of the given addresses"""
+    """Show side channels distribution of the given addresses. Provide a HistogramCube instead of 'events_df' to plot from precomputed histograms."""
+    if isinstance(events_df, HistogramCube):
+        return events_df.show_patterns(addresses, gas_bins=gas_bins, hour_bins=hour_bins, figsize=figsize, log_gas=log_gas)
+    import matplotlib.pyplot as plt
+    # filter events only once for each address
+    grouped = events_df[events_df["from"].isin(addresses)].groupby("from")
+    user_txs = dict((address, grouped.get_group(address) if address in grouped.groups else events_df.iloc[:0]) for address in addresses)
     if show_kde:
         fig, ax = plt.subplots(1,2, figsize=(15,3))
         for address in addresses:
-            user_txs = events_df[events_df["from"]==address]
-            print(address, len(user_txs))
+            print(address, len(user_txs[address]))
         plt.subplot(1,2,1)
         try:
             for address in addresses:
-                user_txs = events_df[events_df["from"]==address]
-                user_txs["normalized_gas"].plot.kde()
+                user_txs[address]["normalized_gas"].plot.kde()
             if log_gas:
                 plt.xlim([0,np.log(1+5)])
             else:
                 plt.xlim([0,5])
             plt.subplot(1,2,2)
             for address in addresses:
-                user_txs = events_df[events_df["from"]==address]
-                user_txs["hour"].plot.kde()
+                user_txs[address]["hour"].plot.kde()
             plt.xlim([0,86400])
         except Exception as e:
             print(e)
     fig, ax = plt.subplots(1,2, figsize=(15,3))
     plt.subplot(1,2,1)
+    max_gas = events_df["normalized_gas"].max()
     for address in addresses:
-        user_txs = events_df[events_df["from"]==address]
-        user_txs["normalized_gas"].hist(bins=gas_bins, range=(0.0, events_df["normalized_gas"].max()), alpha=0.5)
+        user_txs[address]["normalized_gas"].hist(bins=gas_bins, range=(0.0, max_gas), alpha=0.5)
     if log_gas:
         plt.xlim([0,np.log(1+5)])
     else:
         plt.xlim([0,5])
     plt.subplot(1,2,2)
     for address in addresses:
-        user_txs = events_df[events_df["from"]==address]
-        user_txs["hour"].hist(bins=hour_bins, range=(0,86400), alpha=0.5)
+        user_txs[address]["hour"].hist(bins=hour_bins, range=(0,86400), alpha=0.5)
 
 def preproc_node_embeddings(df, a2v_obj):
     """Reorder node representations and handle missing addresses according to the given Address2Vec object."""
@@ -50,18 +53,23 @@ def preproc_node_embeddings(df, a2v_obj):
     missing = set(nodes).difference(set(df["address"]))
     node_emb = df[df["address"].isin(nodes)]
     # handle missing addresses
-    mean_repr = list(node_emb.mean())
-    missing_df = pd.DataFrame([mean_repr for _ in range(len(missing))])
-    missing_df["address"] = list(missing)
-    missing_df.columns = node_emb.columns
-    # concatenation
-    augmented_df = pd.concat([node_emb, missing_df], ignore_index=True)
+    if len(missing) > 0:
+        mean_repr = list(node_emb.mean())
+        missing_df = pd.DataFrame([mean_repr for _ in range(len(missing))])
+        missing_df["address"] = list(missing)
+        missing_df.columns = node_emb.columns
+        # concatenation
+        augmented_df = pd.concat([node_emb, missing_df], ignore_index=True)
+    else:
+        augmented_df = node_emb
     augmented_df = augmented_df.set_index("address")
     augmented_df = augmented_df.loc[nodes,:]
     return augmented_df.values
 
+BLOCK_NAMES = {"hour":"hour", "normalized_gas":"gas"}
+
 class Address2Vec():
-    def __init__(self, events_df=None, norm_type="ptp", min_tx_cnt=10, gas_bins=25, hour_bins=6, use_hour=True, use_gas=True, use_stats=True, use_distrib=True, aggregations=["mean","median","std"], node_emb=None, verbose=True):
+    def __init__(self, events_df=None, norm_type="ptp", min_tx_cnt=10, gas_bins=25, hour_bins=6, use_hour=True, use_gas=True, use_stats=True, use_distrib=True, aggregations=["mean","median","std"], node_emb=None, dtype="float64", cube=None, token_features=None, verbose=True):
         self.min_tx_cnt = min_tx_cnt
         self.gas_bins = gas_bins
         self.hour_bins = hour_bins
@@ -71,14 +79,26 @@ class Address2Vec():
         self.use_distrib = use_distrib
         self.aggregations = aggregations
         self.node_emb = node_emb
+        self.cube = cube
+        self.token_features = token_features
         self.verbose = verbose
         self.events = events_df
         if norm_type in [None,"normal","ptp"]:
             self.norm_type = norm_type
         else:
             raise RuntimeError("Invalid normalization!")
+        if np.dtype(dtype).name in ["float64","float32","float16"]:
+            self.dtype = np.dtype(dtype).name
+        else:
+            raise RuntimeError("Invalid precision!")
         self.X = None
+        self.block_dims = []
+        self._distrib_dims = None
         self.id = "h%s_g%s_s%s_d%s_hb%i_gb%i_tx%i_nt%s_%s" % (self.use_hour, self.use_gas, self.use_stats, self.use_distrib, self.hour_bins, self.gas_bins, self.min_tx_cnt, self.norm_type,  "_".join(aggregations))
+        if self.token_features is not None:
+            self.id += "_tok%i" % (self.token_features.shape[1]-1)
+        if self.dtype != "float64":
+            self.id += "_%s" % self.dtype
         if not events_df is None:
             self._calculate_address_stats()
             self.X = self._preprocess()
@@ -94,19 +114,63 @@ class Address2Vec():
         agg_map = {"hash":["count"]}
         for col in self.feature_cols:
             agg_map[col] = self.aggregations
-        self.stats = self.events.groupby("from").agg(agg_map).reset_index()
+        if isinstance(self.events, EventColumns):
+            self.stats = self._column_stats()
+        else:
+            self.stats = self.events.groupby("from").agg(agg_map).reset_index()
         self.filtered_stats = self.stats[self.stats[("hash","count")] >= self.min_tx_cnt].reset_index(drop=True)
         self.addr_to_embedd = list(self.filtered_stats["from"])
         # mappings
         self.idx2addr = dict(self.filtered_stats["from"])
         self.addr2idx = dict(zip(self.idx2addr.values(), self.idx2addr.keys()))
         # filter
-        self.events = self.events[self.events["from"].isin(self.addr_to_embedd)]
+        if isinstance(self.events, EventColumns):
+            # row of each address code (-1 for addresses that are not embedded)
+            self._code_rows = np.full(len(self.events.addresses), -1, dtype="int64")
+            self._code_rows[self.stats.index[self.stats[("hash","count")] >= self.min_tx_cnt]] = np.arange(len(self.addr_to_embedd))
+        else:
+            self.events = self.events[self.events["from"].isin(self.addr_to_embedd)]
         # info
         if self.verbose:
             print("Number of embedded addresses:", len(self.addr_to_embedd))
             print("Ratio of embedded addresses: %.2f" % (len(self.addr_to_embedd) / len(self.stats)))
         
+    def _column_stats(self):
+        """Address statistics of EventColumns. Columns are wrapped into Series without copies and grouped by the address codes, so the statistics are calculated exactly as for DataFrame events. The index of the result is the address code."""
+        codes = self.events["from"]
+        stats = {("from",""): None, ("hash","count"): pd.Series(codes, copy=False).groupby(codes).size()}
+        for col in self.feature_cols:
+            grouped = pd.Series(self.events[col], copy=False).groupby(codes).agg(self.aggregations)
+            for agg in self.aggregations:
+                stats[(col, agg)] = grouped[agg]
+        # events without sender address
+        index = stats[("hash","count")].index
+        stats[("from","")] = pd.Series(np.array(self.events.addresses, dtype=object)[index[index >= 0]], index=index[index >= 0])
+        return pd.DataFrame(stats).loc[index[index >= 0]]
+
+    def _column_distribution(self, cols):
+        """Distribution of the discretized side channels of EventColumns in the format of the DataFrame based pivot tables"""
+        codes = self.events["from"]
+        rows = self._code_rows[codes]
+        selected = rows >= 0
+        rows = rows[selected]
+        num_rows = len(self.addr_to_embedd)
+        parts = []
+        for col in cols:
+            values = self.events[col]
+            if col == "normalized_gas" and self.gas_bins > 0:
+                # maximum of the embedded addresses
+                max_gas_price = pd.Series(values, copy=False).groupby(codes).max().reindex(np.where(self._code_rows >= 0)[0]).max()
+                bins = (values // (max_gas_price / self.gas_bins)).astype("int64")[selected]
+            elif col == "hour" and self.hour_bins > 0:
+                bins = (values // (86400 / self.hour_bins)).astype("int64")[selected]
+            else:
+                bins = np.asarray(values)[selected]
+            observed = np.unique(bins)
+            counts = np.bincount(rows * len(observed) + np.searchsorted(observed, bins), minlength=num_rows*len(observed))
+            parts.append(counts.reshape(num_rows, len(observed)).astype("float64"))
+        return parts
+
     def _stat_based_repr(self):
         """Prepare basic side channels statistics"""
         A = self.filtered_stats.drop("from",axis=1,level=0).drop(("hash","count"),axis=1).values
@@ -119,37 +183,58 @@ class Address2Vec():
     
     def _distribution_based_repr(self):
         """Prepare address representation based on side channel distribution"""
+        if self.cube is not None:
+            # sum precomputed fine histogram bins
+            parts = []
+            if self.use_hour and self.hour_bins > 0:
+                parts.append(("hour", self.cube.distribution(self.addr_to_embedd, hour_bins=self.hour_bins)))
+            if self.use_gas and self.gas_bins > 0:
+                parts.append(("normalized_gas", self.cube.distribution(self.addr_to_embedd, gas_bins=self.gas_bins)))
+            self._distrib_dims = [(col, part.shape[1]) for col, part in parts]
+            B = np.concatenate([part for _, part in parts], axis=1) if len(parts) > 0 else np.array([])
+            if self.verbose:
+                print("Distribution based representation dimensions:", B.shape)
+            return B
+        cols = self.feature_cols.copy()
+        if self.use_gas and self.gas_bins == 0:
+            cols.remove("normalized_gas")
+        if self.use_hour and self.hour_bins == 0:
+            cols.remove("hour")
+        if isinstance(self.events, EventColumns):
+            parts = self._column_distribution(cols)
+        else:
+            parts = self._pivot_distribution(cols)
+        self._distrib_dims = [(col, part.shape[1]) for col, part in zip(cols, parts)]
+        if len(parts) > 0:
+            B = np.concatenate(parts, axis=1)
+            # normalization
+            tx_counts = np.array(self.filtered_stats[("hash","count")])
+            B = B / tx_counts.reshape(-1,1)
+        else:
+            B = np.array([])
+        if self.verbose:
+            print("Distribution based representation dimensions:", B.shape)
+        return B
+
+    def _pivot_distribution(self, cols):
+        """Distribution of the discretized side channels of DataFrame events"""
         max_gas_price = self.events["normalized_gas"].max()
         events_tmp = self.events.copy()
-        cols = self.feature_cols.copy()
         events_tmp = events_tmp[["from","hash"]+cols]
         # discretization
         if self.use_gas and self.gas_bins > 0:
             norm_gas_interval = max_gas_price / self.gas_bins
             events_tmp["normalized_gas"] = (events_tmp["normalized_gas"] // norm_gas_interval).astype("int64")
-        if self.use_gas and self.gas_bins == 0:
-            cols.remove("normalized_gas")
         if self.use_hour and self.hour_bins > 0:
             hour_interval = 86400 / self.hour_bins
             events_tmp["hour"] = (events_tmp["hour"] // hour_interval).astype("int64")
-        if self.use_hour and self.hour_bins == 0:
-            cols.remove("hour")
         # extract distribution
         parts = []
         for col in cols:
             distrib = events_tmp.groupby(["from",col])["hash"].count().reset_index()
             pivot = distrib.pivot(index="from", columns=col, values="hash").fillna(0.0)
             parts.append(pivot)
-        if len(parts) > 0:
-            B = np.concatenate(parts, axis=1)
-            # normalization
-            tx_counts = np.array(self.filtered_stats[("hash","count")])
-            B = B / tx_counts.reshape(-1,1)
-        else:
-            B = np.array([])
-        if self.verbose:
-            print("Distribution based representation dimensions:", B.shape)
-        return B
+        return parts
     
     def _preprocess(self):
         """Concatenate and normalize multiple representations"""
@@ -160,12 +245,16 @@ class Address2Vec():
         if self.use_stats and self.use_distrib:
             if B.shape[0] > 0:
                 X = np.concatenate([A,B],axis=1)
+                self.block_dims = self._stat_block_dims(A) + self._distrib_block_dims(B)
             else:
                 X = A
+                self.block_dims = self._stat_block_dims(A)
         elif self.use_stats and not self.use_distrib:
             X = A
+            self.block_dims = self._stat_block_dims(A)
         elif self.use_distrib and not self.use_stats:
             X = B
+            self.block_dims = self._distrib_block_dims(B)
         # add node embedding
         if self.node_emb is not None:
             proc_node_emb = preproc_node_embeddings(self.node_emb, self)
@@ -174,47 +263,89 @@ class Address2Vec():
                 X = proc_node_emb
             else:
                 X = np.concatenate([X,proc_node_emb],axis=1)
+            self.block_dims = self.block_dims + [("node", proc_node_emb.shape[1])]
+        # add token co-usage features (see token_similarity.TokenCoUsage.features)
+        if self.token_features is not None:
+            proc_token_features = preproc_node_embeddings(self.token_features, self)
+            if X is None:
+                X = proc_token_features
+            else:
+                X = np.concatenate([X,proc_token_features],axis=1)
+            self.block_dims = self.block_dims + [("token", proc_token_features.shape[1])]
         # normalization
         if self.norm_type == "normal":
             X = (X - X.mean(0)) / X.std(0)
         elif self.norm_type == "ptp":
             X = (X - X.min(0)) / X.ptp(0) 
+        # features are calculated in float64 then stored in the configured precision
+        X = X.astype(self.dtype)
         if self.verbose:
             print("Total dimensions:", X.shape)
         return X
     
+    def _stat_block_dims(self, A):
+        num_aggs = len(self.aggregations)
+        if A.shape[1] != num_aggs * len(self.feature_cols):
+            return [("stats", A.shape[1])]
+        return [("stats_%s" % BLOCK_NAMES[col], num_aggs) for col in self.feature_cols]
+
+    def _distrib_block_dims(self, B):
+        if self._distrib_dims is None or sum(width for _, width in self._distrib_dims) != B.shape[1]:
+            return [("distrib", B.shape[1])]
+        return [("distrib_%s" % BLOCK_NAMES[col], width) for col, width in self._distrib_dims]
+
+    def get_blocks(self):
+        """Split the normalized representation into feature blocks (statistics and distribution of each side channel, node embedding). Column-wise normalization makes any block combination equal to the representation built with the corresponding settings."""
+        blocks = {}
+        start = 0
+        for name, width in self.block_dims:
+            blocks[name] = self.X[:,start:start+width]
+            start += width
+        return blocks
+
+    def astype(self, dtype):
+        """Copy of the address representation with the given storage precision (float64, float32 or float16)"""
+        if not np.dtype(dtype).name in ["float64","float32","float16"]:
+            raise RuntimeError("Invalid precision!")
+        other = copy.copy(self)
+        other.dtype = np.dtype(dtype).name
+        if self.X is not None:
+            other.X = self.X.astype(other.dtype)
+        if self.dtype != "float64":
+            other.id = other.id[:-len(self.dtype)-1]
+        if other.dtype != "float64":
+            other.id += "_%s" % other.dtype
+        return other
+    
     def get_idx_pairs(self, api, min_cnt=2, max_cnt=2, mirror=True):
-        """Extract the indices of ENS address pairs for evaluation."""
+        """Extract the indices of ENS address pairs for evaluation. Pairs are returned in an integer array with (target, query) rows: pair[0] is the target and pair[1] is the query."""
         # extract ens names
-        pairs = api.ens_pairs.copy()
-        pairs = pairs[pairs["address"].isin(self.addr_to_embedd)]
+        pairs = api.ens_pairs[api.ens_pairs["address"].isin(self.addr_to_embedd)]
         ens_counts = pairs["name"].value_counts()
-        idx_pairs = []
         all_ens_names = []
         for cnt in range(min_cnt, max_cnt+1):
-            ens_names = list(ens_counts[ens_counts == cnt].index)
-            all_ens_names += ens_names
-            # convert to indices
-            for ename in ens_names:
-                addrs = list(set(api.ens_addresses(ename)).intersection(set(self.addr_to_embedd)))
-                for i in range(len(addrs)):
-                    for j in range(i+1,len(addrs)):
-                        addr1, addr2 = addrs[i], addrs[j]
-                        idx1, idx2 = self.addr2idx[addr1], self.addr2idx[addr2]
-                        idx_pairs.append([idx1,idx2])
-                        if mirror:
-                            idx_pairs.append([idx2,idx1])
+            all_ens_names += list(ens_counts[ens_counts == cnt].index)
+        # self-join addresses of the selected names
+        members = pairs[pairs["name"].isin(all_ens_names)][["name","address"]].drop_duplicates()
+        members["idx"] = members["address"].map(self.addr2idx).astype("int64")
+        members["name"] = pd.Categorical(members["name"], categories=all_ens_names)
+        joined = members[["name","idx"]].merge(members[["name","idx"]], on="name", suffixes=("_1","_2"))
+        joined = joined[joined["idx_1"] < joined["idx_2"]].sort_values(["name","idx_1","idx_2"])
+        idx_pairs = joined[["idx_1","idx_2"]].values.astype("int64").reshape(-1,2)
+        if mirror:
+            idx_pairs = np.stack([idx_pairs, idx_pairs[:,::-1]], axis=1).reshape(-1,2)
         return idx_pairs, all_ens_names
         
     def run_ens(self, idx_pairs, model_id):
         """Evaluate representations for ENS address pairs"""
+        from tqdm import tqdm
         pbar = tqdm(total=len(idx_pairs))
         records = []
         for pair in idx_pairs:
-            rank, dist, num_set = get_rank(self.X, pair[1], pair[0])
-            records.append((pair[1], pair[0], rank, dist, num_set, "none"))
+            rank, dist, num_set, rank_ratio, auc = rank_metrics(query_distances(self.X, pair[1]), pair[1], pair[0])
+            records.append((pair[1], pair[0], rank, dist, num_set, rank_ratio, auc, "none"))
             pbar.update(1)
-        df = pd.DataFrame(records, columns=["query_idx", "target_idx", "rank", "dist", "set_size", "filter"])
+        df = pd.DataFrame(records, columns=["query_idx", "target_idx", "rank", "dist", "set_size", "rank_ratio", "auc", "filter"])
         df["embedding_id"] = model_id
         df["query_addr"] = df["query_idx"].apply(lambda x: self.idx2addr[x])
         df["target_addr"] = df["target_idx"].apply(lambda x: self.idx2addr[x])
@@ -222,6 +353,7 @@ class Address2Vec():
     
     def run_tornado(self, query_objects, model_id, filters=["none", "past", "week", "day"]):
         """Evaluate representations for Tornado withdraw-deposit heuristics"""
+        from tqdm import tqdm
         res = []
         pbar = tqdm(total=len(query_objects))
         for tq in query_objects:
@@ -233,10 +365,10 @@ class Address2Vec():
                     for f_id in filters:
                         # anonymity set size is needed without filters
                         d_set_idx, size_1 = get_deposit_indices(self, tq, tup, f_id)
-                        rank, dist, size_2 = get_rank(self.X, w_idx, d_idx, d_set_idx)
+                        rank, dist, size_2, rank_ratio, auc = rank_metrics(query_distances(self.X, w_idx), w_idx, d_idx, d_set_idx)
                         num_set = max(size_1, size_2)
-                        records.append((tup[3], w_idx, d_idx, rank, dist, num_set, f_id))
-            df = pd.DataFrame(records, columns=["timestamp","query_idx","target_idx","rank","dist","set_size","filter"])
+                        records.append((tup[3], w_idx, d_idx, rank, dist, num_set, rank_ratio, auc, f_id))
+            df = pd.DataFrame(records, columns=["timestamp","query_idx","target_idx","rank","dist","set_size","rank_ratio","auc","filter"])
             df["embedding_id"] = model_id
             df["mixer"] = tq.mixer_str_value
             res.append(df)
@@ -0,0 +1,166 @@
+import os
+import json
+import multiprocessing
+import numpy as np
+import pandas as pd
+from .distance_calculation import compute_dtype
+
+def _block_top_k(X, sq_norms, start, end, k):
+    """Exact top-k neighbors (excluding the address itself) of the rows start:end. Candidates are selected with the matrix product form of the squared distances and their distances are recalculated directly."""
+    Q = X[start:end]
+    sq_dist = sq_norms[start:end].reshape(-1,1) + sq_norms.reshape(1,-1) - 2.0 * Q.dot(X.T)
+    rows = np.arange(end - start)
+    sq_dist[rows, rows + start] = np.inf
+    # a few extra candidates make the selection robust to rounding errors of the product form
+    num_cand = min(k + 8, X.shape[0] - 1)
+    cand = np.argpartition(sq_dist, num_cand - 1, axis=1)[:,:num_cand]
+    exact = np.sqrt(np.square(X[cand] - Q[:,None,:]).sum(axis=2))
+    exact[cand == (rows + start).reshape(-1,1)] = np.inf
+    # ascending distance, ascending index for ties
+    order = np.lexsort((cand, exact), axis=1)[:,:k]
+    return np.take_along_axis(cand, order, axis=1), np.take_along_axis(exact, order, axis=1)
+
+class NeighborTable():
+    """Top-k nearest neighbors of every embedded address: (addresses x k) index and distance arrays stored as .npy files (loaded with memory mapping) and the address list in 'addresses.json'"""
+    def __init__(self, indices, distances, addresses):
+        self.indices = indices
+        self.distances = distances
+        self.addresses = addresses
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(path, "addresses.json")) as f:
+            addresses = json.load(f)
+        return cls(np.load(os.path.join(path, "indices.npy"), mmap_mode=mmap_mode), np.load(os.path.join(path, "distances.npy"), mmap_mode=mmap_mode), addresses)
+
+    def to_frame(self):
+        """Neighbor table in (address, neighbor, rank, dist) format"""
+        N, k = self.indices.shape
+        addresses = np.array(self.addresses, dtype=object)
+        return pd.DataFrame({
+            "address": np.repeat(addresses, k),
+            "neighbor": addresses[np.asarray(self.indices).ravel()],
+            "rank": np.tile(np.arange(1, k+1), N),
+            "dist": np.asarray(self.distances).ravel(),
+        })
+
+def all_pairs_top_k(a2v_obj, k=10, output_dir=None, memory_limit_mb=256, num_workers=1, verbose=True):
+    """Top-k nearest neighbors of every address of an Address2Vec representation. Rows are processed in blocks whose distance matrix fits into 'memory_limit_mb' (per worker) by 'num_workers' forked processes. Results are written into memory mapped arrays in 'output_dir' (or kept in memory if it is not set) and returned as a NeighborTable."""
+    X = np.asarray(a2v_obj.X)
+    X = X.astype(compute_dtype(X), copy=False)
+    if np.isnan(X).sum() > 0:
+        raise RuntimeError("Representation matrix contains nans!")
+    N = X.shape[0]
+    k = min(k, N - 1)
+    addresses = [a2v_obj.idx2addr[idx] for idx in range(N)]
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        indices = np.lib.format.open_memmap(os.path.join(output_dir, "indices.npy"), mode="w+", dtype="int32", shape=(N, k))
+        distances = np.lib.format.open_memmap(os.path.join(output_dir, "distances.npy"), mode="w+", dtype="float32", shape=(N, k))
+        with open(os.path.join(output_dir, "addresses.json"), "w") as f:
+            json.dump(addresses, f)
+    elif num_workers > 1:
+        raise RuntimeError("Parallel processing requires an output folder!")
+    else:
+        indices = np.zeros((N, k), dtype="int32")
+        distances = np.zeros((N, k), dtype="float32")
+    sq_norms = np.square(X).sum(axis=1)
+    # the distance matrix and the candidate distances of a block
+    bytes_per_row = N * X.itemsize * 2 + (k + 8) * X.shape[1] * X.itemsize
+    block_size = int(max(1, min(N, memory_limit_mb * 1024**2 // bytes_per_row)))
+    blocks = [(start, min(start + block_size, N)) for start in range(0, N, block_size)]
+    if verbose:
+        print("All-pairs top-%i: %i addresses, %i blocks of %i rows" % (k, N, len(blocks), block_size))
+    def work(worker_id):
+        for start, end in blocks[worker_id::max(1, num_workers)]:
+            idx, dist = _block_top_k(X, sq_norms, start, end, k)
+            indices[start:end] = idx
+            distances[start:end] = dist
+        if output_dir is not None:
+            indices.flush()
+            distances.flush()
+    if num_workers <= 1:
+        work(0)
+    else:
+        ctx = multiprocessing.get_context("fork")
+        workers = [ctx.Process(target=work, args=(worker_id,)) for worker_id in range(num_workers)]
+        for proc in workers:
+            proc.start()
+        for proc in workers:
+            proc.join()
+        for proc in workers:
+            if proc.exitcode != 0:
+                raise RuntimeError("Top-k worker failed with exit code %i" % proc.exitcode)
+    if output_dir is not None:
+        return NeighborTable.load(output_dir)
+    return NeighborTable(indices, distances, addresses)
+
+def ens_pair_distances(a2v_obj, idx_pairs):
+    """Distances of the ENS address pairs of Address2Vec.get_idx_pairs"""
+    X = np.asarray(a2v_obj.X)
+    X = X.astype(compute_dtype(X), copy=False)
+    return np.sqrt(np.square(X[idx_pairs[:,0]] - X[idx_pairs[:,1]]).sum(axis=1))
+
+def mutual_knn_edges(table, threshold=None):
+    """Address pairs (i < j) that are among the top-k neighbors of each other and (optionally) closer than 'threshold'"""
+    N, k = table.indices.shape
+    src = np.repeat(np.arange(N, dtype="int64"), k)
+    trg = np.asarray(table.indices).ravel().astype("int64")
+    dist = np.asarray(table.distances).ravel()
+    keys = src * N + trg
+    sorted_keys = np.sort(keys)
+    reverse = trg * N + src
+    pos = np.clip(np.searchsorted(sorted_keys, reverse), 0, len(sorted_keys) - 1)
+    mutual = (sorted_keys[pos] == reverse) & (src < trg)
+    if threshold is not None:
+        mutual &= dist <= threshold
+    return src[mutual], trg[mutual], dist[mutual]
+
+def union_find_components(num_nodes, src, trg):
+    """Connected component label of each node (the smallest node index of its component) with a vectorized union-find"""
+    parent = np.arange(num_nodes, dtype="int64")
+    src, trg = np.asarray(src, dtype="int64"), np.asarray(trg, dtype="int64")
+    while True:
+        # path halving on every node
+        while True:
+            grand = parent[parent]
+            if (grand == parent).all():
+                break
+            parent = grand
+        ru, rv = parent[src], parent[trg]
+        active = ru != rv
+        if not active.any():
+            return parent
+        # link larger roots to the smallest root they are connected to
+        lo, hi = np.minimum(ru[active], rv[active]), np.maximum(ru[active], rv[active])
+        np.minimum.at(parent, hi, lo)
+
+def cluster_addresses(a2v_obj, table, threshold=None, idx_pairs=None, quantile=0.5, verbose=True):
+    """Candidate user clusters: connected components of the mutual kNN graph of the neighbor table. Without an explicit 'threshold' edges are limited to the 'quantile' of the ENS pair distances (idx_pairs of Address2Vec.get_idx_pairs). Returns the (address, cluster, cluster_size) table and the calibration summary."""
+    summary = {}
+    if threshold is None and idx_pairs is not None and len(idx_pairs) > 0:
+        pair_dist = ens_pair_distances(a2v_obj, idx_pairs)
+        threshold = float(np.quantile(pair_dist, quantile))
+        summary["ens_pairs"] = len(idx_pairs)
+        summary["quantile"] = quantile
+    summary["threshold"] = threshold
+    N = table.indices.shape[0]
+    src, trg, _ = mutual_knn_edges(table, threshold)
+    labels = union_find_components(N, src, trg)
+    sizes = np.bincount(labels, minlength=N)
+    clusters = pd.DataFrame({"address": table.addresses, "cluster": labels, "cluster_size": sizes[labels]})
+    summary["edges"] = len(src)
+    summary["clusters"] = int((sizes > 1).sum())
+    summary["clustered_addresses"] = int((sizes[labels] > 1).sum())
+    summary["max_cluster_size"] = int(sizes.max()) if N > 0 else 0
+    if idx_pairs is not None and len(idx_pairs) > 0:
+        # share of ENS pairs assigned to the same cluster
+        summary["ens_pair_recall"] = float((labels[idx_pairs[:,0]] == labels[idx_pairs[:,1]]).mean())
+    if verbose:
+        print(summary)
+    return clusters, summary
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from .distance_calculation import compute_dtype, rank_metrics
+from .tornado_mixer import get_deposit_indices
+
+class BlockDistances():
+    """Squared Euclidean distances of the evaluated query rows from every address, stored separately for each feature block of an Address2Vec object.
+
+    Squared distances are additive across blocks, so ranks for any block combination or weighting are calculated by summing the precomputed matrices instead of new distance passes over the representation. Memory usage is (number of queries) x (number of addresses) x (number of blocks) values."""
+    def __init__(self, a2v_obj, query_indices, blocks=None, verbose=True):
+        self.a2v = a2v_obj
+        self.verbose = verbose
+        all_blocks = a2v_obj.get_blocks()
+        if blocks is None:
+            blocks = list(all_blocks.keys())
+        for name in blocks:
+            if not name in all_blocks:
+                raise RuntimeError("Invalid block: %s (available: %s)" % (name, list(all_blocks.keys())))
+        self.blocks = blocks
+        self.query_indices = np.unique(np.asarray(query_indices, dtype="int64"))
+        self.row_of = dict(zip(self.query_indices, range(len(self.query_indices))))
+        self.num_addresses = a2v_obj.X.shape[0]
+        self.sq_dist = {}
+        for name in blocks:
+            self.sq_dist[name] = self._block_sq_dist(all_blocks[name])
+        if self.verbose:
+            print("Precomputed blocks:", [(name, all_blocks[name].shape[1]) for name in blocks])
+            print("Block distance memory (MB): %.2f" % self.memory_usage())
+
+    def _block_sq_dist(self, X_block):
+        dtype = compute_dtype(X_block)
+        X_block = X_block.astype(dtype, copy=False)
+        if np.isnan(X_block).sum() > 0:
+            raise RuntimeError("Representation matrix contains nans!")
+        D = np.empty((len(self.query_indices), self.num_addresses), dtype=dtype)
+        for row, idx in enumerate(self.query_indices):
+            D[row] = np.sum(np.square(X_block - X_block[idx,:]), axis=1)
+        return D
+
+    def memory_usage(self):
+        """Size of the precomputed distances in MB"""
+        return sum(D.nbytes for D in self.sq_dist.values()) / 1024**2
+
+    def _weights(self, weights):
+        if weights is None:
+            weights = self.blocks
+        if not isinstance(weights, dict):
+            weights = dict((name, 1.0) for name in weights)
+        for name in weights:
+            if not name in self.sq_dist:
+                raise RuntimeError("Block was not precomputed: %s" % name)
+        return weights
+
+    def combine(self, weights=None):
+        """Squared distance matrix (query rows x addresses) for the given block weights ({block: weight} or list of blocks with unit weights; every block by default)"""
+        weights = self._weights(weights)
+        D = np.zeros((len(self.query_indices), self.num_addresses), dtype="float64")
+        for name, w in weights.items():
+            if w != 0.0:
+                D += w * self.sq_dist[name]
+        return D
+
+    def get_rank(self, D, query_idx, target_idx, include_idx_mask=[]):
+        """Rank, distance, candidate set size, rank ratio and AUC of the target based on the combined squared distance matrix 'D' (see distance_calculation.rank_metrics)"""
+        rank, sq_dist, set_size, rank_ratio, auc = rank_metrics(D[self.row_of[query_idx]], query_idx, target_idx, include_idx_mask)
+        dist = None if sq_dist is None else float(np.sqrt(max(sq_dist, 0.0)))
+        return rank, dist, set_size, rank_ratio, auc
+
+    def run_ens(self, idx_pairs, model_id, weights=None):
+        """Address2Vec.run_ens for the given block combination"""
+        D = self.combine(weights)
+        records = []
+        for pair in idx_pairs:
+            rank, dist, num_set, rank_ratio, auc = self.get_rank(D, pair[1], pair[0])
+            records.append((pair[1], pair[0], rank, dist, num_set, rank_ratio, auc, "none"))
+        df = pd.DataFrame(records, columns=["query_idx", "target_idx", "rank", "dist", "set_size", "rank_ratio", "auc", "filter"])
+        df["embedding_id"] = model_id
+        df["query_addr"] = df["query_idx"].apply(lambda x: self.a2v.idx2addr[x])
+        df["target_addr"] = df["target_idx"].apply(lambda x: self.a2v.idx2addr[x])
+        return df.drop(["query_idx","target_idx"], axis=1)
+
+    def run_tornado(self, query_objects, model_id, weights=None, filters=["none", "past", "week", "day"], deposit_sets=None):
+        """Address2Vec.run_tornado for the given block combination. Pass 'deposit_sets' from tornado_deposit_sets() to reuse anonymity sets across combinations."""
+        D = self.combine(weights)
+        if deposit_sets is None:
+            deposit_sets = tornado_deposit_sets(self.a2v, query_objects, filters)
+        res = []
+        for tq_idx, tq in enumerate(query_objects):
+            records = []
+            for timestamp, w_idx, d_idx, f_id, d_set_idx, size_1 in deposit_sets[tq_idx]:
+                rank, dist, size_2, rank_ratio, auc = self.get_rank(D, w_idx, d_idx, d_set_idx)
+                records.append((timestamp, w_idx, d_idx, rank, dist, max(size_1, size_2), rank_ratio, auc, f_id))
+            df = pd.DataFrame(records, columns=["timestamp","query_idx","target_idx","rank","dist","set_size","rank_ratio","auc","filter"])
+            df["embedding_id"] = model_id
+            df["mixer"] = tq.mixer_str_value
+            res.append(df)
+        df = pd.concat(res)
+        df["query_addr"] = df["query_idx"].apply(lambda x: self.a2v.idx2addr[x])
+        df["target_addr"] = df["target_idx"].apply(lambda x: self.a2v.idx2addr[x])
+        return df.drop(["query_idx","target_idx"], axis=1)
+
+def tornado_deposit_sets(a2v_obj, query_objects, filters=["none", "past", "week", "day"]):
+    """Anonymity sets of the evaluated Tornado withdrawals for each query object"""
+    deposit_sets = []
+    for tq in query_objects:
+        items = []
+        for tup in tq.tornado_tuples:
+            d_addr, w_addr = tup[0], tup[1]
+            if d_addr in a2v_obj.addr2idx and w_addr in a2v_obj.addr2idx:
+                for f_id in filters:
+                    d_set_idx, size_1 = get_deposit_indices(a2v_obj, tq, tup, f_id)
+                    items.append((tup[3], a2v_obj.addr2idx[w_addr], a2v_obj.addr2idx[d_addr], f_id, d_set_idx, size_1))
+        deposit_sets.append(items)
+    return deposit_sets
+
+def tornado_query_indices(deposit_sets):
+    return [item[1] for items in deposit_sets for item in items]
+
+def block_combinations(blocks):
+    """Every non-empty block subset as {block: 1.0} weights keyed by the joined block names"""
+    combinations = {}
+    for mask in range(1, 2**len(blocks)):
+        subset = [name for i, name in enumerate(blocks) if mask & (1 << i)]
+        combinations["+".join(subset)] = dict((name, 1.0) for name in subset)
+    return combinations
+
+def run_block_sweep(a2v_obj, combinations, idx_pairs=None, query_objects=[], filters=["none", "past", "week", "day"], verbose=True):
+    """Evaluate ENS pairs and Tornado heuristics for each {model_id: block weights} combination with a single distance precomputation"""
+    deposit_sets = tornado_deposit_sets(a2v_obj, query_objects, filters)
+    query_indices = tornado_query_indices(deposit_sets)
+    if idx_pairs is not None:
+        query_indices += [pair[1] for pair in idx_pairs]
+    blocks = sorted(set(name for weights in combinations.values() for name in weights), key=[name for name, _ in a2v_obj.block_dims].index)
+    bd = BlockDistances(a2v_obj, query_indices, blocks=blocks, verbose=verbose)
+    ens_res, tornado_res = [], []
+    for model_id, weights in combinations.items():
+        if idx_pairs is not None:
+            ens_res.append(bd.run_ens(idx_pairs, model_id, weights))
+        if len(query_objects) > 0:
+            tornado_res.append(bd.run_tornado(query_objects, model_id, weights, filters, deposit_sets))
+    ens_df = pd.concat(ens_res) if len(ens_res) > 0 else None
+    tornado_df = pd.concat(tornado_res) if len(tornado_res) > 0 else None
+    return ens_df, tornado_df
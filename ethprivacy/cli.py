@@ -0,0 +1,156 @@
+import argparse
+import os
+import sys
+
+# Only the standard library is imported here. Subcommands import the package modules (and their plotting, embedding or progress bar dependencies) when they are executed.
+
+def _preprocess(args):
+    from .preprocessing import preprocess
+    preprocess(args.data_dir, args.results_dir, export_figs=not args.no_figs)
+
+def _heuristics(args):
+    from .entity_api import EntityAPI
+    from .tornado_heuristics import compute_heuristics
+    api = EntityAPI(args.data_dir, lazy=True, compact=True)
+    output_dir = args.output_dir if args.output_dir is not None else os.path.join(args.results_dir, "heuristics")
+    compute_heuristics(api, args.data_dir, output_folder=output_dir, overwrite=args.overwrite)
+
+def _train_embedding(args):
+    from .experiments import train_node_embeddings
+    sample_ids = args.sample_ids if args.sample_ids is not None else range(args.num_samples)
+    train_node_embeddings(args.data_dir, args.results_dir, args.algos.split(","), args.exclude_tornado, sample_ids, workers=args.workers, cpu_budget=args.cpu_budget, memory_budget_mb=args.memory_budget_mb, dim=args.dim, nwalks=args.nwalks, reseed=args.reseed)
+
+def _run_experiment(args):
+    from . import experiments
+    func = experiments.run_ens_experiment if args.command == "run-ens" else experiments.run_tornado_experiment
+    if args.algo is not None:
+        func(args.data_dir, args.results_dir, None, None, args.algo, args.sample_id, args.shard_dir, args.num_workers, args.sample_size, args.num_candidates, args.seed)
+    else:
+        func(args.data_dir, args.results_dir, args.hour_bins, args.gas_bins, None, None, args.shard_dir, args.num_workers, args.sample_size, args.num_candidates, args.seed)
+
+def _sweep(args):
+    from .experiments import run_sweep
+    run_sweep(args.data_dir, args.results_dir, args.task, args.hour_bins, args.gas_bins, args.sample_size, args.seed)
+
+def _fuse(args):
+    from .experiments import run_fusion_experiment
+    run_fusion_experiment(args.data_dir, args.results_dir, args.task, args.representations, args.fusions.split(","), args.rrf_k)
+
+def _daemon(args):
+    from .job_daemon import JobDaemon
+    JobDaemon(args.queue_dir, args.data_dir, args.results_dir, max_jobs=args.max_jobs, preload_graphs=args.preload_graphs, poll_interval=args.poll_interval, load_jobs=args.load_jobs).run()
+
+def _submit(args):
+    from .job_daemon import JobQueue
+    print(JobQueue(args.queue_dir).submit(args.job))
+
+def _status(args):
+    from .job_daemon import JobQueue
+    queue = JobQueue(args.queue_dir)
+    jobs = queue.status(args.job_id)
+    if args.job_id is not None and len(jobs) == 0:
+        raise RuntimeError("Unknown job: %s" % args.job_id)
+    for state, job in jobs:
+        print("%s\t%s\t%s" % (job["id"], state, " ".join(job["argv"])))
+    if args.job_id is not None and os.path.exists(queue.log_path(args.job_id)):
+        print("--- %s ---" % queue.log_path(args.job_id))
+        with open(queue.log_path(args.job_id)) as f:
+            print("".join(f.readlines()[-args.tail:]), end="")
+
+def _stop(args):
+    from .job_daemon import JobQueue
+    JobQueue(args.queue_dir).request_stop()
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ethprivacy", description="Profiling and Deanonymizing Ethereum Users")
+    parser.add_argument("--data-dir", default="data", help="Folder of the downloaded data (default: data)")
+    parser.add_argument("--results-dir", default="results", help="Folder of the preprocessed data and results (default: results)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    p = subparsers.add_parser("preprocess", help="Prepare side channel events of the addresses of interest")
+    p.add_argument("--no-figs", action="store_true", help="Do not export distribution figures")
+    p.set_defaults(func=_preprocess)
+
+    p = subparsers.add_parser("heuristics", help="Compute Tornado withdraw-deposit heuristics from the mixer histories and transactions")
+    p.add_argument("--output-dir", default=None, help="Folder of the heuristics files (default: <results-dir>/heuristics)")
+    p.add_argument("--overwrite", action="store_true", help="Replace existing heuristics files (e.g. the published ones with --output-dir data)")
+    p.set_defaults(func=_heuristics)
+
+    p = subparsers.add_parser("train-embedding", help="Train node embeddings for multiple samples in parallel")
+    p.add_argument("algos", help="Comma separated list of karateclub models (e.g. role2vec,diff2vec)")
+    p.add_argument("--exclude-tornado", action="store_true", help="Remove Tornado heuristic edges from the graph")
+    p.add_argument("--num-samples", type=int, default=1)
+    p.add_argument("--sample-ids", nargs="+", default=None, help="Train only the given sample ids")
+    p.add_argument("--workers", type=int, default=1, help="Cores of a single training job")
+    p.add_argument("--cpu-budget", type=int, default=None)
+    p.add_argument("--memory-budget-mb", type=float, default=None)
+    p.add_argument("--dim", type=int, default=128)
+    p.add_argument("--nwalks", type=int, default=10)
+    p.add_argument("--reseed", action="store_true", help="Seed each sample with its sample id instead of the default seed of karateclub (evaluate them with --sample-id seed<sample_id>)")
+    p.set_defaults(func=_train_embedding)
+
+    for command, task in [("run-ens", "ENS address pairs"), ("run-tornado", "Tornado withdraw-deposit heuristics")]:
+        p = subparsers.add_parser(command, help="Evaluate a representation for %s" % task)
+        p.add_argument("--hour-bins", type=int, default=6, help="Time of day bins (-1 disables this side channel)")
+        p.add_argument("--gas-bins", type=int, default=-1, help="Gas price bins (-1 disables this side channel)")
+        p.add_argument("--algo", default=None, help="Evaluate a node embedding instead of side channels")
+        p.add_argument("--sample-id", default=None)
+        p.add_argument("--shard-dir", default=None, help="Checkpoint results in shards in this (possibly shared) folder")
+        p.add_argument("--num-workers", type=int, default=1)
+        p.add_argument("--sample-size", type=int, default=None, help="Estimate the performance from a stratified sample of queries")
+        p.add_argument("--num-candidates", type=int, default=None, help="Estimate unfiltered ranks from a sample of candidates (with --sample-size)")
+        p.add_argument("--seed", type=int, default=None)
+        p.set_defaults(func=_run_experiment)
+
+    p = subparsers.add_parser("sweep", help="Evaluate every feature block combination of a side channel representation")
+    p.add_argument("task", choices=["ens", "tornado"])
+    p.add_argument("--hour-bins", type=int, default=6)
+    p.add_argument("--gas-bins", type=int, default=50)
+    p.add_argument("--sample-size", type=int, default=None, help="Estimate the performance from a stratified sample of queries")
+    p.add_argument("--seed", type=int, default=None)
+    p.set_defaults(func=_sweep)
+
+    p = subparsers.add_parser("fuse", help="Evaluate several representations and their fused rankings in a single pass")
+    p.add_argument("task", choices=["ens", "tornado"])
+    p.add_argument("representations", nargs="+", help="'side:<hour_bins>,<gas_bins>' for side channels (e.g. side:6,-1) or '<algo>:<sample_id>' for node embeddings")
+    p.add_argument("--fusions", default="rrf,score", help="Comma separated fusion methods (rrf, score)")
+    p.add_argument("--rrf-k", type=int, default=60, help="Rank offset of reciprocal rank fusion")
+    p.set_defaults(func=_fuse)
+
+    p = subparsers.add_parser("daemon", help="Load the data once and run submitted jobs in forked workers")
+    p.add_argument("queue_dir", help="Folder of the job queue and the job logs")
+    p.add_argument("--max-jobs", type=int, default=2, help="Number of concurrent jobs")
+    p.add_argument("--preload-graphs", action="store_true", help="Build the transaction graphs before forking the workers")
+    p.add_argument("--poll-interval", type=float, default=0.5)
+    p.add_argument("--load-jobs", type=int, default=1, help="Parallel workers for loading the tables and building the graphs")
+    p.set_defaults(func=_daemon)
+
+    p = subparsers.add_parser("submit", help="Submit a job to a daemon (e.g. submit queue run-ens --hour-bins 6)")
+    p.add_argument("queue_dir")
+    p.add_argument("job", nargs=argparse.REMAINDER, help="Subcommand and its arguments")
+    p.set_defaults(func=_submit)
+
+    p = subparsers.add_parser("status", help="Show the state of the submitted jobs or the log of a job")
+    p.add_argument("queue_dir")
+    p.add_argument("job_id", nargs="?", default=None)
+    p.add_argument("--tail", type=int, default=20, help="Number of log lines to show")
+    p.set_defaults(func=_status)
+
+    p = subparsers.add_parser("stop", help="Stop a daemon after its running jobs are finished")
+    p.add_argument("queue_dir")
+    p.set_defaults(func=_stop)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+    if args.command in ["run-ens", "run-tornado"] and args.algo is not None and args.sample_id is None:
+        parser.error("--sample-id is required for node embeddings")
+    args.func(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
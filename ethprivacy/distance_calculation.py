@@ -4,14 +4,23 @@ import pandas as pd
 def euclidean_dist(a, b):
     return np.sqrt(np.sum(np.square(a-b)))
 
+def compute_dtype(X):
+    """Distances are calculated in float32 for float16 representations and in the precision of the representation otherwise"""
+    return np.dtype("float32") if X.dtype == np.float16 else X.dtype
+
+def query_distances(X, idx):
+    """Euclidean distance of every row of the representation matrix from the given row"""
+    dtype = compute_dtype(X)
+    diff = X.astype(dtype, copy=False) - X[idx,:].astype(dtype)
+    return np.sqrt(np.sum(np.square(diff), axis=1))
+
 def nearest_neighbors(idx, X):
     if np.isnan(X).sum() > 0:
         raise RuntimeError("Representation matrix contains nans!")
-    a = X[idx,:]
     indices = list(range(X.shape[0]))
     # exclude self distance
     indices.remove(idx)
-    dist = np.array([euclidean_dist(a, X[i,:]) for i in indices])
+    dist = query_distances(X, idx)[indices]
     sorted_df = pd.DataFrame(list(zip(indices, dist)), columns=["idx","dist"]).sort_values("dist")
     return list(sorted_df["idx"]), list(sorted_df["dist"])
 
@@ -28,10 +37,43 @@ def get_neighbors(X, idx, include_idx_mask=[]):
         distances = distances_tmp
     return indices, distances 
 
+def rank_metrics(dist, query_idx, target_idx, include_idx_mask=[]):
+    """Rank, rank ratio and AUC of the target based on the distances of every address from the query. Candidates (the query excluded) are only counted as closer, tied or farther than the target, so no sorting is needed. Tied candidates precede the target in index order (as in a stable sort of the candidates)."""
+    if np.isnan(dist).sum() > 0:
+        raise RuntimeError("Representation matrix contains nans!")
+    if len(include_idx_mask) > 0:
+        in_set = np.zeros(len(dist), dtype=bool)
+        in_set[np.asarray(include_idx_mask, dtype="int64")] = True
+    else:
+        in_set = np.ones(len(dist), dtype=bool)
+    in_set[query_idx] = False
+    set_size = int(in_set.sum())
+    if not in_set[target_idx]:
+        return None, None, set_size, None, None
+    target_dist = dist[target_idx]
+    closer = int(np.sum(in_set & (dist < target_dist)))
+    # the target itself is tied
+    ties = int(np.sum(in_set & (dist == target_dist))) - 1
+    ties_before = int(np.sum(in_set[:target_idx] & (dist[:target_idx] == target_dist)))
+    farther = set_size - 1 - closer - ties
+    rank = 1 + closer + ties_before
+    auc = (farther + 0.5 * ties) / (set_size - 1) if set_size > 1 else None
+    return rank, target_dist, set_size, rank / set_size, auc
+
 def get_rank(X, query_idx, target_idx, include_idx_mask=[]):
-    indices, distances = get_neighbors(X, query_idx, include_idx_mask)
-    if len(indices) > 0 and target_idx in indices:
-        trg_idx = indices.index(target_idx)
-        return trg_idx+1, distances[trg_idx], len(indices)
+    rank, dist, set_size, _, _ = rank_metrics(query_distances(X, query_idx), query_idx, target_idx, include_idx_mask)
+    return rank, dist, set_size
+
+def tie_rank_interval(X, query_idx, target_idx, include_idx_mask=[], rtol=1e-5):
+    """Range of ranks that the target can take if distances within relative tolerance 'rtol' of the target distance are considered as ties"""
+    dist = query_distances(X, query_idx)
+    if len(include_idx_mask) > 0:
+        candidates = np.array([idx for idx in set(include_idx_mask) if idx != query_idx])
     else:
-        return None, None, len(indices)
\ No newline at end of file
+        candidates = np.array([idx for idx in range(X.shape[0]) if idx != query_idx])
+    if not target_idx in set(candidates):
+        return None, None
+    target_dist = dist[target_idx]
+    lower = 1 + int(np.sum(dist[candidates] < target_dist * (1.0 - rtol)))
+    upper = int(np.sum(dist[candidates] <= target_dist * (1.0 + rtol)))
+    return lower, upper
\ No newline at end of file
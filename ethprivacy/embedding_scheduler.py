@@ -0,0 +1,90 @@
+import os
+import time
+import random
+import multiprocessing
+import numpy as np
+from .node_embeddings import karate_factory, embedding_file_name
+from .schema import peak_rss_mb
+
+def _train_job(ne, algo, dim, nwalks, workers, seed, output_path, queue):
+    if seed is not None:
+        # forked jobs inherit the random state of the parent
+        random.seed(seed)
+        np.random.seed(seed)
+    karate_obj = karate_factory(algo, dim, nwalks, workers, seed=seed)
+    embedding = ne.fit(karate_obj)
+    tmp_path = "%s.%i.tmp" % (output_path, os.getpid())
+    embedding.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+    queue.put((output_path, peak_rss_mb()))
+
+class EmbeddingScheduler():
+    """Train node embeddings for multiple (algorithm, sample id) jobs concurrently on the same preprocessed graph.
+
+    Jobs run in forked processes that share the loaded NodeEmbedder graph. At most 'cpu_budget' cores are used ('workers' cores per job). If 'memory_budget_mb' is set, the first job runs alone to measure its peak memory usage (shared pages included, so the estimate is conservative), and further jobs are only started while the estimated total stays within the budget. Finished embeddings are skipped on re-runs. By default every job is trained with the default seed of karateclub (like scripts/train_node_embedding.py). With 'reseed' each job seeds karateclub, random and numpy with its sample id, and the embeddings are stored in separate 'seed<sample_id>' sample folders."""
+    def __init__(self, ne, output_dir, dim=128, nwalks=10, workers=1, cpu_budget=None, memory_budget_mb=None, reseed=False, verbose=True):
+        self.ne = ne
+        self.output_dir = output_dir
+        self.dim = dim
+        self.nwalks = nwalks
+        self.workers = workers
+        self.cpu_budget = cpu_budget if cpu_budget is not None else os.cpu_count()
+        self.memory_budget_mb = memory_budget_mb
+        self.reseed = reseed
+        self.verbose = verbose
+        self.job_memory_mb = None
+        self.max_parallel = max(1, self.cpu_budget // self.workers)
+
+    def output_path(self, algo, sample_id):
+        sample_dir = "seed%s" % sample_id if self.reseed else str(sample_id)
+        return os.path.join(self.output_dir, sample_dir, embedding_file_name(algo, self.dim, self.nwalks))
+
+    def _fits(self, num_running):
+        if num_running >= self.max_parallel:
+            return False
+        if self.memory_budget_mb is None or num_running == 0:
+            return True
+        if self.job_memory_mb is None:
+            # wait for the memory usage of the first job
+            return False
+        return (num_running + 1) * self.job_memory_mb <= self.memory_budget_mb
+
+    def run(self, jobs):
+        """Train every unfinished (algo, sample_id) job and return the number of trained embeddings"""
+        pending = [(algo, sample_id) for algo, sample_id in jobs if not os.path.exists(self.output_path(algo, sample_id))]
+        if self.verbose:
+            print("Embedding jobs: %i (%i finished earlier)" % (len(pending), len(jobs) - len(pending)))
+        ctx = multiprocessing.get_context("fork")
+        queue = ctx.Queue()
+        running = {}
+        finished = 0
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and self._fits(len(running)):
+                algo, sample_id = pending.pop(0)
+                output_path = self.output_path(algo, sample_id)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                seed = int(sample_id) if self.reseed else None
+                proc = ctx.Process(target=_train_job, args=(self.ne, algo, self.dim, self.nwalks, self.workers, seed, output_path, queue))
+                proc.start()
+                running[proc] = (algo, sample_id, time.time())
+                if self.verbose:
+                    print("Started %s %s (running: %i)" % (algo, sample_id, len(running)))
+            while not queue.empty():
+                _, peak_mb = queue.get()
+                self.job_memory_mb = peak_mb if self.job_memory_mb is None else max(self.job_memory_mb, peak_mb)
+            for proc in list(running.keys()):
+                if proc.is_alive():
+                    continue
+                proc.join()
+                algo, sample_id, start = running.pop(proc)
+                if proc.exitcode != 0:
+                    for other in running:
+                        other.terminate()
+                    raise RuntimeError("Training %s %s failed with exit code %i" % (algo, sample_id, proc.exitcode))
+                finished += 1
+                if self.verbose:
+                    print("Finished %s %s in %.1f seconds" % (algo, sample_id, time.time() - start))
+            time.sleep(0.05)
+        if self.verbose and self.job_memory_mb is not None:
+            print("Peak memory usage of a job: %.1f MB" % self.job_memory_mb)
+        return finished
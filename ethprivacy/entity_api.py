@@ -1,6 +1,11 @@
+import multiprocessing
 import pandas as pd
 import networkx as nx
+from concurrent.futures import ThreadPoolExecutor
 from .topic_analysis import addresses_of_interest
+from .schema import read_table, memory_footprint
+from .tx_store import TxStore, TimeIndex
+from .tornado_history import get_history_store
 
 class GraphFactory():
     def __init__(self, txs_df, source_col, target_col):
@@ -39,10 +44,15 @@ class GraphFactory():
         out_neighbors = dict(out_links.groupby("src")["trg"].apply(set))
         return in_neighbors, out_neighbors
 
-def dataframe_time_filter(df, min_time, max_time):
+def dataframe_time_filter(df, min_time, max_time, time_index=None):
+    """Select records of the given time interval. Only the relevant day partitions are read from a TxStore, and records are selected with binary search if a TimeIndex of the DataFrame is given."""
+    if isinstance(df, TxStore):
+        return df.read(min_time, max_time)
     check_min = (min_time != None)
     check_max = (max_time != None)
     if check_min or check_max:
+        if time_index is not None:
+            return df.iloc[time_index.positions(min_time, max_time)]
         tmp = df.copy()
         if check_min:
             tmp = tmp[tmp["timeStamp"] >= min_time]
@@ -67,81 +77,195 @@ def filter_tx_df(df, api, address_filter, hash_to_remove=[]):
         print("removed %i hashes" % len(hash_to_remove))
     return tmp_df
     
+# API object of the graphs built by forked workers (see EntityAPI._init_graphs)
+_GRAPH_API = None
+
+def _build_graph(name):
+    return _GRAPH_API._build_graph(name)
+
 class EntityAPI():
-    def __init__(self, data_dir, only_pos_tx=False, address_filter="aoi", hash_to_remove=[], verbose=False):
+    # graph name -> (transaction table, source column, target column)
+    graph_endpoints = {
+        "normal_graph": ("normal_txs", "from", "to"),
+        "token_graph": ("token_txs", "from", "to"),
+        "contract_graph": ("token_txs", "from", "contractAddress"),
+        "rev_contract_graph": ("token_txs", "contractAddress", "to"),
+    }
+    
+    def __init__(self, data_dir, only_pos_tx=False, address_filter="aoi", hash_to_remove=[], verbose=False, lazy=False, compact=False, store_dir=None, n_jobs=1):
         self.verbose = verbose
         self.data_dir = data_dir
         self.address_filter = address_filter
         self.hash_to_remove = hash_to_remove
         self.only_pos_tx = only_pos_tx
+        self.lazy = lazy
+        self.compact = compact
+        self.store_dir = store_dir
+        # with n_jobs > 1 tables are loaded by threads and graphs are built by forked processes (the result is the same as with n_jobs=1)
+        self.n_jobs = n_jobs
+        self._time_indices = {}
+        self._temporal_indices = {}
         self.max_ens_per_address = 1
-        self.ens_pairs = pd.read_csv("%s/all_ens_pairs.csv" % data_dir)
-        if "Unnamed: 0" in self.ens_pairs.columns:
-            self.ens_pairs.drop("Unnamed: 0", axis=1, inplace=True)
-        self.normal_txs = pd.read_csv("%s/raw_normal_txs.csv" % data_dir)
-        self.token_txs = pd.read_csv("%s/raw_token_txs.csv" % data_dir)
-        self._clean()
+        self._graphs = {}
+        self._summary = None
+        self._load_tables()
         self.address2ens = dict(zip(self.ens_pairs["address"], self.ens_pairs["name"]))
-        self._init_graphs()
-        self.info()
+        # with lazy=True graphs and summary statistics are only calculated on first access
+        if not self.lazy:
+            self._init_graphs()
+            self.info()
+            
+    def _read(self, file_name, table):
+        """Load every column with default type inference or only the declared columns with compact dtypes (compact=True, used by the experiment pipeline). Transactions are loaded from the day partitioned store if 'store_dir' is set."""
+        if self.store_dir is not None and file_name in ["raw_normal_txs", "raw_token_txs"]:
+            store = TxStore(self.store_dir, file_name.replace("raw_", ""), verbose=self.verbose)
+            return store.read_table() if self.compact else store.read().reset_index(drop=True)
+        file_path = "%s/%s.csv" % (self.data_dir, file_name)
+        if self.compact:
+            return read_table(file_path, table)
+        else:
+            return pd.read_csv(file_path)
+            
+    def memory_footprint(self):
+        """Memory usage (in MB) of the loaded tables"""
+        return memory_footprint({"ens_pairs": self.ens_pairs, "normal_txs": self.normal_txs, "token_txs": self.token_txs, "events": self.events})
+            
+    @property
+    def normal_graph(self):
+        return self._get_graph("normal_graph")
+    
+    @property
+    def token_graph(self):
+        return self._get_graph("token_graph")
+    
+    @property
+    def contract_graph(self):
+        return self._get_graph("contract_graph")
+    
+    @property
+    def rev_contract_graph(self):
+        return self._get_graph("rev_contract_graph")
         
-    def info(self):
+    def _build_graph(self, name):
+        table, source_col, target_col = self.graph_endpoints[name]
+        if self.verbose:
+            print("Building %s" % name)
+        return GraphFactory(getattr(self, table), source_col, target_col)
+
+    def _get_graph(self, name):
+        """Build the given transaction graph on first access"""
+        if not name in self._graphs:
+            self._graphs[name] = self._build_graph(name)
+        return self._graphs[name]
+        
+    def summary(self):
+        """Calculate summary statistics of the collected events (only once)"""
+        if self._summary is None:
+            events = self.events
+            accounts = pd.concat([events["from"], events["to"]]).nunique()
+            self._summary = {
+                "num_ens_names": self.ens_pairs["name"].nunique(),
+                "num_events": len(events),
+                "num_hashes": events["hash"].nunique(),
+                "num_accounts": accounts,
+                "min_time": pd.to_datetime(events["timeStamp"].min(), unit='s'),
+                "max_time": pd.to_datetime(events["timeStamp"].max(), unit='s'),
+            }
+        return self._summary
+        
+    def info(self, with_graphs=True):
         """Show colleted data size"""
         print("ens_pairs", self.ens_pairs.shape)
         print("normal_txs", self.normal_txs.shape)
         print("token_txs", self.token_txs.shape)
-        print("normal_graph", self.normal_graph.info())
-        print("token_graph", self.token_graph.info())
-        print("contract_graph", self.contract_graph.info())
-        print("rev_contract_graph", self.rev_contract_graph.info())
-        print("Number of unique ENS names:", len(self.ens_pairs["name"].unique()))
-        print("Number of Etherscan events:", len(self.events))
-        print("Number of unique tx hashes:", len(self.events["hash"].unique()))
-        print("Number of accounts:", len(set(self.events["from"]).union(set(self.events["to"]))))
-        print("min time", pd.to_datetime(self.events["timeStamp"].min(), unit='s'))
-        print("max time", pd.to_datetime(self.events["timeStamp"].max(), unit='s'))
+        if with_graphs:
+            for name in self.graph_endpoints:
+                print(name, self._get_graph(name).info())
+        stats = self.summary()
+        print("Number of unique ENS names:", stats["num_ens_names"])
+        print("Number of Etherscan events:", stats["num_events"])
+        print("Number of unique tx hashes:", stats["num_hashes"])
+        print("Number of accounts:", stats["num_accounts"])
+        print("min time", stats["min_time"])
+        print("max time", stats["max_time"])
         
-    def _clean(self):
+    def _load_tables(self):
+        """Load and clean the ENS pairs and the transaction tables. With n_jobs > 1 the transaction tables are loaded and cleaned by parallel threads."""
+        self.ens_pairs = self._read("all_ens_pairs", "ens_pairs")
+        if "Unnamed: 0" in self.ens_pairs.columns:
+            self.ens_pairs.drop("Unnamed: 0", axis=1, inplace=True)
+        tables = [("raw_normal_txs", ["from","to"]), ("raw_token_txs", ["from","to","contractAddress"])]
+        if self.n_jobs > 1:
+            with ThreadPoolExecutor(max_workers=min(self.n_jobs, len(tables))) as executor:
+                futures = [executor.submit(self._read, file_name, file_name) for file_name, _ in tables]
+                # prepare the addresses of interest while the transactions are loaded
+                self._clean_ens()
+                get_history_store(self.data_dir).accounts()
+                futures = [executor.submit(self._clean_txs, future.result(), cols) for future, (_, cols) in zip(futures, tables)]
+                (self.normal_txs, old_normal_size), (self.token_txs, old_token_size) = [future.result() for future in futures]
+        else:
+            normal_txs = self._read("raw_normal_txs", "raw_normal_txs")
+            token_txs = self._read("raw_token_txs", "raw_token_txs")
+            self._clean_ens()
+            self.normal_txs, old_normal_size = self._clean_txs(normal_txs, tables[0][1])
+            self.token_txs, old_token_size = self._clean_txs(token_txs, tables[1][1])
+        if self.verbose:
+            print("Normal", len(self.normal_txs) / old_normal_size, "Token", len(self.token_txs) / old_token_size)
+        self.token_txs["tx_type"] = "token"
+        cols = list(self.normal_txs.columns)
+        cols.remove("isError")
+        self.events = pd.concat([self.normal_txs[cols], self.token_txs[cols]]).sort_values("timeStamp")
+
+    def _clean_ens(self):
         # lowercasing
         for col in ["name","address"]:
             self.ens_pairs[col] = self.ens_pairs[col].str.lower()
-        for col in ["from","to"]:
-            self.normal_txs[col] = self.normal_txs[col].str.lower()
-            self.token_txs[col] = self.token_txs[col].str.lower()
-        self.token_txs["contractAddress"] = self.token_txs["contractAddress"].str.lower()
-        # exclude zero value txs
-        if self.only_pos_tx:
-            self.normal_txs = self.normal_txs[self.normal_txs["value"] > 0]
-            self.token_txs = self.token_txs[self.token_txs["value"] > 0]
         # exclude addresses with multiple ENS names
         num_ens_for_addr = self.ens_pairs.groupby("address")["name"].nunique().sort_values(ascending=False).reset_index()
         excluded = list(num_ens_for_addr[num_ens_for_addr["name"] > self.max_ens_per_address]["address"])
         self.ens_pairs = self.ens_pairs[~self.ens_pairs["address"].isin(excluded)]
         if self.verbose:
             print("Number of addresses excluded from ens pairs: %i" % len(set(excluded)))
-        old_normal_size = len(self.normal_txs)
-        old_token_size = len(self.token_txs)
-        self.normal_txs = filter_tx_df(self.normal_txs, self, self.address_filter, self.hash_to_remove)
-        self.token_txs = filter_tx_df(self.token_txs, self, self.address_filter, self.hash_to_remove)
-        if self.verbose:
-            print("Normal", len(self.normal_txs) / old_normal_size, "Token", len(self.token_txs) / old_token_size)
-        self.token_txs["tx_type"] = "token"
-        cols = list(self.normal_txs.columns)
-        cols.remove("isError")
-        self.events = pd.concat([self.normal_txs[cols], self.token_txs[cols]]).sort_values("timeStamp")
-            
+
+    def _clean_txs(self, df, address_cols):
+        """Transactions of the addresses of interest with lowercased addresses (and the number of transactions before the address filter)"""
+        # lowercasing
+        for col in address_cols:
+            df[col] = df[col].str.lower()
+        # exclude zero value txs
+        if self.only_pos_tx:
+            df = df[df["value"] > 0]
+        return filter_tx_df(df, self, self.address_filter, self.hash_to_remove), len(df)
+
     def _init_graphs(self):
-        self.normal_graph = GraphFactory(self.normal_txs, "from", "to")
-        self.token_graph = GraphFactory(self.token_txs, "from", "to")
-        self.contract_graph = GraphFactory(self.token_txs, "from", "contractAddress")
-        self.rev_contract_graph = GraphFactory(self.token_txs, "contractAddress", "to")
-        
+        """Build every transaction graph. With n_jobs > 1 the graphs are built by forked processes (sharing the loaded tables) while this process builds the first one."""
+        names = [name for name in self.graph_endpoints if not name in self._graphs]
+        if self.n_jobs > 1 and len(names) > 1:
+            global _GRAPH_API
+            _GRAPH_API = self
+            try:
+                with multiprocessing.get_context("fork").Pool(min(self.n_jobs - 1, len(names) - 1)) as pool:
+                    result = pool.map_async(_build_graph, names[1:])
+                    graphs = [self._build_graph(names[0])] + result.get()
+            finally:
+                _GRAPH_API = None
+            self._graphs.update(zip(names, graphs))
+        # graphs are stored in the order of graph_endpoints just like in the serial case
+        self._graphs = dict((name, self._get_graph(name)) for name in self.graph_endpoints)
+
     def _mask(self, address_list):
         hits = set(address_list).intersection(set(self.address2ens.keys()))
         return set(self.address2ens[addr] for addr in hits)
         
+    def _get_time_index(self, table):
+        if not table in self._time_indices:
+            self._time_indices[table] = TimeIndex(getattr(self, table)["timeStamp"].values)
+        return self._time_indices[table]
+        
     def _time_filter(self, min_time, max_time):
-        return dataframe_time_filter(self.normal_txs, min_time, max_time), dataframe_time_filter(self.token_txs, min_time, max_time)
+        if min_time == None and max_time == None:
+            return self.normal_txs, self.token_txs
+        return dataframe_time_filter(self.normal_txs, min_time, max_time, self._get_time_index("normal_txs")), dataframe_time_filter(self.token_txs, min_time, max_time, self._get_time_index("token_txs"))
         
     def ens_addresses(self, ens_name):
         """Get every address that is related to the given ENS name"""
@@ -221,6 +345,21 @@ class EntityAPI():
                     res[addr][key] = self._mask(res[addr][key])
         return res
     
+    def temporal_index(self, graphs=["normal_graph", "token_graph", "contract_graph", "rev_contract_graph"]):
+        """Timestamped adjacency of the given transaction graphs for multi-hop queries (built on first access)"""
+        key = tuple(graphs)
+        if not key in self._temporal_indices:
+            from .temporal_graph import TemporalGraphIndex
+            self._temporal_indices[key] = TemporalGraphIndex(self, graphs, verbose=self.verbose)
+        return self._temporal_indices[key]
+
+    def multi_hop_neighbors(self, address_list, hops=2, direction="out", start_time=None, min_time=None, max_time=None, min_gap=0, max_gap=None, max_edges_per_node=None, max_results=100000, targets=None, graphs=["normal_graph", "token_graph", "contract_graph", "rev_contract_graph"], ens_result=False):
+        """Get the addresses reachable from the given addresses by time-respecting transaction paths of at most 'hops' hops (see TemporalGraphIndex.multi_hop)"""
+        res = self.temporal_index(graphs).multi_hop(address_list, hops=hops, direction=direction, start_time=start_time, min_time=min_time, max_time=max_time, min_gap=min_gap, max_gap=max_gap, max_edges_per_node=max_edges_per_node, max_results=max_results, targets=targets)
+        if ens_result:
+            res["ens"] = res["address"].apply(lambda addr: self.address2ens.get(addr))
+        return res
+
     def topic_neighbors(self, address_list, selected_addr_info, result_type="topic"):
         """Get the topic of transaction neighbor addresses. More detailed output is given in case of result_type='name'."""
         topic_map = dict(zip(selected_addr_info["address"], selected_addr_info["topic"]))
@@ -1,6 +1,7 @@
 import os
 import pandas as pd
-import matplotlib.pyplot as plt
+from .distance_calculation import get_rank, tie_rank_interval
+from .tornado_mixer import get_deposit_indices
 
 ### Rank ###
 
@@ -16,4 +17,49 @@ def get_avg_rank(df, keys=["embedding_id", "filter"]):
     mean_result = df.groupby(["query_addr", "target_addr"]+keys)[target_cols].mean().reset_index()
     # aggregate for address pairs
     perf = mean_result.groupby(keys)[target_cols].mean().reset_index()
-    return perf, mean_result
\ No newline at end of file
+    return perf, mean_result
+
+def compare_ranks(df_a, df_b, keys=["query_addr", "target_addr", "filter"]):
+    """Compare the ranks of two evaluation results (e.g. run_ens outputs of two representations) for the same queries"""
+    merged = df_a[keys+["rank"]].merge(df_b[keys+["rank"]], on=keys, suffixes=("_a","_b"))
+    merged = merged.dropna()
+    diff = merged["rank_b"] - merged["rank_a"]
+    return {
+        "num_queries": len(merged),
+        "mean_rank_a": merged["rank_a"].mean(),
+        "mean_rank_b": merged["rank_b"].mean(),
+        "rank_corr": merged["rank_a"].corr(merged["rank_b"], method="spearman"),
+        "mean_abs_diff": diff.abs().mean(),
+        "better": int((diff < 0).sum()),
+        "worse": int((diff > 0).sum()),
+    }
+
+### Precision ###
+
+def rank_stability(a2v_obj, dtype="float32", idx_pairs=None, query_objects=[], filters=["none", "past", "week", "day"], rtol=1e-4):
+    """Compare ENS and Tornado ranks of a reduced precision representation against the original one (in the dtype of a2v_obj.X). Rank changes inside the tie interval of the original distances (relative tolerance 'rtol') are considered stable."""
+    low_obj = a2v_obj.astype(dtype)
+    queries = []
+    if idx_pairs is not None:
+        for pair in idx_pairs:
+            queries.append(("ens", "none", pair[1], pair[0], []))
+    for tq in query_objects:
+        for tup in tq.tornado_tuples:
+            d_addr, w_addr = tup[0], tup[1]
+            if d_addr in a2v_obj.addr2idx and w_addr in a2v_obj.addr2idx:
+                for f_id in filters:
+                    d_set_idx, _ = get_deposit_indices(a2v_obj, tq, tup, f_id)
+                    queries.append(("tornado_%s" % tq.mixer_str_value, f_id, a2v_obj.addr2idx[w_addr], a2v_obj.addr2idx[d_addr], d_set_idx))
+    records = []
+    for task, f_id, query_idx, target_idx, mask in queries:
+        rank, _, _ = get_rank(a2v_obj.X, query_idx, target_idx, mask)
+        low_rank, _, _ = get_rank(low_obj.X, query_idx, target_idx, mask)
+        lower, upper = tie_rank_interval(a2v_obj.X, query_idx, target_idx, mask, rtol)
+        records.append((task, f_id, a2v_obj.idx2addr[query_idx], a2v_obj.idx2addr[target_idx], rank, low_rank, lower, upper))
+    df = pd.DataFrame(records, columns=["task", "filter", "query_addr", "target_addr", "rank", "rank_%s" % dtype, "rank_min", "rank_max"])
+    low_col = "rank_%s" % dtype
+    df["changed"] = df["rank"].fillna(-1) != df[low_col].fillna(-1)
+    df["stable"] = (df["rank"].isnull() & df[low_col].isnull()) | ((df[low_col] >= df["rank_min"]) & (df[low_col] <= df["rank_max"]))
+    df["abs_diff"] = (df["rank"] - df[low_col]).abs()
+    summary = df.groupby(["task", "filter"]).agg(num_queries=("rank", "size"), changed=("changed", "sum"), unstable=("stable", lambda x: int((~x).sum())), max_abs_diff=("abs_diff", "max")).reset_index()
+    return summary, df
@@ -0,0 +1,253 @@
+import os
+import time
+import datetime as dt
+import numpy as np
+import pandas as pd
+from .entity_api import EntityAPI
+from .address2vec import Address2Vec
+from .evaluation import get_avg_rank
+from .schema import read_table, memory_footprint, peak_rss_mb, EventColumns, ADDRESS2VEC_COLUMNS
+from .tornado_history import get_history_store
+
+TORNADO_FILTERS = ["past", "week", "day"]
+TORNADO_EXPERIMENT_MIXERS = ["0.1", "1", "10"]
+
+# objects loaded by preload() that are reused by the experiments (e.g. in forked workers of the job daemon)
+_PRELOADED = {}
+
+def preload(data_dir, results_dir, graphs=False, n_jobs=1):
+    """Load the EntityAPI (with 'n_jobs' parallel workers), the Tornado queries and the preprocessed events once. Later experiments with the same folders reuse them instead of loading the data again."""
+    api = EntityAPI(data_dir, lazy=True, compact=True, n_jobs=n_jobs)
+    _PRELOADED[("api", data_dir)] = api
+    _PRELOADED[("tornado", data_dir)] = tornado_queries(api, data_dir)
+    if os.path.exists("%s/filtered_data" % results_dir) or os.path.exists("%s/filtered_data.csv" % results_dir):
+        _PRELOADED[("filtered", results_dir)] = load_filtered_data(results_dir)
+    if graphs:
+        # lazy graphs are built here to be shared with the workers
+        api._init_graphs()
+    return api
+
+def get_api(data_dir):
+    if ("api", data_dir) in _PRELOADED:
+        return _PRELOADED[("api", data_dir)]
+    return EntityAPI(data_dir, lazy=True, compact=True)
+
+def get_tornado_queries(api, data_dir):
+    if ("tornado", data_dir) in _PRELOADED:
+        return _PRELOADED[("tornado", data_dir)]
+    return tornado_queries(api, data_dir)
+
+def load_filtered_data(results_dir):
+    """Preprocessed events: memory mapped EventColumns if they were exported by preprocess, the csv file otherwise"""
+    if ("filtered", results_dir) in _PRELOADED:
+        return _PRELOADED[("filtered", results_dir)]
+    if os.path.exists("%s/filtered_data" % results_dir):
+        return EventColumns("%s/filtered_data" % results_dir)
+    return read_table("%s/filtered_data.csv" % results_dir, "filtered_data", columns=ADDRESS2VEC_COLUMNS)
+
+def export_result(result_df, output_dir, model_id):
+    """Save results with a unique timestamp based file name"""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    while True:
+        time_id = str(dt.datetime.now()).split(".")[0].replace(" ","_")
+        experiment_id = "%s-%s" % (time_id, model_id)
+        output_file = "%s/%s.csv" % (output_dir, experiment_id)
+        if os.path.exists(output_file):
+            time.sleep(np.random.randint(1,10))
+            continue
+        else:
+            result_df.to_csv(output_file, index=False)
+            return output_file
+
+def load_node_embeddings(results_dir, exclude_tornado, sample_id):
+    node_embs = {}
+    node_emb_dir = "%s/node_embeddings_ex%s/%s" % (results_dir, exclude_tornado, sample_id)
+    for f in os.listdir(node_emb_dir):
+        algo_id = f.split("_")[0]
+        node_embs[algo_id] = pd.read_csv(node_emb_dir + "/" + f)
+        print(algo_id, node_embs[algo_id].shape)
+    return node_embs
+
+def load_representation(results_dir, hour_bins, gas_bins, min_tx_cnt, algo=None, sample_id=None, exclude_tornado=False):
+    """Side channel (hour_bins/gas_bins = -1 disables a channel) or node embedding (algo, sample_id) representation of the preprocessed events"""
+    filtered = load_filtered_data(results_dir)
+    print(memory_footprint({"filtered_data": filtered}))
+    if algo != None:
+        node_embs = load_node_embeddings(results_dir, exclude_tornado, sample_id)
+        ae = Address2Vec(filtered, norm_type=None, min_tx_cnt=min_tx_cnt, gas_bins=0, hour_bins=0, use_hour=False, use_gas=False, use_stats=False, use_distrib=False, node_emb=node_embs[algo])
+        ae.id = algo
+    else:
+        ae = Address2Vec(filtered, min_tx_cnt=min_tx_cnt, gas_bins=gas_bins, hour_bins=hour_bins, use_hour=hour_bins != -1, use_gas=gas_bins != -1, use_stats=True, use_distrib=True)
+    print("Representation id:", ae.id)
+    print("Representation shape:", ae.X.shape)
+    return ae
+
+def tornado_queries(api, data_dir, mixers=TORNADO_EXPERIMENT_MIXERS):
+    from .tornado_mixer import TornadoQueries
+    max_time = api.events["timeStamp"].max()
+    return [TornadoQueries(mixer_str_value=mixer, data_folder=data_dir, max_time=max_time) for mixer in mixers]
+
+def shard_work_dir(shard_dir, task, ae, sample_id, exclude_tornado):
+    """Shard folder and manifest parameters of an experiment: node embeddings of different samples (or with/without Tornado edges) are checkpointed separately"""
+    params = {"model_id": ae.id, "sample_id": None if sample_id is None else str(sample_id), "exclude_tornado": exclude_tornado}
+    run_id = ae.id
+    if sample_id is not None:
+        run_id += "_s%s" % sample_id
+        if exclude_tornado:
+            run_id += "_notornado"
+    return "%s/%s/%s" % (shard_dir, task, run_id), params
+
+def run_ens_experiment(data_dir, results_dir, hour_bins, gas_bins, algo=None, sample_id=None, shard_dir=None, num_workers=1, sample_size=None, num_candidates=None, seed=None):
+    """Evaluate a representation for ENS address pairs and export the results to '<results_dir>/ens' (or to '<results_dir>/ens_sampled' for a stratified sample of 'sample_size' pairs)"""
+    print("arguments:", hour_bins, gas_bins, algo, sample_id)
+    api = get_api(data_dir)
+    print(api.memory_footprint())
+    ae = load_representation(results_dir, hour_bins, gas_bins, 5, algo, sample_id, exclude_tornado=False)
+    if sample_size != None:
+        from .sampled_evaluation import sample_ens_pairs, run_sampled_ens, get_sampled_avg_rank
+        idx_pairs, design = sample_ens_pairs(ae, api, sample_size, seed=seed)
+        print("Evaluated address pairs:", len(idx_pairs))
+        ens_result = run_sampled_ens(ae, idx_pairs, design, ae.id, num_candidates=num_candidates, seed=seed)
+        ens_perf, _ = get_sampled_avg_rank(ens_result)
+        print(ens_perf)
+        export_result(ens_result, "%s/ens_sampled" % results_dir, ae.id)
+        return ens_result
+    idx_pairs, ens_names = ae.get_idx_pairs(api)
+    print("Evaluated address pairs:", len(idx_pairs))
+    if shard_dir != None:
+        from .sharding import run_sharded_ens
+        work_dir, params = shard_work_dir(shard_dir, "ens", ae, sample_id, False)
+        ens_result = run_sharded_ens(ae, idx_pairs, ae.id, work_dir, num_workers=num_workers, exclusive=True, params=params, export=lambda df: export_result(df, "%s/ens" % results_dir, ae.id))
+        if ens_result is None:
+            print("Results are collected by another worker")
+            return None
+    else:
+        ens_result = ae.run_ens(idx_pairs, ae.id)
+        export_result(ens_result, "%s/ens" % results_dir, ae.id)
+    ens_perf, _ = get_avg_rank(ens_result)
+    print(ens_perf)
+    print("Peak memory usage: %.1f MB" % peak_rss_mb())
+    return ens_result
+
+def run_tornado_experiment(data_dir, results_dir, hour_bins, gas_bins, algo=None, sample_id=None, shard_dir=None, num_workers=1, sample_size=None, num_candidates=None, seed=None):
+    """Evaluate a representation for Tornado withdraw-deposit heuristics and export the results to '<results_dir>/tornado' (or to '<results_dir>/tornado_sampled' for a sample of 'sample_size' tuples per mixer)"""
+    api = get_api(data_dir)
+    queries = get_tornado_queries(api, data_dir)
+    print(api.memory_footprint())
+    ae = load_representation(results_dir, hour_bins, gas_bins, 1, algo, sample_id, exclude_tornado=True)
+    if sample_size != None:
+        from .sampled_evaluation import sample_tornado_queries, run_sampled_tornado, get_sampled_avg_rank
+        subsets, design = sample_tornado_queries(ae, queries, sample_size, seed=seed)
+        tornado_result = run_sampled_tornado(ae, subsets, design, ae.id, filters=TORNADO_FILTERS, num_candidates=num_candidates, seed=seed)
+        tornado_perf, _ = get_sampled_avg_rank(tornado_result)
+        print(tornado_perf)
+        export_result(tornado_result, "%s/tornado_sampled" % results_dir, ae.id)
+        return tornado_result
+    pairs = pd.concat([tq.tornado_pairs[["sender","receiver"]] for tq in queries]).reset_index(drop=True)
+    pairs = pairs.drop_duplicates()
+    print("Evaluated withdraw-deposit:", pairs.shape)
+    if shard_dir != None:
+        from .sharding import run_sharded_tornado
+        work_dir, params = shard_work_dir(shard_dir, "tornado", ae, sample_id, True)
+        tornado_result = run_sharded_tornado(ae, queries, ae.id, work_dir, filters=TORNADO_FILTERS, num_workers=num_workers, exclusive=True, params=params, export=lambda df: export_result(df, "%s/tornado" % results_dir, ae.id))
+        if tornado_result is None:
+            print("Results are collected by another worker")
+            return None
+    else:
+        tornado_result = ae.run_tornado(queries, ae.id, filters=TORNADO_FILTERS)
+        export_result(tornado_result, "%s/tornado" % results_dir, ae.id)
+    tornado_perf, _ = get_avg_rank(tornado_result)
+    print(tornado_perf)
+    print("Peak memory usage: %.1f MB" % peak_rss_mb())
+    return tornado_result
+
+def parse_representation(spec):
+    """Representation arguments of load_representation from 'side:<hour_bins>,<gas_bins>' (side channels) or '<algo>:<sample_id>' (node embedding) specifications"""
+    if not ":" in spec:
+        raise RuntimeError("Invalid representation: %s (use 'side:<hour_bins>,<gas_bins>' or '<algo>:<sample_id>')" % spec)
+    name, value = spec.split(":", 1)
+    if name != "side":
+        return {"hour_bins": None, "gas_bins": None, "algo": name, "sample_id": value}
+    parts = value.split(",")
+    if len(parts) != 2:
+        raise RuntimeError("Invalid representation: %s (use 'side:<hour_bins>,<gas_bins>' or '<algo>:<sample_id>')" % spec)
+    return {"hour_bins": int(parts[0]), "gas_bins": int(parts[1]), "algo": None, "sample_id": None}
+
+def run_fusion_experiment(data_dir, results_dir, task, representations, fusions=["rrf", "score"], rrf_k=60):
+    """Evaluate several representations (see parse_representation) and their fused rankings for ENS pairs or Tornado heuristics in a single pass and export the results to '<results_dir>/<task>'"""
+    from .rank_fusion import MultiRepresentation
+    if not task in ["ens", "tornado"]:
+        raise RuntimeError("Invalid task: %s" % task)
+    api = get_api(data_dir)
+    min_tx_cnt = 5 if task == "ens" else 1
+    a2v_objs = {}
+    for spec in representations:
+        kwargs = parse_representation(spec)
+        ae = load_representation(results_dir, kwargs["hour_bins"], kwargs["gas_bins"], min_tx_cnt, kwargs["algo"], kwargs["sample_id"], exclude_tornado=task == "tornado")
+        a2v_objs[ae.id] = ae
+    mr = MultiRepresentation(a2v_objs, rrf_k=rrf_k)
+    if task == "ens":
+        idx_pairs, _ = mr.get_idx_pairs(api)
+        print("Evaluated address pairs:", len(idx_pairs))
+        result = mr.run_ens(idx_pairs, fusions=fusions)
+    else:
+        result = mr.run_tornado(get_tornado_queries(api, data_dir), filters=TORNADO_FILTERS, fusions=fusions)
+    perf, _ = get_avg_rank(result)
+    print(perf)
+    export_result(result, "%s/%s" % (results_dir, task), "fusion-%s" % "+".join(mr.model_ids))
+    print("Peak memory usage: %.1f MB" % peak_rss_mb())
+    return result
+
+def train_node_embeddings(data_dir, results_dir, algos, exclude_tornado, sample_ids, workers=1, cpu_budget=None, memory_budget_mb=None, dim=128, nwalks=10, reseed=False):
+    """Train node embeddings for every (algorithm, sample id) pair on the cached preprocessed graph. With 'reseed' samples are seeded with the sample id and stored as sample 'seed<sample_id>'."""
+    from .node_embeddings import cached_node_embedder
+    from .embedding_scheduler import EmbeddingScheduler
+    api = get_api(data_dir)
+    max_time = api.events["timeStamp"].max()
+    edges_to_remove = []
+    if exclude_tornado:
+        edges_to_remove = get_history_store(data_dir).heuristic_edges(max_time=max_time)
+    print(len(edges_to_remove))
+    ne = cached_node_embedder(api, "%s/graph_cache" % results_dir, edges_to_remove=edges_to_remove)
+    scheduler = EmbeddingScheduler(ne, "%s/node_embeddings_ex%s" % (results_dir, exclude_tornado), dim=dim, nwalks=nwalks, workers=workers, cpu_budget=cpu_budget, memory_budget_mb=memory_budget_mb, reseed=reseed)
+    num_trained = scheduler.run([(algo, sample_id) for algo in algos for sample_id in sample_ids])
+    print("Peak memory usage: %.1f MB" % peak_rss_mb())
+    return num_trained
+
+def run_sweep(data_dir, results_dir, task, hour_bins, gas_bins, sample_size=None, seed=None):
+    """Evaluate every feature block combination of a side channel representation with a single distance precomputation and export the results to '<results_dir>/<task>'. With 'sample_size' only a stratified sample of the queries is evaluated (exported to '<results_dir>/<task>_sampled')."""
+    from .block_distances import run_block_sweep, block_combinations
+    if not task in ["ens", "tornado"]:
+        raise RuntimeError("Invalid task: %s" % task)
+    api = get_api(data_dir)
+    min_tx_cnt = 5 if task == "ens" else 1
+    ae = load_representation(results_dir, hour_bins, gas_bins, min_tx_cnt)
+    combinations = block_combinations([name for name, _ in ae.block_dims])
+    # model ids are prefixed with the full representation id
+    combinations = dict(("%s-%s" % (ae.id, key), value) for key, value in combinations.items())
+    if sample_size != None:
+        from . import sampled_evaluation
+    if task == "ens":
+        if sample_size != None:
+            idx_pairs, design = sampled_evaluation.sample_ens_pairs(ae, api, sample_size, seed=seed)
+        else:
+            idx_pairs, _ = ae.get_idx_pairs(api)
+        result, _ = run_block_sweep(ae, combinations, idx_pairs=idx_pairs)
+    else:
+        queries = get_tornado_queries(api, data_dir)
+        if sample_size != None:
+            queries, design = sampled_evaluation.sample_tornado_queries(ae, queries, sample_size, seed=seed)
+        _, result = run_block_sweep(ae, combinations, query_objects=queries, filters=TORNADO_FILTERS)
+    if sample_size != None:
+        merge_keys = ["query_addr", "target_addr"] if task == "ens" else ["mixer"]
+        result = result.merge(design.drop_duplicates(merge_keys), on=merge_keys, how="left")
+        perf, _ = sampled_evaluation.get_sampled_avg_rank(result)
+        task_dir = "%s_sampled" % task
+    else:
+        perf, _ = get_avg_rank(result)
+        task_dir = task
+    print(perf)
+    export_result(result, "%s/%s" % (results_dir, task_dir), "%s-sweep" % ae.id)
+    print("Peak memory usage: %.1f MB" % peak_rss_mb())
+    return result
@@ -0,0 +1,99 @@
+import pandas as pd
+import numpy as np
+
+class HistogramCube():
+    """Per-address histograms of the side channels (hour of day, normalized gas price) at the finest resolution that we use. Coarser 'hour_bins'/'gas_bins' distributions are calculated by summing fine bins, so the resolution must be a multiple of the requested number of bins.
+
+    Histograms are stored as sparse (address index, bin, count) arrays. Gas price bins are defined by 'max_gas': Address2Vec bins the gas price by the maximum of the embedded addresses, so by default it is the maximal normalized gas price of the addresses with at least 'min_tx_cnt' events (use the 'min_tx_cnt' of the Address2Vec objects). The maximum of each address is stored to validate the requested address sets."""
+    def __init__(self, events_df, hour_resolution=1440, gas_resolution=3600, max_gas=None, min_tx_cnt=1, verbose=True):
+        self.verbose = verbose
+        self.resolution = {"hour": hour_resolution, "normalized_gas": gas_resolution}
+        from_col = events_df["from"].astype("category")
+        self.addresses = list(from_col.cat.categories)
+        self.addr2idx = dict(zip(self.addresses, range(len(self.addresses))))
+        codes = from_col.cat.codes.values.astype("int64")
+        self.tx_counts = np.bincount(codes, minlength=len(self.addresses))
+        self.address_max_gas = None
+        if "normalized_gas" in events_df.columns:
+            self.address_max_gas = pd.Series(events_df["normalized_gas"].values).groupby(codes).max().reindex(np.arange(len(self.addresses))).values
+            if max_gas is None:
+                max_gas = float(self.address_max_gas[self.tx_counts >= min_tx_cnt].max())
+        self.value_range = {"hour": 86400.0, "normalized_gas": max_gas}
+        self.hist = {}
+        for col in ["hour", "normalized_gas"]:
+            if col in events_df.columns:
+                self.hist[col] = self._compress(codes, events_df[col].values, col)
+        if self.verbose:
+            print("Histogram cube addresses:", len(self.addresses))
+            print("Histogram cube memory (MB): %.2f" % self.memory_usage())
+
+    def _compress(self, codes, values, col):
+        resolution = self.resolution[col]
+        interval = self.value_range[col] / resolution
+        bins = (values // interval).astype("int64")
+        # the maximal value gets its own bin just like in Address2Vec (values above 'max_gas' belong to addresses that are rejected by distribution)
+        bins[values >= self.value_range[col]] = resolution
+        keys, counts = np.unique(codes * (resolution+1) + bins, return_counts=True)
+        return {
+            "addr": (keys // (resolution+1)).astype("int32"),
+            "bin": (keys % (resolution+1)).astype("int32"),
+            "count": counts.astype("uint32"),
+        }
+
+    def memory_usage(self):
+        """Size of the stored histograms in MB"""
+        size = self.tx_counts.nbytes
+        for col in self.hist:
+            size += sum(arr.nbytes for arr in self.hist[col].values())
+        return size / 1024**2
+
+    def counts(self, col, num_bins, addresses=None):
+        """Dense (address x coarse bin) count matrix by summing fine bins"""
+        resolution = self.resolution[col]
+        if resolution % num_bins != 0:
+            raise RuntimeError("Resolution of %s (%i) is not a multiple of %i bins!" % (col, resolution, num_bins))
+        if addresses is None:
+            addresses = self.addresses
+        rows = np.full(len(self.addresses), -1, dtype="int64")
+        rows[[self.addr2idx[addr] for addr in addresses]] = np.arange(len(addresses))
+        hist = self.hist[col]
+        row_idx = rows[hist["addr"]]
+        sel = row_idx >= 0
+        coarse = hist["bin"][sel] // (resolution // num_bins)
+        # the maximal value is binned as 'max // (max / num_bins)' in Address2Vec, which may round down to the previous bin
+        coarse[hist["bin"][sel] == resolution] = int(self.value_range[col] // (self.value_range[col] / num_bins))
+        flat = np.bincount(row_idx[sel] * (num_bins+1) + coarse, weights=hist["count"][sel], minlength=len(addresses)*(num_bins+1))
+        return flat.reshape(len(addresses), num_bins+1)
+
+    def distribution(self, addresses, hour_bins=0, gas_bins=0):
+        """Address2Vec compatible distribution based representation (only observed bins are kept)"""
+        if gas_bins > 0:
+            max_gas = float(self.address_max_gas[[self.addr2idx[addr] for addr in addresses]].max())
+            if max_gas != self.value_range["normalized_gas"]:
+                raise RuntimeError("Gas price bins of the cube are based on max_gas=%f but the maximum of the given addresses is %f! Build the cube with the 'min_tx_cnt' of the representation." % (self.value_range["normalized_gas"], max_gas))
+        parts = []
+        for col, num_bins in [("hour", hour_bins), ("normalized_gas", gas_bins)]:
+            if num_bins > 0:
+                C = self.counts(col, num_bins, addresses)
+                parts.append(C[:, C.sum(axis=0) > 0])
+        if len(parts) == 0:
+            return np.array([])
+        B = np.concatenate(parts, axis=1)
+        tx_counts = self.tx_counts[[self.addr2idx[addr] for addr in addresses]]
+        return B / tx_counts.reshape(-1,1)
+
+    def show_patterns(self, addresses, gas_bins=50, hour_bins=24, figsize=(15,3), log_gas=False):
+        """Show side channels distribution of the given addresses"""
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(1,2, figsize=figsize)
+        for i, (col, num_bins) in enumerate([("normalized_gas", gas_bins), ("hour", hour_bins)]):
+            C = self.counts(col, num_bins, addresses)
+            edges = np.arange(num_bins+2) * self.value_range[col] / num_bins
+            for row in C:
+                ax[i].hist(edges[:-1], bins=edges, weights=row, alpha=0.5)
+        if log_gas:
+            ax[0].set_xlim([0,np.log(1+5)])
+        else:
+            ax[0].set_xlim([0,5])
+        ax[1].set_xlim([0,86400])
+        return fig
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+from .address2vec import Address2Vec
+from .evaluation import compare_ranks
+
+def snapshot_edges(api, min_time=None, max_time=None, use_normal=True, use_token=True, use_contract=False):
+    """Undirected address pairs of the transactions in the given (inclusive) time interval with the same graph options as NodeEmbedder"""
+    normal_txs, token_txs = api._time_filter(min_time, max_time)
+    endpoints = []
+    if use_normal:
+        endpoints.append((normal_txs, "from", "to"))
+    if use_token:
+        endpoints.append((token_txs, "from", "to"))
+    if use_contract:
+        endpoints.append((token_txs, "from", "contractAddress"))
+        endpoints.append((token_txs, "contractAddress", "to"))
+    parts = []
+    for df, src, trg in endpoints:
+        pairs = df[[src, trg]].dropna()
+        pairs.columns = ["u", "v"]
+        parts.append(pairs)
+    if len(parts) == 0:
+        return []
+    pairs = pd.concat(parts)
+    pairs = pairs[pairs["u"] != pairs["v"]]
+    # undirected edges
+    swap = pairs["u"] > pairs["v"]
+    pairs.loc[swap, ["u", "v"]] = pairs.loc[swap, ["v", "u"]].values
+    return list(pairs.drop_duplicates().itertuples(index=False, name=None))
+
+def neighborhood(G, nodes, hops=1):
+    """Nodes within 'hops' distance of the given nodes"""
+    region = set(nodes)
+    frontier = set(nodes)
+    for _ in range(hops):
+        frontier = set(nbr for node in frontier for nbr in G.neighbors(node)).difference(region)
+        region.update(frontier)
+    return region
+
+def refresh_embedding(ne, emb_df, affected, hops=1, iterations=10, alpha=0.5, verbose=True):
+    """Neighbor averaging approximation of retraining a node embedding after NodeEmbedder.update. The embedding model is not trained at all: nodes in the 'hops' neighborhood of the affected nodes are refreshed by neighbor averaging, new nodes get the mean of their neighbors, while previously embedded nodes move towards it with weight 'alpha'. Other nodes keep their representation. The approximation can be poor (e.g. new nodes that are only connected to a hub get the same representation), so compare it with a retrained embedding with ens_quality_check."""
+    dims = [col for col in emb_df.columns if col != "address"]
+    N = len(ne.node_map)
+    E = np.zeros((N, len(dims)))
+    known = np.zeros(N, dtype=bool)
+    old_idx = emb_df["address"].map(ne.node_map)
+    if old_idx.isnull().sum() > 0:
+        raise RuntimeError("Embedded addresses are missing from the graph!")
+    old_idx = old_idx.values.astype("int64")
+    E[old_idx] = emb_df[dims].values
+    known[old_idx] = True
+    anchor = E.copy()
+    region = np.array(sorted(neighborhood(ne.G, affected, hops)), dtype="int64")
+    # edges of the refreshed region (each direction)
+    src, trg = [], []
+    for node in region:
+        for nbr in ne.G.neighbors(node):
+            src.append(node)
+            trg.append(nbr)
+    src, trg = np.array(src, dtype="int64"), np.array(trg, dtype="int64")
+    valid = known.copy()
+    for _ in range(iterations):
+        sums = np.zeros_like(E)
+        counts = np.zeros(N)
+        sel = valid[trg]
+        np.add.at(sums, src[sel], E[trg[sel]])
+        np.add.at(counts, src[sel], 1)
+        has_nbr = counts[region] > 0
+        nodes = region[has_nbr]
+        means = sums[nodes] / counts[nodes].reshape(-1,1)
+        old = known[nodes]
+        E_next = E.copy()
+        E_next[nodes[old]] = (1.0 - alpha) * anchor[nodes[old]] + alpha * means[old]
+        E_next[nodes[~old]] = means[~old]
+        E = E_next
+        valid[nodes] = True
+    # nodes without any embedded node in their component get the mean representation
+    missing = ~valid
+    if missing.sum() > 0:
+        E[missing] = anchor[known].mean(axis=0)
+    if verbose:
+        print("Refreshed nodes: %i (new: %i, without embedded neighbors: %i)" % (len(region), int((~known).sum()), int(missing.sum())))
+    refreshed = pd.DataFrame(E, columns=dims)
+    refreshed["address"] = ne.ordered_addresses
+    return refreshed
+
+def ens_quality_check(api, events_df, emb_dfs, min_tx_cnt=5):
+    """Compare ENS ranks of node embeddings (e.g. {'refreshed': ..., 'retrained': ...}) with the run_ens setup of the ENS experiment. Returns the per-pair results and a pairwise rank comparison against the first embedding."""
+    results = {}
+    idx_pairs = None
+    for model_id, emb_df in emb_dfs.items():
+        ae = Address2Vec(events_df, norm_type=None, min_tx_cnt=min_tx_cnt, gas_bins=0, hour_bins=0, use_hour=False, use_gas=False, use_stats=False, use_distrib=False, node_emb=emb_df, verbose=False)
+        if idx_pairs is None:
+            idx_pairs, _ = ae.get_idx_pairs(api)
+        results[model_id] = ae.run_ens(idx_pairs, model_id)
+    model_ids = list(emb_dfs.keys())
+    summary = pd.DataFrame([compare_ranks(results[model_ids[0]], results[other]) for other in model_ids[1:]], index=model_ids[1:])
+    return pd.concat(results.values(), ignore_index=True), summary
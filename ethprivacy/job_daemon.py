@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import traceback
+import datetime as dt
+import multiprocessing
+
+JOB_COMMANDS = ["run-ens", "run-tornado", "sweep", "fuse", "train-embedding", "heuristics"]
+JOB_STATES = ["pending", "running", "done", "failed"]
+
+class JobQueue():
+    """Queue directory of experiment jobs. Each job is a '<state>/<job id>.json' file with the command line arguments of an ethprivacy subcommand and its output is written to 'logs/<job id>.log'. State changes are atomic file moves, so any process of the host can submit jobs or query their status."""
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        for name in JOB_STATES + ["logs"]:
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+    def _path(self, state, job_id):
+        return os.path.join(self.queue_dir, state, "%s.json" % job_id)
+
+    def _write(self, state, job):
+        path = self._path(state, job["id"])
+        tmp_path = "%s.%i.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def log_path(self, job_id):
+        return os.path.join(self.queue_dir, "logs", "%s.log" % job_id)
+
+    def submit(self, argv):
+        """Add a job (e.g. ['run-ens', '--hour-bins', '6']) to the queue and return its id"""
+        if len(argv) == 0 or not argv[0] in JOB_COMMANDS:
+            raise RuntimeError("Invalid job! Supported commands: %s" % ", ".join(JOB_COMMANDS))
+        job_id = "%s-%s" % (dt.datetime.now().strftime("%Y%m%d_%H%M%S_%f"), uuid.uuid4().hex[:6])
+        self._write("pending", {"id": job_id, "argv": list(argv), "submitted": time.time()})
+        return job_id
+
+    def job_ids(self, state):
+        return sorted(f[:-5] for f in os.listdir(os.path.join(self.queue_dir, state)) if f.endswith(".json"))
+
+    def load(self, state, job_id):
+        with open(self._path(state, job_id)) as f:
+            return json.load(f)
+
+    def claim(self, job_id):
+        """Move a pending job to the running state. Returns None if it was claimed by another daemon."""
+        try:
+            os.replace(self._path("pending", job_id), self._path("running", job_id))
+        except FileNotFoundError:
+            return None
+        return self.load("running", job_id)
+
+    def update(self, state, job):
+        self._write(state, job)
+
+    def finish(self, job, exit_code):
+        job["exit_code"] = exit_code
+        job["finished"] = time.time()
+        self._write("done" if exit_code == 0 else "failed", job)
+        os.remove(self._path("running", job["id"]))
+
+    def requeue_running(self):
+        """Move the jobs of a stopped daemon back to the pending state"""
+        job_ids = self.job_ids("running")
+        for job_id in job_ids:
+            os.replace(self._path("running", job_id), self._path("pending", job_id))
+        return job_ids
+
+    def status(self, job_id=None):
+        """(state, job) pairs of every job or of the given job"""
+        jobs = []
+        for state in JOB_STATES:
+            for other_id in self.job_ids(state):
+                if job_id is None or other_id == job_id:
+                    try:
+                        jobs.append((state, self.load(state, other_id)))
+                    except FileNotFoundError:
+                        # the job has just changed state
+                        continue
+        return sorted(jobs, key=lambda x: x[1]["id"])
+
+    @property
+    def stop_file(self):
+        return os.path.join(self.queue_dir, "STOP")
+
+    def request_stop(self):
+        with open(self.stop_file, "w") as f:
+            f.write(str(time.time()))
+
+def _run_job(job, log_path, data_dir, results_dir):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(log_path, "a") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    from .cli import main
+    try:
+        exit_code = main(["--data-dir", data_dir, "--results-dir", results_dir] + job["argv"])
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(exit_code)
+
+class JobDaemon():
+    """Load the EntityAPI, the Tornado queries and the preprocessed events once and run the submitted jobs in forked processes.
+
+    Workers share the loaded data with the daemon copy-on-write, so jobs start without loading the data and concurrent jobs do not duplicate it. At most 'max_jobs' jobs run at the same time. The daemon stops after the running jobs are finished when 'ethprivacy stop' is called or on SIGTERM/SIGINT. Jobs left running by a previous daemon are requeued on start, so a queue folder should be served by a single daemon."""
+    def __init__(self, queue_dir, data_dir, results_dir, max_jobs=2, preload_graphs=False, poll_interval=0.5, load_jobs=1, verbose=True):
+        self.queue = JobQueue(queue_dir)
+        self.data_dir = data_dir
+        self.results_dir = results_dir
+        self.max_jobs = max_jobs
+        self.preload_graphs = preload_graphs
+        self.poll_interval = poll_interval
+        self.load_jobs = load_jobs
+        self.verbose = verbose
+        self.stopping = False
+
+    def _log(self, message):
+        if self.verbose:
+            print("[%s] %s" % (dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), message))
+            sys.stdout.flush()
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _start(self, ctx, job):
+        job["started"] = time.time()
+        proc = ctx.Process(target=_run_job, args=(job, self.queue.log_path(job["id"]), self.data_dir, self.results_dir))
+        proc.start()
+        job["pid"] = proc.pid
+        self.queue.update("running", job)
+        self._log("Started %s: %s (pid: %i)" % (job["id"], " ".join(job["argv"]), proc.pid))
+        return proc
+
+    def run(self):
+        """Serve jobs until stopped and return the number of finished jobs"""
+        from .experiments import preload
+        from .schema import peak_rss_mb
+        if os.path.exists(self.queue.stop_file):
+            os.remove(self.queue.stop_file)
+        requeued = self.queue.requeue_running()
+        if len(requeued) > 0:
+            self._log("Requeued unfinished jobs: %s" % ", ".join(requeued))
+        start = time.time()
+        preload(self.data_dir, self.results_dir, graphs=self.preload_graphs, n_jobs=self.load_jobs)
+        self._log("Data loaded in %.1f seconds (memory usage: %.1f MB)" % (time.time() - start, peak_rss_mb()))
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        ctx = multiprocessing.get_context("fork")
+        running = {}
+        finished = 0
+        while not self.stopping or len(running) > 0:
+            for proc in list(running.keys()):
+                if proc.is_alive():
+                    continue
+                proc.join()
+                job = running.pop(proc)
+                self.queue.finish(job, proc.exitcode)
+                finished += 1
+                self._log("Finished %s with exit code %i in %.1f seconds" % (job["id"], proc.exitcode, job["finished"] - job["started"]))
+            if os.path.exists(self.queue.stop_file) and not self.stopping:
+                self.stopping = True
+                self._log("Stop requested, waiting for %i running jobs" % len(running))
+            if not self.stopping:
+                for job_id in self.queue.job_ids("pending"):
+                    if len(running) >= self.max_jobs:
+                        break
+                    job = self.queue.claim(job_id)
+                    if job is not None:
+                        running[self._start(ctx, job)] = job
+            time.sleep(self.poll_interval)
+        if os.path.exists(self.queue.stop_file):
+            os.remove(self.queue.stop_file)
+        self._log("Daemon stopped after %i jobs" % finished)
+        return finished
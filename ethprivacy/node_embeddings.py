@@ -1,9 +1,9 @@
+import os
+import pickle
+import hashlib
 import networkx as nx
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-
-from karateclub import DeepWalk, Walklets, Role2Vec, Diff2Vec, BoostNE, NodeSketch, NetMF, HOPE, GraRep, NMFADMM, GraphWave, LaplacianEigenmaps
 
 def clean_graph(G):
     G_undir = G.to_undirected()
@@ -22,13 +22,16 @@ def recode_graph(G):
     return G_tmp, node_map
 
 def show_embeddings(emb_df, address_mask=[]):
+    import matplotlib.pyplot as plt
     if len(address_mask) > 0:
         row_sel = emb_df["address"].isin(address_mask)
         plt.scatter(emb_df.loc[row_sel,0], emb_df.loc[row_sel,1])
     else:
         plt.scatter(emb_df.loc[:,0], emb_df.loc[:,1])
         
-def karate_factory(algo, dim, nwalks, workers):
+def karate_factory(algo, dim, nwalks, workers, seed=None):
+    # karateclub (and its dependencies) are only loaded for training
+    from karateclub import DeepWalk, Walklets, Role2Vec, Diff2Vec, BoostNE, NodeSketch, NetMF, HOPE, GraRep, NMFADMM, GraphWave, LaplacianEigenmaps
     if algo == "walklets":
         karate_obj = Walklets(dimensions=int(dim/4), walk_number=nwalks, workers=workers)
     elif algo == "role2vec":
@@ -55,15 +58,71 @@ def karate_factory(algo, dim, nwalks, workers):
         karate_obj = LaplacianEigenmaps(dimensions=dim)
     else:
         raise RuntimeError("Invalid model type: %s" % algo)
+    if seed is not None:
+        karate_obj.seed = seed
     return karate_obj
 
+def embedding_file_name(algo, dim, nwalks):
+    if algo in ["deepwalk","diff2vec","role2vec","walklets"]:
+        return "%s_dim%i_nwalk%i.csv" % (algo, dim, nwalks)
+    elif algo == "graphwave":
+        return "%s.csv" % algo
+    else:
+        return "%s_dim%i.csv" % (algo, dim)
+
+def data_fingerprint(api):
+    """Description of the data behind the graphs of an EntityAPI: loader options, table sizes and the size and modification time of the data files"""
+    lines = ["filter%s_pos%s" % (api.address_filter, api.only_pos_tx)]
+    lines.append("remove%s" % ",".join(sorted(str(tx_hash) for tx_hash in api.hash_to_remove)))
+    lines.append("ens%i_normal%i_token%i" % (len(api.ens_pairs), len(api.normal_txs), len(api.token_txs)))
+    # top level files of the data folder and the partitions of the transaction store
+    paths = [os.path.join(api.data_dir, name) for name in sorted(os.listdir(api.data_dir))]
+    if api.store_dir is not None:
+        for root, dirs, files in os.walk(api.store_dir):
+            dirs.sort()
+            paths += [os.path.join(root, name) for name in sorted(files) if not name.endswith(".lock") and not name.endswith(".tmp")]
+    for path in paths:
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            lines.append("%s,%i,%i" % (path, stat.st_size, int(stat.st_mtime)))
+    return "\n".join(lines)
+
+def graph_cache_key(edges_to_remove, use_normal=True, use_token=True, use_contract=False, core_number=2, max_time=None, data_key=None):
+    """Checksum of the graph preprocessing configuration (and of the data fingerprint if 'data_key' is set)"""
+    sha = hashlib.sha1()
+    sha.update(("normal%s_token%s_contract%s_core%i\n" % (use_normal, use_token, use_contract, core_number)).encode("utf-8"))
+    if max_time is not None:
+        sha.update(("max_time%i\n" % max_time).encode("utf-8"))
+    if data_key is not None:
+        sha.update(("%s\n" % data_key).encode("utf-8"))
+    for u, v in sorted(set((str(u), str(v)) for u, v in edges_to_remove)):
+        sha.update(("%s,%s\n" % (u, v)).encode("utf-8"))
+    return sha.hexdigest()
+
+def cached_node_embedder(api, cache_dir, use_normal=True, use_token=True, use_contract=False, core_number=2, edges_to_remove=[], max_time=None, verbose=True):
+    """Load the cleaned and recoded graph for the given configuration and data (see data_fingerprint) from 'cache_dir' or build it with NodeEmbedder and persist it"""
+    key = graph_cache_key(edges_to_remove, use_normal, use_token, use_contract, core_number, max_time, data_key=data_fingerprint(api))
+    path = os.path.join(cache_dir, "graph_%s.pkl" % key)
+    if os.path.exists(path):
+        if verbose:
+            print("Loading preprocessed graph:", path)
+        return NodeEmbedder.load(path, verbose=verbose)
+    ne = NodeEmbedder(api, use_normal=use_normal, use_token=use_token, use_contract=use_contract, core_number=core_number, edges_to_remove=edges_to_remove, max_time=max_time, verbose=verbose)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    ne.save(path)
+    return ne
+
 class NodeEmbedder():
-    def __init__(self, api, use_normal=True, use_token=True, use_contract=False, core_number=2, edges_to_remove=[],  verbose=True):
+    def __init__(self, api, use_normal=True, use_token=True, use_contract=False, core_number=2, edges_to_remove=[], max_time=None, verbose=True):
         self.verbose = verbose
-        self.normal_G = clean_graph(api.normal_graph.G)
-        self.token_G = clean_graph(api.token_graph.G)
-        self.to_contract = clean_graph(api.contract_graph.G)
-        self.from_contract = clean_graph(api.rev_contract_graph.G)
+        self.max_time = max_time
+        self.removed_edges = set(edges_to_remove)
+        # transactions after 'max_time' are excluded (e.g. to train on an earlier snapshot)
+        self.normal_G = clean_graph(api.normal_graph._time_filter(None, max_time))
+        self.token_G = clean_graph(api.token_graph._time_filter(None, max_time))
+        self.to_contract = clean_graph(api.contract_graph._time_filter(None, max_time))
+        self.from_contract = clean_graph(api.rev_contract_graph._time_filter(None, max_time))
         all_edges = []
         if use_normal:
             all_edges += list(self.normal_G.edges())
@@ -80,7 +139,8 @@ class NodeEmbedder():
         if self.verbose:
             print("%i edges were removed" % len(edges_to_remove))
         # remove node nan - transactions without endpoint (e.g. new contract creation)
-        G.remove_node(np.nan)
+        if G.has_node(np.nan):
+            G.remove_node(np.nan)
         # remove low degree nodes
         G = nx.k_core(G, k=core_number)
         # component check
@@ -95,6 +155,55 @@ class NodeEmbedder():
             print("Number of nodes:", self.G.number_of_nodes())
             print("Number of edges:", self.G.number_of_edges())
             
+    def save(self, path):
+        """Persist the preprocessed graph (node and edge order is preserved)"""
+        tmp_path = "%s.%i.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"G": self.G, "node_map": self.node_map, "removed_edges": self.removed_edges}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, verbose=True):
+        """Load a preprocessed graph saved with NodeEmbedder.save"""
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        ne = cls.__new__(cls)
+        ne.verbose = verbose
+        ne.G = state["G"]
+        ne.node_map = state["node_map"]
+        ne.removed_edges = state.get("removed_edges", set())
+        ne.idx_map = dict(zip(ne.node_map.values(),ne.node_map.keys()))
+        ne.ordered_addresses = [ne.idx_map[idx] for idx in range(len(ne.node_map))]
+        if ne.verbose:
+            print("Number of nodes:", ne.G.number_of_nodes())
+            print("Number of edges:", ne.G.number_of_edges())
+        return ne
+
+    def update(self, edges):
+        """Add new (address, address) edges to the preprocessed graph. New addresses get the next node ids so existing node ids are not changed. Returns the ids of the nodes with new edges."""
+        affected = set()
+        num_new_nodes, num_new_edges = 0, 0
+        for u, v in edges:
+            if pd.isnull(u) or pd.isnull(v) or u == v:
+                continue
+            if (u, v) in self.removed_edges or (v, u) in self.removed_edges:
+                continue
+            for addr in [u, v]:
+                if not addr in self.node_map:
+                    idx = len(self.node_map)
+                    self.node_map[addr] = idx
+                    self.idx_map[idx] = addr
+                    self.ordered_addresses.append(addr)
+                    num_new_nodes += 1
+            src, trg = self.node_map[u], self.node_map[v]
+            if not self.G.has_edge(src, trg):
+                self.G.add_edge(src, trg)
+                affected.update([src, trg])
+                num_new_edges += 1
+        if self.verbose:
+            print("%i new nodes and %i new edges were added" % (num_new_nodes, num_new_edges))
+        return sorted(affected)
+
     def get_indices(self, addresses):
         indices = []
         for addr in addresses:
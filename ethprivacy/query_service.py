@@ -0,0 +1,373 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from .distance_calculation import compute_dtype
+
+def _jsonify(obj):
+    """Convert query results (sets, numpy scalars, DataFrames) into JSON serializable objects"""
+    if isinstance(obj, pd.DataFrame):
+        return [_jsonify(rec) for rec in obj.to_dict("records")]
+    if isinstance(obj, dict):
+        return {str(key): _jsonify(value) for key, value in obj.items()}
+    if isinstance(obj, (set, frozenset)):
+        return sorted(_jsonify(item) for item in obj)
+    if isinstance(obj, (list, tuple)):
+        return [_jsonify(item) for item in obj]
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    return obj
+
+def latency_percentiles(latencies, percentiles=[50, 99]):
+    """Summarize latencies (in seconds) with the given percentiles (in milliseconds)"""
+    if len(latencies) == 0:
+        return {"count": 0}
+    values = np.array(latencies) * 1000.0
+    res = {"count": len(values), "mean_ms": float(values.mean())}
+    for p in percentiles:
+        res["p%i_ms" % p] = float(np.percentile(values, p))
+    return res
+
+def normalize_params(params):
+    """Request parameters with lowercased addresses and ENS names (as they are stored by EntityAPI), so that case variants share cache entries"""
+    res = dict(params)
+    for key in ["address", "name"]:
+        if key in res and isinstance(res[key], str):
+            res[key] = res[key].lower()
+    if "addresses" in res and isinstance(res["addresses"], list):
+        res["addresses"] = [str(addr).lower() for addr in res["addresses"]]
+    return res
+
+class LRUCache():
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, self._data[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+class QueryService():
+    """Long-running query service over a loaded EntityAPI and Address2Vec object.
+
+    Requests are newline delimited JSON objects of the form {"id": ..., "method": ..., "params": {...}} served over a Unix socket or TCP. Supported methods: 'similar', 'address_info', 'neighbors', 'multi_hop', 'ens_info' and 'stats'. Similarity requests that arrive within 'batch_window' seconds are answered by a single distance computation."""
+    def __init__(self, api, a2v_obj, cache_size=4096, batch_window=0.002, max_batch=64, workers=2, verbose=True):
+        self.api = api
+        self.a2v = a2v_obj
+        self.X = np.asarray(a2v_obj.X)
+        self.X = self.X.astype(compute_dtype(self.X), copy=False)
+        if np.isnan(self.X).sum() > 0:
+            raise RuntimeError("Representation matrix contains nans!")
+        self.sq_norms = np.square(self.X).sum(axis=1)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.verbose = verbose
+        self.cache = LRUCache(cache_size)
+        self.latencies = deque(maxlen=100000)
+        # pandas based EntityAPI lookups are executed one at a time
+        self._api_executor = ThreadPoolExecutor(max_workers=1)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._queue = None
+        self._batcher = None
+        self._server = None
+        self.handlers = {
+            "similar": self._similar,
+            "address_info": self._address_info,
+            "neighbors": self._neighbors,
+            "multi_hop": self._multi_hop,
+            "ens_info": self._ens_info,
+            "stats": self._stats,
+        }
+
+    ### similarity ###
+
+    def top_k(self, query_indices, k=10):
+        """Find the 'k' nearest embedded addresses (excluding itself) for each query index"""
+        Q = self.X[query_indices,:]
+        sq_dist = self.sq_norms[query_indices].reshape(-1,1) + self.sq_norms.reshape(1,-1) - 2.0 * Q.dot(self.X.T)
+        sq_dist = np.maximum(sq_dist, 0.0)
+        sq_dist[np.arange(len(query_indices)), query_indices] = np.inf
+        k = min(k, self.X.shape[0]-1)
+        results = []
+        for row, idx in zip(sq_dist, query_indices):
+            cand = np.argpartition(row, k-1)[:k] if k > 0 else np.array([], dtype=int)
+            cand = cand[np.argsort(row[cand], kind="mergesort")]
+            results.append([(self.a2v.idx2addr[c], float(np.sqrt(row[c]))) for c in cand])
+        return results
+
+    async def _batch_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            max_k = max(item[1] for item in batch)
+            indices = [item[0] for item in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self.top_k, indices, max_k)
+                for item, res in zip(batch, results):
+                    if not item[2].done():
+                        item[2].set_result(res[:item[1]])
+            except Exception as e:
+                for item in batch:
+                    if not item[2].done():
+                        item[2].set_exception(e)
+
+    async def _similar(self, params):
+        address = str(params["address"]).lower()
+        k = int(params.get("k", 10))
+        if not address in self.a2v.addr2idx:
+            raise KeyError("Address is not embedded: %s" % address)
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((self.a2v.addr2idx[address], k, future))
+        neighbors = await future
+        return [{"address": addr, "dist": dist} for addr, dist in neighbors]
+
+    ### EntityAPI lookups ###
+
+    async def _run_api(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._api_executor, lambda: func(*args, **kwargs))
+
+    async def _address_info(self, params):
+        return await self._run_api(self.api.address_info, params["address"], min_time=params.get("min_time"), max_time=params.get("max_time"))
+
+    async def _neighbors(self, params):
+        addresses = params["addresses"] if "addresses" in params else [params["address"]]
+        addresses = [str(addr).lower() for addr in addresses]
+        return await self._run_api(self.api.neighbors, addresses, min_time=params.get("min_time"), max_time=params.get("max_time"), ens_result=params.get("ens_result", False))
+
+    async def _multi_hop(self, params):
+        addresses = params["addresses"] if "addresses" in params else [params["address"]]
+        addresses = [str(addr).lower() for addr in addresses]
+        options = dict((key, params[key]) for key in ["hops", "direction", "start_time", "min_time", "max_time", "min_gap", "max_gap", "max_edges_per_node", "max_results", "ens_result"] if key in params)
+        return await self._run_api(self.api.multi_hop_neighbors, addresses, **options)
+
+    async def _ens_info(self, params):
+        return await self._run_api(self.api.ens_info, params["name"], min_time=params.get("min_time"), max_time=params.get("max_time"))
+
+    async def _stats(self, params):
+        stats = latency_percentiles(list(self.latencies))
+        stats.update({"cache_size": len(self.cache), "cache_hits": self.cache.hits, "cache_misses": self.cache.misses})
+        return stats
+
+    ### request handling ###
+
+    async def handle(self, request):
+        """Answer a single request object and return the response object"""
+        start = time.perf_counter()
+        method = request.get("method")
+        params = request.get("params", {})
+        response = {"id": request.get("id")}
+        try:
+            if not method in self.handlers:
+                raise RuntimeError("Invalid method: %s" % method)
+            cacheable = method != "stats"
+            params = normalize_params(params)
+            key = (method, json.dumps(params, sort_keys=True))
+            found, result = self.cache.get(key) if cacheable else (False, None)
+            if not found:
+                result = _jsonify(await self.handlers[method](params))
+                if cacheable:
+                    self.cache.put(key, result)
+            response["result"] = result
+        except Exception as e:
+            response["error"] = "%s: %s" % (type(e).__name__, e)
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    async def _respond(self, response, writer, lock):
+        data = (json.dumps(response) + "\n").encode("utf-8")
+        async with lock:
+            try:
+                writer.write(data)
+                await writer.drain()
+            except ConnectionError:
+                # the client has disconnected
+                pass
+
+    async def _handle_line(self, line, writer, lock):
+        try:
+            request = json.loads(line)
+            response = await self.handle(request)
+        except ValueError as e:
+            response = {"id": None, "error": "Invalid request: %s" % e}
+        await self._respond(response, writer, lock)
+
+    async def _handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = []
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError) as e:
+                    # the request line is longer than the stream limit: the rest of the stream can not be split into requests
+                    await self._respond({"id": None, "error": "Invalid request: %s" % e}, writer, lock)
+                    break
+                if not line:
+                    break
+                # requests of the same connection are answered concurrently
+                tasks.append(asyncio.ensure_future(self._handle_line(line, writer, lock)))
+                tasks = [t for t in tasks if not t.done()]
+        except ConnectionError:
+            pass
+        finally:
+            # answer the requests in flight before closing the connection
+            tasks = [t for t in tasks if not t.done()]
+            if len(tasks) > 0:
+                await asyncio.wait(tasks)
+            writer.close()
+
+    async def warm(self, addresses=None, k=10):
+        """Populate the similarity cache for the given (by default every embedded) addresses"""
+        if addresses is None:
+            addresses = self.a2v.addr_to_embedd
+        requests = [{"method": "similar", "params": {"address": addr, "k": k}} for addr in addresses]
+        await asyncio.gather(*[self.handle(req) for req in requests])
+        if self.verbose:
+            print("Warmed up cache with %i addresses" % len(requests))
+
+    async def start(self, path=None, host="127.0.0.1", port=None):
+        """Start listening on a Unix socket ('path') or on a TCP port"""
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._batch_loop())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=path)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host=host, port=port)
+        if self.verbose:
+            print("Query service is listening on", path if path is not None else self._server.sockets[0].getsockname())
+        return self._server
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+        self._executor.shutdown(wait=False)
+        self._api_executor.shutdown(wait=False)
+
+    def serve_forever(self, path=None, host="127.0.0.1", port=None, warm_up=False):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.start(path=path, host=host, port=port))
+        if warm_up:
+            loop.run_until_complete(self.warm())
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+class QueryClient():
+    """Asynchronous client for QueryService. Requests can be pipelined on a single connection."""
+    def __init__(self, path=None, host="127.0.0.1", port=None):
+        self.path = path
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+        self._pending = {}
+        self._next_id = 0
+        self._listener = None
+        self._closed = None
+
+    async def connect(self):
+        if self.path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._listener = asyncio.ensure_future(self._listen())
+        return self
+
+    async def _listen(self):
+        error = ConnectionError("Connection closed by the query service")
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._pending.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except Exception as e:
+            error = e
+        finally:
+            # pending requests would wait forever
+            self._closed = error
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    async def request(self, method, **params):
+        """Send a request and wait for the response object"""
+        if self._closed is not None:
+            raise ConnectionError("Connection is closed: %s" % self._closed)
+        self._next_id += 1
+        req_id = self._next_id
+        future = asyncio.get_event_loop().create_future()
+        self._pending[req_id] = future
+        self._writer.write((json.dumps({"id": req_id, "method": method, "params": params}) + "\n").encode("utf-8"))
+        await self._writer.drain()
+        return await future
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def benchmark(self, requests, concurrency=16):
+        """Send (method, params) requests with the given concurrency and report client side latency percentiles"""
+        latencies = []
+        errors = 0
+        semaphore = asyncio.Semaphore(concurrency)
+        async def timed(method, params):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await self.request(method, **params)
+                latencies.append(time.perf_counter() - start)
+                if "error" in response:
+                    errors += 1
+        await asyncio.gather(*[timed(method, params) for method, params in requests])
+        stats = latency_percentiles(latencies)
+        stats["errors"] = errors
+        return stats
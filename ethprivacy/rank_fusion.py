@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+from .address2vec import Address2Vec
+from .distance_calculation import query_distances, rank_metrics
+from .block_distances import tornado_deposit_sets
+
+FUSION_METHODS = ["rrf", "score"]
+
+class MultiRepresentation():
+    """Several representations (e.g. time of day, gas price and node embeddings) of the same addresses evaluated together.
+
+    Representations are aligned to a shared address index (the common addresses in the order of the first one; matrices with the same address order are used without copies). For each query the distances are calculated once per representation and every representation and fused ranking is evaluated from them: reciprocal rank fusion ('rrf') sums 1/(rrf_k + rank) over the representations, score fusion ('score') sums the distances standardized over the candidate set. Both are calculated within the candidate set of the query, so the filters of Tornado queries apply to the fused rankings as well."""
+    def __init__(self, a2v_objs, weights=None, rrf_k=60, score_norm="zscore", verbose=True):
+        if len(a2v_objs) == 0:
+            raise RuntimeError("No representations!")
+        if not score_norm in ["zscore", "minmax"]:
+            raise RuntimeError("Invalid score normalization: %s" % score_norm)
+        self.model_ids = list(a2v_objs.keys())
+        self.weights = dict((model_id, 1.0) for model_id in self.model_ids) if weights is None else weights
+        self.rrf_k = rrf_k
+        self.score_norm = score_norm
+        objs = list(a2v_objs.values())
+        reference = objs[0].addr_to_embedd
+        if all(obj.addr_to_embedd == reference for obj in objs):
+            self.addr_to_embedd = list(reference)
+            self.Xs = [obj.X for obj in objs]
+        else:
+            common = set(reference)
+            for obj in objs[1:]:
+                common &= set(obj.addr_to_embedd)
+            self.addr_to_embedd = [addr for addr in reference if addr in common]
+            self.Xs = [obj.X[[obj.addr2idx[addr] for addr in self.addr_to_embedd]] for obj in objs]
+        self.idx2addr = dict(enumerate(self.addr_to_embedd))
+        self.addr2idx = dict(zip(self.addr_to_embedd, range(len(self.addr_to_embedd))))
+        if verbose:
+            print("Aligned representations:", [(model_id, X.shape) for model_id, X in zip(self.model_ids, self.Xs)])
+
+    get_idx_pairs = Address2Vec.get_idx_pairs
+
+    def fusion_id(self, method):
+        return "%s-%s" % (method, "+".join(self.model_ids))
+
+    def distances(self, query_idx):
+        """Distances of every address from the query in each representation"""
+        return [query_distances(X, query_idx) for X in self.Xs]
+
+    def _fuse(self, dists, candidates, method):
+        """Fused dissimilarity of the candidates (lower is better): negative RRF score or weighted sum of standardized distances"""
+        fused = np.zeros(len(candidates))
+        for model_id, dist in zip(self.model_ids, dists):
+            w = self.weights.get(model_id, 0.0)
+            if w == 0.0:
+                continue
+            cand_dist = dist[candidates].astype("float64")
+            if method == "rrf":
+                # ties are ranked in index order as in rank_metrics
+                ranks = np.empty(len(candidates))
+                ranks[np.argsort(cand_dist, kind="stable")] = np.arange(1, len(candidates)+1)
+                fused -= w / (self.rrf_k + ranks)
+            else:
+                if self.score_norm == "zscore":
+                    center, scale = cand_dist.mean(), cand_dist.std()
+                else:
+                    center, scale = cand_dist.min(), cand_dist.max() - cand_dist.min()
+                fused += w * (cand_dist - center) / (scale if scale > 0 else 1.0)
+        return fused
+
+    def evaluate(self, dists, query_idx, target_idx, include_idx_mask=[], fusions=FUSION_METHODS):
+        """rank_metrics of the target for each representation and fusion method ([(rank, dist, set_size, rank_ratio, auc)] in the order of model_ids and fusions)"""
+        res = [rank_metrics(dist, query_idx, target_idx, include_idx_mask) for dist in dists]
+        if len(fusions) == 0:
+            return res
+        N = len(dists[0])
+        if len(include_idx_mask) > 0:
+            in_set = np.zeros(N, dtype=bool)
+            in_set[np.asarray(include_idx_mask, dtype="int64")] = True
+        else:
+            in_set = np.ones(N, dtype=bool)
+        in_set[query_idx] = False
+        candidates = np.where(in_set)[0]
+        for method in fusions:
+            if not method in FUSION_METHODS:
+                raise RuntimeError("Invalid fusion method: %s" % method)
+            if not in_set[target_idx]:
+                res.append((None, None, len(candidates), None, None))
+                continue
+            fused = np.full(N, np.inf)
+            fused[candidates] = self._fuse(dists, candidates, method)
+            res.append(rank_metrics(fused, query_idx, target_idx, candidates))
+        return res
+
+    def _result_frame(self, records, columns, fusions):
+        """Result DataFrame in the schema of Address2Vec.run_ens/run_tornado with the representations and fusions stacked"""
+        model_ids = self.model_ids + [self.fusion_id(method) for method in fusions]
+        parts = []
+        for i, model_id in enumerate(model_ids):
+            df = pd.DataFrame([record[i] for record in records], columns=columns)
+            df["embedding_id"] = model_id
+            parts.append(df)
+        return pd.concat(parts)
+
+    def run_ens(self, idx_pairs, fusions=FUSION_METHODS):
+        """Address2Vec.run_ens for every representation and fusion method"""
+        records = []
+        for pair in idx_pairs:
+            res = self.evaluate(self.distances(pair[1]), pair[1], pair[0], fusions=fusions)
+            records.append([(pair[1], pair[0]) + tuple(metrics) + ("none",) for metrics in res])
+        df = self._result_frame(records, ["query_idx", "target_idx", "rank", "dist", "set_size", "rank_ratio", "auc", "filter"], fusions)
+        df["query_addr"] = df["query_idx"].apply(lambda x: self.idx2addr[x])
+        df["target_addr"] = df["target_idx"].apply(lambda x: self.idx2addr[x])
+        return df.drop(["query_idx","target_idx"], axis=1)
+
+    def run_tornado(self, query_objects, filters=["none", "past", "week", "day"], fusions=FUSION_METHODS):
+        """Address2Vec.run_tornado for every representation and fusion method. Distances of a withdrawal are reused for every filter."""
+        deposit_sets = tornado_deposit_sets(self, query_objects, filters)
+        res = []
+        for tq_idx, tq in enumerate(query_objects):
+            records = []
+            dists, last_idx = None, None
+            for timestamp, w_idx, d_idx, f_id, d_set_idx, size_1 in deposit_sets[tq_idx]:
+                if w_idx != last_idx:
+                    dists, last_idx = self.distances(w_idx), w_idx
+                metrics = self.evaluate(dists, w_idx, d_idx, d_set_idx, fusions)
+                records.append([(timestamp, w_idx, d_idx, rank, dist, max(size_1, size_2), rank_ratio, auc, f_id) for rank, dist, size_2, rank_ratio, auc in metrics])
+            df = self._result_frame(records, ["timestamp","query_idx","target_idx","rank","dist","set_size","rank_ratio","auc","filter"], fusions)
+            df["mixer"] = tq.mixer_str_value
+            res.append(df)
+        df = pd.concat(res)
+        df["query_addr"] = df["query_idx"].apply(lambda x: self.idx2addr[x])
+        df["target_addr"] = df["target_idx"].apply(lambda x: self.idx2addr[x])
+        return df.drop(["query_idx","target_idx"], axis=1)
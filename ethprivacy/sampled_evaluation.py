@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+from .distance_calculation import compute_dtype, query_distances, rank_metrics
+from .tornado_mixer import get_deposit_indices
+from .sharding import TornadoQuerySubset
+
+### Sampling ###
+
+def allocate_sample(stratum_sizes, sample_size, min_per_stratum=2):
+    """Proportional allocation of 'sample_size' units to strata ({stratum: population size}) with at least 'min_per_stratum' units (or the whole stratum) in each stratum"""
+    total = sum(stratum_sizes.values())
+    allocation = {}
+    for stratum, size in stratum_sizes.items():
+        n = int(round(sample_size * size / total)) if total > 0 else 0
+        allocation[stratum] = min(size, max(n, min_per_stratum))
+    return allocation
+
+def sample_ens_pairs(a2v_obj, api, sample_size, min_cnt=2, max_cnt=2, mirror=True, seed=None):
+    """Stratified sample of the ENS address pairs of Address2Vec.get_idx_pairs. Strata are the number of addresses of the ENS name. Returns the sampled (query, target) index pairs and the sampling design (query_addr, target_addr, stratum, stratum_size)."""
+    rng = np.random.default_rng(seed)
+    pairs_by_stratum = {}
+    for cnt in range(min_cnt, max_cnt+1):
+        idx_pairs, _ = a2v_obj.get_idx_pairs(api, min_cnt=cnt, max_cnt=cnt, mirror=mirror)
+        if len(idx_pairs) > 0:
+            pairs_by_stratum[cnt] = idx_pairs
+    allocation = allocate_sample(dict((cnt, len(pairs)) for cnt, pairs in pairs_by_stratum.items()), sample_size)
+    sampled, design = [], []
+    for cnt, idx_pairs in pairs_by_stratum.items():
+        selected = idx_pairs[np.sort(rng.choice(len(idx_pairs), allocation[cnt], replace=False))]
+        sampled.append(selected)
+        for target_idx, query_idx in selected:
+            design.append((a2v_obj.idx2addr[query_idx], a2v_obj.idx2addr[target_idx], cnt, len(idx_pairs)))
+    idx_pairs = np.concatenate(sampled) if len(sampled) > 0 else np.zeros((0,2), dtype="int64")
+    return idx_pairs, pd.DataFrame(design, columns=["query_addr", "target_addr", "stratum", "stratum_size"])
+
+def sample_tornado_queries(a2v_obj, query_objects, sample_size, seed=None):
+    """Random sample of 'sample_size' distinct (deposit, withdraw) address pairs of each mixer, the unit of get_avg_rank. Every evaluable withdraw-deposit tuple of the sampled pairs is kept (and every filter is evaluated for them), so pairs with many tuples are not oversampled. Returns TornadoQuerySubset objects and the sampling design (mixer, stratum, stratum_size) with the number of distinct pairs as stratum size."""
+    rng = np.random.default_rng(seed)
+    subsets, design = [], []
+    for tq in query_objects:
+        tuples = [tup for tup in tq.tornado_tuples if tup[0] in a2v_obj.addr2idx and tup[1] in a2v_obj.addr2idx]
+        if len(tuples) == 0:
+            continue
+        pairs = list(dict.fromkeys((tup[0], tup[1]) for tup in tuples))
+        n = min(len(pairs), sample_size)
+        selected = set(pairs[i] for i in rng.choice(len(pairs), n, replace=False))
+        subsets.append(TornadoQuerySubset(tq, [tup for tup in tuples if (tup[0], tup[1]) in selected]))
+        design.append((tq.mixer_str_value, tq.mixer_str_value, len(pairs)))
+    return subsets, pd.DataFrame(design, columns=["mixer", "stratum", "stratum_size"])
+
+### Ranking ###
+
+def sampled_rank_metrics(X, query_idx, target_idx, num_candidates=None, rng=None):
+    """Unbiased estimates of rank_metrics for the unfiltered candidate set (every address except the query) based on 'num_candidates' uniformly sampled candidates. Exact metrics are returned if the candidate set is not larger than the sample."""
+    N = X.shape[0]
+    if num_candidates is None or N - 2 <= num_candidates or target_idx == query_idx:
+        return rank_metrics(query_distances(X, query_idx), query_idx, target_idx)
+    if rng is None:
+        rng = np.random.default_rng()
+    # sample candidates without the query and the target
+    a, b = min(query_idx, target_idx), max(query_idx, target_idx)
+    candidates = rng.choice(N - 2, num_candidates, replace=False)
+    candidates += (candidates >= a)
+    candidates += (candidates >= b)
+    dtype = compute_dtype(X)
+    query = X[query_idx,:].astype(dtype)
+    dist = np.sqrt(np.sum(np.square(X[candidates].astype(dtype, copy=False) - query), axis=1))
+    target_dist = np.sqrt(np.sum(np.square(X[target_idx,:].astype(dtype) - query)))
+    if np.isnan(dist).sum() > 0 or np.isnan(target_dist):
+        raise RuntimeError("Representation matrix contains nans!")
+    set_size = N - 1
+    scale = (set_size - 1) / num_candidates
+    closer = np.sum(dist < target_dist) * scale
+    ties = np.sum(dist == target_dist) * scale
+    ties_before = np.sum((dist == target_dist) & (candidates < target_idx)) * scale
+    farther = (set_size - 1) - closer - ties
+    rank = 1 + closer + ties_before
+    auc = (farther + 0.5 * ties) / (set_size - 1)
+    return rank, target_dist, set_size, rank / set_size, auc
+
+def run_sampled_ens(a2v_obj, idx_pairs, design, model_id, num_candidates=None, seed=None):
+    """Address2Vec.run_ens for the sampled pairs of sample_ens_pairs. With 'num_candidates' the ranks are estimated from a candidate sample."""
+    rng = np.random.default_rng(seed)
+    records = []
+    for pair in idx_pairs:
+        rank, dist, num_set, rank_ratio, auc = sampled_rank_metrics(a2v_obj.X, pair[1], pair[0], num_candidates, rng)
+        records.append((pair[1], pair[0], rank, dist, num_set, rank_ratio, auc, "none"))
+    df = pd.DataFrame(records, columns=["query_idx", "target_idx", "rank", "dist", "set_size", "rank_ratio", "auc", "filter"])
+    df["embedding_id"] = model_id
+    df["query_addr"] = df["query_idx"].apply(lambda x: a2v_obj.idx2addr[x])
+    df["target_addr"] = df["target_idx"].apply(lambda x: a2v_obj.idx2addr[x])
+    df = df.drop(["query_idx","target_idx"], axis=1)
+    # a pair of addresses may share ENS names of different sizes
+    design = design.drop_duplicates(["query_addr", "target_addr"])
+    return df.merge(design, on=["query_addr", "target_addr"], how="left")
+
+def run_sampled_tornado(a2v_obj, query_subsets, design, model_id, filters=["none", "past", "week", "day"], num_candidates=None, seed=None):
+    """Address2Vec.run_tornado for the sampled tuples of sample_tornado_queries. With 'num_candidates' the ranks of the 'none' filter are estimated from a candidate sample."""
+    rng = np.random.default_rng(seed)
+    res = []
+    for tq in query_subsets:
+        records = []
+        for tup in tq.tornado_tuples:
+            d_idx, w_idx = a2v_obj.addr2idx[tup[0]], a2v_obj.addr2idx[tup[1]]
+            for f_id in filters:
+                d_set_idx, size_1 = get_deposit_indices(a2v_obj, tq, tup, f_id)
+                if len(d_set_idx) == 0:
+                    rank, dist, size_2, rank_ratio, auc = sampled_rank_metrics(a2v_obj.X, w_idx, d_idx, num_candidates, rng)
+                else:
+                    rank, dist, size_2, rank_ratio, auc = rank_metrics(query_distances(a2v_obj.X, w_idx), w_idx, d_idx, d_set_idx)
+                records.append((tup[3], w_idx, d_idx, rank, dist, max(size_1, size_2), rank_ratio, auc, f_id))
+        df = pd.DataFrame(records, columns=["timestamp","query_idx","target_idx","rank","dist","set_size","rank_ratio","auc","filter"])
+        df["embedding_id"] = model_id
+        df["mixer"] = tq.mixer_str_value
+        res.append(df)
+    df = pd.concat(res)
+    df["query_addr"] = df["query_idx"].apply(lambda x: a2v_obj.idx2addr[x])
+    df["target_addr"] = df["target_idx"].apply(lambda x: a2v_obj.idx2addr[x])
+    df = df.drop(["query_idx","target_idx"], axis=1)
+    return df.merge(design, on="mixer", how="left")
+
+### Estimation ###
+
+def get_sampled_avg_rank(df, keys=["embedding_id", "filter"], confidence=0.95):
+    """get_avg_rank for stratified samples: stratified mean estimates with normal confidence intervals ('<metric>_ci_low', '<metric>_ci_high') for each key group. The 'stratum' and 'stratum_size' columns of the sampling design are required. The intervals cover the sampling of pairs; candidate sampling only adds to the within stratum variance."""
+    keys = list(keys)
+    target_cols = ["rank","set_size"]
+    if "mixer" in df.columns and "mixer" not in keys:
+        keys.append("mixer")
+    for col in ["rank_ratio","auc"]:
+        if col in df.columns:
+            target_cols.append(col)
+    # aggregate for independent experiments
+    mean_result = df.groupby(["query_addr", "target_addr", "stratum", "stratum_size"]+keys)[target_cols].mean().reset_index()
+    from scipy.stats import norm
+    z = norm.ppf(0.5 + confidence / 2)
+    records = []
+    for key_values, group in mean_result.groupby(keys):
+        key_values = key_values if isinstance(key_values, tuple) else (key_values,)
+        strata = group.groupby("stratum")
+        n_h = strata.size()
+        N_h = strata["stratum_size"].first()
+        W_h = N_h / N_h.sum()
+        fpc = (1.0 - n_h / N_h).clip(lower=0.0)
+        record = list(key_values)
+        for col in target_cols:
+            mean_h = strata[col].mean()
+            var_h = strata[col].var(ddof=1).fillna(0.0)
+            estimate = (W_h * mean_h).sum()
+            # ranks are missing if the target is not in the candidate set
+            std_err = np.sqrt((W_h**2 * fpc * var_h / strata[col].count().clip(lower=1)).sum())
+            record += [estimate, estimate - z * std_err, estimate + z * std_err]
+        record.append(len(group))
+        records.append(record)
+    columns = list(keys)
+    for col in target_cols:
+        columns += [col, "%s_ci_low" % col, "%s_ci_high" % col]
+    perf = pd.DataFrame(records, columns=columns+["num_samples"])
+    return perf, mean_result
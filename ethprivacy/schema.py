@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+# Declared columns (and compact dtypes) of the tables that are used by the package.
+# Columns that are not listed here are not loaded at all with EntityAPI(..., compact=True).
+# Preprocessed features keep the dtypes of pandas type inference, so results do not
+# depend on the file format.
+TABLE_SCHEMAS = {
+    "ens_pairs": {
+        "name": "object",
+        "address": "object",
+    },
+    "raw_normal_txs": {
+        "timeStamp": "int64",
+        "hash": "object",
+        "nonce": "float64",
+        "from": "object",
+        "to": "object",
+        "value": "float64",
+        "gasPrice": "float64",
+        "isError": "float32",
+        "tx_type": "category",
+    },
+    "raw_token_txs": {
+        "timeStamp": "int64",
+        "hash": "object",
+        "nonce": "float64",
+        "from": "object",
+        "to": "object",
+        "contractAddress": "object",
+        "value": "float64",
+        "gasPrice": "float64",
+    },
+    "tornado_history": {
+        "txHash": "object",
+        "timeStamp": "int64",
+        "action": "category",
+        "account": "object",
+    },
+    "tornado_heuristics": {
+        "sender": "object",
+        "receiver": "object",
+        "withdHash": "object",
+    },
+    "filtered_data": {
+        "timeStamp": "int64",
+        "from": "object",
+        "to": "object",
+        "hash": "object",
+        "gasPrice": "float64",
+        "tx_type": "category",
+        "day": "int64",
+        "hour": "int64",
+        "gasPrice_addr": "float64",
+        "normalized_gas": "float64",
+    },
+}
+
+# Columns of preprocessed events needed by Address2Vec
+ADDRESS2VEC_COLUMNS = ["from", "hash", "hour", "normalized_gas"]
+
+def read_table(file_path, table, columns=None):
+    """Load a csv file with the declared schema of the given table. Provide 'columns' to load only a subset of the declared columns."""
+    if not table in TABLE_SCHEMAS:
+        raise RuntimeError("Invalid table: %s" % table)
+    schema = TABLE_SCHEMAS[table]
+    if columns is None:
+        columns = list(schema.keys())
+    else:
+        for col in columns:
+            if not col in schema:
+                raise RuntimeError("Column '%s' is not declared for table '%s'!" % (col, table))
+    selected = set(columns)
+    dtypes = dict((col, schema[col]) for col in columns)
+    # round-trip parsing keeps the exact values written by to_csv (as in the EventColumns export)
+    return pd.read_csv(file_path, usecols=lambda col: col in selected, dtype=dtypes, float_precision="round_trip")
+
+class EventColumns():
+    """Preprocessed events stored as one .npy file per column in a folder. Address columns are int32 codes of the sorted address dictionary 'addresses.json' (-1 for missing addresses), numeric columns keep their full precision. Columns are memory mapped when they are first accessed, so loading takes no time and forked workers share the same pages."""
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap_mode = "r" if mmap else None
+        with open(os.path.join(path, "columns.json")) as f:
+            meta = json.load(f)
+        self.columns = meta["columns"]
+        self.address_columns = meta["address_columns"]
+        self.num_rows = meta["num_rows"]
+        with open(os.path.join(path, "addresses.json")) as f:
+            self.addresses = json.load(f)
+        self._arrays = {}
+
+    def __getitem__(self, col):
+        """Column values (address codes for address columns) without copies"""
+        if not col in self.columns:
+            raise RuntimeError("Column '%s' is not available in %s!" % (col, self.path))
+        if not col in self._arrays:
+            self._arrays[col] = np.load(os.path.join(self.path, "%s.npy" % col), mmap_mode=self.mmap_mode)
+        return self._arrays[col]
+
+    def __contains__(self, col):
+        return col in self.columns
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def shape(self):
+        return (self.num_rows, len(self.columns))
+
+    def memory_usage(self, index=True, deep=True):
+        """Size of the columns in bytes (for memory_footprint)"""
+        return pd.Series(dict((col, self[col].nbytes) for col in self.columns))
+
+    def to_frame(self, columns=None):
+        """DataFrame copy of the given columns with decoded addresses"""
+        if columns is None:
+            columns = self.columns
+        addresses = np.array(self.addresses + [None], dtype=object)
+        data = {}
+        for col in columns:
+            data[col] = addresses[self[col]] if col in self.address_columns else np.asarray(self[col])
+        return pd.DataFrame(data)
+
+def write_columns(df, path, address_columns=["from", "to"], columns=None):
+    """Export the address columns and the numeric columns (every numeric column by default) of a DataFrame as EventColumns. The folder is replaced atomically."""
+    if columns is None:
+        columns = [col for col in df.columns if col in address_columns or pd.api.types.is_numeric_dtype(df[col])]
+    address_columns = [col for col in address_columns if col in columns]
+    values = pd.concat([df[col] for col in address_columns]).dropna().unique() if len(address_columns) > 0 else []
+    addresses = sorted(values)
+    tmp_path = "%s.%i.tmp" % (path.rstrip("/"), os.getpid())
+    os.makedirs(tmp_path)
+    for col in columns:
+        if col in address_columns:
+            arr = pd.Categorical(df[col], categories=addresses).codes.astype("int32")
+        else:
+            arr = df[col].values
+        np.save(os.path.join(tmp_path, "%s.npy" % col), arr)
+    with open(os.path.join(tmp_path, "addresses.json"), "w") as f:
+        json.dump(addresses, f)
+    with open(os.path.join(tmp_path, "columns.json"), "w") as f:
+        json.dump({"columns": list(columns), "address_columns": address_columns, "num_rows": len(df)}, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+def memory_footprint(tables):
+    """Report the memory usage (in MB) of the given named tables"""
+    records = []
+    for name, df in tables.items():
+        size = df.memory_usage(index=True, deep=True).sum() / 1024**2
+        records.append((name, df.shape[0], df.shape[1], size))
+    return pd.DataFrame(records, columns=["table", "rows", "columns", "memory_mb"])
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
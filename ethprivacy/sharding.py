@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+import pandas as pd
+
+def items_fingerprint(items):
+    """Checksum of the evaluated items to detect manifest mismatch"""
+    sha = hashlib.sha1()
+    for item in items:
+        sha.update(("|".join(str(value) for value in item) + "\n").encode("utf-8"))
+    return sha.hexdigest()
+
+class ShardManifest():
+    """Split evaluation items into deterministic shards inside a (possibly shared) work directory.
+
+    Shards are claimed with atomically created lock files, so that multiple processes or hosts can pull work from the same directory. Finished shards are persisted as pickled DataFrames and skipped on re-runs. Workers touch their locks every 'heartbeat' seconds, so locks that were not refreshed for 'lock_timeout' seconds are considered stale (e.g. crashed worker) and can be claimed again. Additional 'params' of the evaluation (e.g. model and sample id) are part of the manifest."""
+    def __init__(self, work_dir, items, shard_size=1000, lock_timeout=600, heartbeat=60, params=None, verbose=True):
+        self.work_dir = work_dir
+        self.shard_size = shard_size
+        self.lock_timeout = lock_timeout
+        self.heartbeat = min(heartbeat, lock_timeout / 4.0)
+        self.verbose = verbose
+        self.num_items = len(items)
+        self.num_shards = (self.num_items + shard_size - 1) // shard_size
+        self.worker_id = "%s-%i" % (socket.gethostname(), os.getpid())
+        if not os.path.exists(work_dir):
+            os.makedirs(work_dir, exist_ok=True)
+        manifest = {"num_items": self.num_items, "shard_size": shard_size, "num_shards": self.num_shards, "fingerprint": items_fingerprint(items), "params": {} if params is None else params}
+        # compare in the JSON form of the stored manifest
+        self._init_manifest(json.loads(json.dumps(manifest)))
+
+    def _init_manifest(self, manifest):
+        path = os.path.join(self.work_dir, "manifest.json")
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f)
+        except FileExistsError:
+            # wait for the creator to finish writing
+            for _ in range(100):
+                with open(path) as f:
+                    content = f.read()
+                if len(content) > 0:
+                    break
+                time.sleep(0.1)
+            existing = json.loads(content)
+            if existing != manifest:
+                raise RuntimeError("Shard manifest mismatch in %s: %s != %s" % (self.work_dir, existing, manifest))
+
+    def shard_range(self, shard_id):
+        start = shard_id * self.shard_size
+        return start, min(start + self.shard_size, self.num_items)
+
+    def _path(self, shard_id, ext):
+        return os.path.join(self.work_dir, "shard_%06i.%s" % (shard_id, ext))
+
+    def is_done(self, shard_id):
+        return os.path.exists(self._path(shard_id, "pkl"))
+
+    def pending_shards(self):
+        return [shard_id for shard_id in range(self.num_shards) if not self.is_done(shard_id)]
+
+    def _is_stale(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) > self.lock_timeout
+        except FileNotFoundError:
+            return False
+
+    def _remove_stale(self, lock_path):
+        """Take a stale lock out of the way with an atomic rename, so only one worker can remove it"""
+        if not self._is_stale(lock_path):
+            return
+        stale_path = "%s.%s.stale" % (lock_path, self.worker_id)
+        try:
+            os.rename(lock_path, stale_path)
+        except FileNotFoundError:
+            return
+        if not self._is_stale(stale_path):
+            # another worker has taken over in the meantime: restore its lock unless a new one exists
+            try:
+                os.link(stale_path, lock_path)
+            except FileExistsError:
+                pass
+        os.remove(stale_path)
+
+    def _acquire(self, lock_path):
+        self._remove_stale(lock_path)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(self.worker_id)
+        return True
+
+    @contextmanager
+    def _keep_alive(self, lock_path):
+        """Touch the lock periodically while the block is running"""
+        stop = threading.Event()
+        def touch():
+            while not stop.wait(self.heartbeat):
+                try:
+                    os.utime(lock_path)
+                except FileNotFoundError:
+                    pass
+        thread = threading.Thread(target=touch, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def claim(self, shard_id):
+        """Try to claim a shard. Returns False if the shard is finished or claimed by another worker."""
+        if self.is_done(shard_id):
+            return False
+        lock_path = self._path(shard_id, "lock")
+        if not self._acquire(lock_path):
+            return False
+        # the shard may have been finished since the first check
+        if self.is_done(shard_id):
+            os.remove(lock_path)
+            return False
+        return True
+
+    def complete(self, shard_id, result_df):
+        """Persist the result of a shard (atomic rename) and release its lock"""
+        tmp_path = self._path(shard_id, "pkl.%s.tmp" % self.worker_id)
+        result_df.to_pickle(tmp_path)
+        os.replace(tmp_path, self._path(shard_id, "pkl"))
+        try:
+            os.remove(self._path(shard_id, "lock"))
+        except FileNotFoundError:
+            pass
+
+    def release(self, shard_id):
+        try:
+            os.remove(self._path(shard_id, "lock"))
+        except FileNotFoundError:
+            pass
+
+    def claim_collection(self):
+        """Only one worker at a time is allowed to collect (and export) the merged results"""
+        return self._acquire(os.path.join(self.work_dir, "collect.lock"))
+
+    def release_collection(self):
+        """Release the collection lock once the merged results are exported, so that re-runs can collect them again"""
+        try:
+            os.remove(os.path.join(self.work_dir, "collect.lock"))
+        except FileNotFoundError:
+            pass
+
+    def is_exported(self):
+        return os.path.exists(os.path.join(self.work_dir, "exported"))
+
+    def mark_exported(self):
+        """Record that the merged results were exported, so that re-runs do not export them again"""
+        tmp_path = os.path.join(self.work_dir, "exported.%s.tmp" % self.worker_id)
+        with open(tmp_path, "w") as f:
+            f.write(self.worker_id)
+        os.replace(tmp_path, os.path.join(self.work_dir, "exported"))
+
+    def collect(self):
+        """Merge shard results in shard order (None if some shards are not finished yet)"""
+        if len(self.pending_shards()) > 0:
+            return None
+        parts = [pd.read_pickle(self._path(shard_id, "pkl")) for shard_id in range(self.num_shards)]
+        if len(parts) == 0:
+            return pd.DataFrame()
+        return pd.concat(parts, ignore_index=True)
+
+    def run(self, compute_shard):
+        """Process every claimable shard with 'compute_shard(start, end)' that returns a result DataFrame"""
+        processed = 0
+        for shard_id in range(self.num_shards):
+            if not self.claim(shard_id):
+                continue
+            start, end = self.shard_range(shard_id)
+            try:
+                with self._keep_alive(self._path(shard_id, "lock")):
+                    result_df = compute_shard(start, end)
+            except BaseException:
+                self.release(shard_id)
+                raise
+            self.complete(shard_id, result_df)
+            processed += 1
+            if self.verbose:
+                print("%s finished shard %i/%i" % (self.worker_id, shard_id+1, self.num_shards))
+        return processed
+
+def run_workers(manifest, compute_shard, num_workers=1):
+    """Process shards with multiple local processes (forked workers share the loaded data)"""
+    if num_workers <= 1:
+        manifest.run(compute_shard)
+        return
+    ctx = multiprocessing.get_context("fork")
+    def work():
+        manifest.worker_id = "%s-%i" % (socket.gethostname(), os.getpid())
+        manifest.run(compute_shard)
+    workers = [ctx.Process(target=work) for _ in range(num_workers)]
+    for proc in workers:
+        proc.start()
+    for proc in workers:
+        proc.join()
+    for proc in workers:
+        if proc.exitcode != 0:
+            raise RuntimeError("Shard worker failed with exit code %i" % proc.exitcode)
+
+def _finish(manifest, exclusive, export):
+    """Merge the finished shards. The results are exported only once (by the worker that holds the collection lock), re-runs of a finished manifest just return them."""
+    if len(manifest.pending_shards()) > 0:
+        return None
+    if not exclusive and (export is None or manifest.is_exported()):
+        return manifest.collect()
+    if not manifest.claim_collection():
+        return None if exclusive else manifest.collect()
+    try:
+        with manifest._keep_alive(os.path.join(manifest.work_dir, "collect.lock")):
+            result_df = manifest.collect()
+            if export is not None and not manifest.is_exported():
+                export(result_df)
+                manifest.mark_exported()
+    finally:
+        manifest.release_collection()
+    return result_df
+
+class TornadoQuerySubset():
+    """Subset of the heuristic tuples of a TornadoQueries object"""
+    def __init__(self, tq, tornado_tuples):
+        self.tq = tq
+        self.mixer_str_value = tq.mixer_str_value
+        self.tornado_tuples = tornado_tuples
+
+    def get_possible_deposits(self, tornado_tuple, time_interval=None):
+        return self.tq.get_possible_deposits(tornado_tuple, time_interval)
+
+def run_sharded_ens(a2v_obj, idx_pairs, model_id, work_dir, shard_size=1000, num_workers=1, exclusive=False, params=None, export=None, verbose=True):
+    """Checkpointed version of Address2Vec.run_ens. The merged results are passed to 'export' (if set) once by the collecting worker. Returns None while shards are unfinished (e.g. processed by other hosts) or, with exclusive=True, if another worker is collecting the results."""
+    manifest = ShardManifest(work_dir, idx_pairs, shard_size=shard_size, params=params, verbose=verbose)
+    compute_shard = lambda start, end: a2v_obj.run_ens(idx_pairs[start:end], model_id)
+    run_workers(manifest, compute_shard, num_workers)
+    return _finish(manifest, exclusive, export)
+
+def run_sharded_tornado(a2v_obj, query_objects, model_id, work_dir, filters=["none", "past", "week", "day"], shard_size=100, num_workers=1, exclusive=False, params=None, export=None, verbose=True):
+    """Checkpointed version of Address2Vec.run_tornado with shards of withdraw-deposit tuples. The merged results are passed to 'export' (if set) once by the collecting worker. Returns None while shards are unfinished or, with exclusive=True, if another worker is collecting the results."""
+    items = [(tq_idx, tup) for tq_idx, tq in enumerate(query_objects) for tup in tq.tornado_tuples]
+    fingerprint_items = [(query_objects[tq_idx].mixer_str_value,) + tuple(tup) for tq_idx, tup in items]
+    manifest = ShardManifest(work_dir, fingerprint_items, shard_size=shard_size, params=params, verbose=verbose)
+    def compute_shard(start, end):
+        subsets = []
+        for tq_idx, tq in enumerate(query_objects):
+            tuples = [tup for idx, tup in items[start:end] if idx == tq_idx]
+            if len(tuples) > 0:
+                subsets.append(TornadoQuerySubset(tq, tuples))
+        return a2v_obj.run_tornado(subsets, model_id, filters=filters)
+    run_workers(manifest, compute_shard, num_workers)
+    return _finish(manifest, exclusive, export)
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+# timestamps are stored in the lower 32 bits of the adjacency keys
+_TIME_BITS = 32
+_MAX_TIME = 2**_TIME_BITS - 1
+
+def _expand_ranges(starts, ends):
+    """Positions of the concatenated [start, end) ranges and the range id of each position"""
+    counts = ends - starts
+    total = int(counts.sum())
+    range_ids = np.repeat(np.arange(len(starts)), counts)
+    positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+    return positions, range_ids
+
+class TemporalGraphIndex():
+    """Timestamped adjacency of the EntityAPI transaction graphs for multi-hop queries.
+
+    Edges of every node are sorted by time in a single array with (node, timestamp) keys, so the edges of a whole BFS frontier within per-node time windows are found with two vectorized binary searches. The reversed adjacency is used to follow edges backwards in time."""
+    def __init__(self, api, graphs=["normal_graph", "token_graph", "contract_graph", "rev_contract_graph"], verbose=True):
+        self.graphs = list(graphs)
+        parts = []
+        for graph_id, name in enumerate(self.graphs):
+            table, source_col, target_col = api.graph_endpoints[name]
+            df = getattr(api, table)[[source_col, target_col, "timeStamp"]].dropna()
+            df.columns = ["src", "trg", "timeStamp"]
+            df["graph"] = graph_id
+            parts.append(df)
+        edges = pd.concat(parts, ignore_index=True)
+        codes, self.addresses = pd.factorize(pd.concat([edges["src"], edges["trg"]], ignore_index=True))
+        self.addr2idx = dict(zip(self.addresses, range(len(self.addresses))))
+        self._src = codes[:len(edges)].astype("int64")
+        self._trg = codes[len(edges):].astype("int64")
+        self._time = edges["timeStamp"].values.astype("int64")
+        if len(self._time) > 0 and (self._time.min() < 0 or self._time.max() >= _MAX_TIME):
+            raise RuntimeError("Timestamps out of range!")
+        self._graph = edges["graph"].values.astype("int8")
+        self._adjacency = {}
+        if verbose:
+            print("Temporal graph index: %i nodes, %i edges" % (len(self.addresses), len(edges)))
+
+    def _get_adjacency(self, direction):
+        """Edge keys sorted by (node, time), the other endpoints, times and graph ids for 'out' or 'in' edges. For 'in' edges time is reversed so both directions are queried with increasing time."""
+        if not direction in self._adjacency:
+            if direction == "out":
+                node, other, time = self._src, self._trg, self._time
+            elif direction == "in":
+                node, other, time = self._trg, self._src, _MAX_TIME - self._time
+            else:
+                raise RuntimeError("Invalid direction: %s" % direction)
+            keys = (node << _TIME_BITS) | time
+            order = np.argsort(keys, kind="stable")
+            self._adjacency[direction] = (keys[order], other[order], time[order], self._graph[order])
+        return self._adjacency[direction]
+
+    def multi_hop(self, addresses, hops=2, direction="out", start_time=None, min_time=None, max_time=None, min_gap=0, max_gap=None, max_edges_per_node=None, max_results=100000, targets=None):
+        """Addresses reachable from the given addresses by time-respecting paths of at most 'hops' transactions.
+
+        With direction='out' every hop occurs at least 'min_gap' and at most 'max_gap' seconds after the previous one (the first hop after 'start_time'); with direction='in' paths are followed backwards in time. Nodes are expanded again only if they are reached earlier (later for 'in') than before, so the result contains the earliest arrival path of every address (with 'max_gap' paths that need a later arrival are not followed). At most 'max_edges_per_node' edges (the earliest ones) are followed from a node. The search stops when 'max_results' addresses or every address of 'targets' are reached. Returns a DataFrame with address, hop, time (of the earliest arrival), parent (previous address of the path) and graph (of the last hop) columns."""
+        keys, other, time, graph = self._get_adjacency(direction)
+        # the time of 'in' queries is reversed
+        to_internal = (lambda t: t) if direction == "out" else (lambda t: _MAX_TIME - t)
+        lower_bound, upper_bound = min_time, max_time
+        if direction == "in":
+            lower_bound, upper_bound = max_time, min_time
+        lower_bound = 0 if lower_bound is None else to_internal(lower_bound)
+        upper_bound = _MAX_TIME if upper_bound is None else to_internal(upper_bound)
+        sources = np.array([self.addr2idx[addr] for addr in addresses if addr in self.addr2idx], dtype="int64")
+        start = lower_bound if start_time is None else max(lower_bound, to_internal(start_time))
+        # hop, earliest internal arrival time, parent and graph id of the reached nodes
+        N = len(self.addresses)
+        unreached = _MAX_TIME + 1
+        best_time = np.full(N, unreached, dtype="int64")
+        best_hop = np.full(N, -1, dtype="int64")
+        best_parent = np.full(N, -1, dtype="int64")
+        best_graph = np.full(N, -1, dtype="int64")
+        best_time[sources] = start
+        best_hop[sources] = 0
+        num_reached = len(np.unique(sources))
+        target_idx = None if targets is None else np.array([self.addr2idx[addr] for addr in targets if addr in self.addr2idx], dtype="int64")
+        frontier = np.unique(sources)
+        frontier_time = np.full(len(frontier), start, dtype="int64")
+        # source addresses can be left at their start time, later hops need 'min_gap' seconds
+        gap = 0
+        for hop in range(1, hops+1):
+            if len(frontier) == 0 or num_reached >= max_results:
+                break
+            if target_idx is not None and (best_hop[target_idx] >= 0).all():
+                break
+            window_start = np.maximum(frontier_time + gap, lower_bound)
+            window_end = np.full(len(frontier), upper_bound, dtype="int64")
+            if max_gap is not None:
+                window_end = np.minimum(window_end, frontier_time + max_gap)
+            lo = np.searchsorted(keys, (frontier << _TIME_BITS) | np.clip(window_start, 0, _MAX_TIME), side="left")
+            hi = np.searchsorted(keys, (frontier << _TIME_BITS) | np.clip(window_end, 0, _MAX_TIME), side="right")
+            hi = np.where((window_end >= window_start) & (window_start <= _MAX_TIME), hi, lo)
+            if max_edges_per_node is not None:
+                hi = np.minimum(hi, lo + max_edges_per_node)
+            positions, range_ids = _expand_ranges(lo, hi)
+            if len(positions) == 0:
+                break
+            # earliest arrival of each node in this hop
+            nodes, times = other[positions], time[positions]
+            order = np.lexsort((nodes, times))
+            nodes, times, positions, range_ids = nodes[order], times[order], positions[order], range_ids[order]
+            _, first = np.unique(nodes, return_index=True)
+            first = np.sort(first)
+            nodes, times, positions, range_ids = nodes[first], times[first], positions[first], range_ids[first]
+            # only earlier arrivals can reach new addresses
+            improved = times < best_time[nodes]
+            is_new = best_time[nodes] == unreached
+            # new addresses beyond 'max_results' are dropped (the earliest ones are kept)
+            num_allowed = max_results - num_reached
+            dropped = is_new & (np.cumsum(is_new) > num_allowed)
+            selected = improved & ~dropped
+            nodes, times = nodes[selected], times[selected]
+            best_time[nodes] = times
+            best_hop[nodes] = hop
+            best_parent[nodes] = frontier[range_ids[selected]]
+            best_graph[nodes] = graph[positions[selected]]
+            num_reached += int((is_new & selected).sum())
+            frontier, frontier_time = nodes, times
+            gap = min_gap
+        found = np.where(best_hop >= 0)[0]
+        df = pd.DataFrame({"address": self.addresses[found], "hop": best_hop[found], "time": best_time[found]})
+        df["time"] = [to_internal(t) if hop > 0 else start_time for hop, t in zip(df["hop"], df["time"])]
+        df["parent"] = [self.addresses[idx] if idx >= 0 else None for idx in best_parent[found]]
+        df["graph"] = [self.graphs[idx] if idx >= 0 else None for idx in best_graph[found]]
+        return df.sort_values(["hop", "time"], kind="stable").reset_index(drop=True)
+
+def reconstruct_path(result_df, address):
+    """Addresses of the path from a source to the given address in a multi_hop result"""
+    parents = dict(zip(result_df["address"], result_df["parent"]))
+    path = [address]
+    while parents.get(path[-1]) is not None and not parents[path[-1]] in path:
+        path.append(parents[path[-1]])
+    return path[::-1]
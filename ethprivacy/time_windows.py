@@ -0,0 +1,216 @@
+import pandas as pd
+import numpy as np
+
+from .address2vec import Address2Vec
+
+def bucket_ids(timestamps, bucket_size="month"):
+    """Map unix timestamps to integer time bucket ids ('day', 'week', 'month' or bucket length in seconds)"""
+    timestamps = pd.Series(timestamps)
+    if bucket_size == "month":
+        dates = pd.to_datetime(timestamps, unit="s")
+        return (dates.dt.year * 12 + dates.dt.month - 1).values
+    elif bucket_size == "week":
+        return (timestamps // (7*86400)).values
+    elif bucket_size == "day":
+        return (timestamps // 86400).values
+    elif isinstance(bucket_size, (int, np.integer)) and bucket_size > 0:
+        return (timestamps // bucket_size).values
+    else:
+        raise RuntimeError("Invalid bucket size: %s" % str(bucket_size))
+
+def bucket_start_time(bucket_id, bucket_size="month"):
+    """Start of the given time bucket as a pandas Timestamp"""
+    if bucket_size == "month":
+        return pd.Timestamp(year=int(bucket_id) // 12, month=int(bucket_id) % 12 + 1, day=1)
+    elif bucket_size == "week":
+        return pd.to_datetime(int(bucket_id) * 7 * 86400, unit="s")
+    elif bucket_size == "day":
+        return pd.to_datetime(int(bucket_id) * 86400, unit="s")
+    else:
+        return pd.to_datetime(int(bucket_id) * int(bucket_size), unit="s")
+
+class WindowAddress2Vec(Address2Vec):
+    """Address2Vec representation assembled from merged time bucket accumulators"""
+    def __init__(self, filtered_stats, distrib_repr, feature_cols, window, **kwargs):
+        Address2Vec.__init__(self, events_df=None, **kwargs)
+        self.window = window
+        self.id += "_w%i-%i" % window
+        self.feature_cols = feature_cols
+        self.filtered_stats = filtered_stats
+        self.addr_to_embedd = list(self.filtered_stats["from"])
+        self.idx2addr = dict(self.filtered_stats["from"])
+        self.addr2idx = dict(zip(self.idx2addr.values(), self.idx2addr.keys()))
+        self._distrib_repr = distrib_repr
+        if self.verbose:
+            print("Number of embedded addresses:", len(self.addr_to_embedd))
+        self.X = self._preprocess()
+
+    def _distribution_based_repr(self):
+        if self.verbose:
+            print("Distribution based representation dimensions:", self._distrib_repr.shape)
+        return self._distrib_repr
+
+class WindowedAddress2Vec():
+    """Keep per-address, per-time-bucket accumulators of the side channel features so that the Address2Vec representation of any window of consecutive buckets is assembled by merging buckets instead of re-scanning the events.
+
+    A window is an approximation of Address2Vec built on the events of the same time slice. Transaction counts, means, standard deviations, minimums, maximums and the time of day distribution are the same (up to floating point error). Medians are estimated from a histogram with 'median_resolution' bins, so they can differ by half a bin (value range / median_resolution / 2). Gas price bins are defined by the maximal normalized gas price of every event to keep windows comparable, while Address2Vec uses the maximum of the embedded addresses of the slice, so the gas price distributions only agree for windows that contain this maximum."""
+    def __init__(self, events_df, bucket_size="month", norm_type="ptp", min_tx_cnt=10, gas_bins=25, hour_bins=6, use_hour=True, use_gas=True, use_stats=True, use_distrib=True, aggregations=["mean","median","std"], median_resolution=1440, verbose=True):
+        for agg in aggregations:
+            if not agg in ["mean","median","std","min","max","sum"]:
+                raise RuntimeError("Invalid aggregation for windowed representation: %s" % agg)
+        self.bucket_size = bucket_size
+        self.norm_type = norm_type
+        self.min_tx_cnt = min_tx_cnt
+        self.gas_bins = gas_bins
+        self.hour_bins = hour_bins
+        self.use_hour = use_hour
+        self.use_gas = use_gas
+        self.use_stats = use_stats
+        self.use_distrib = use_distrib
+        self.aggregations = aggregations
+        self.median_resolution = median_resolution
+        self.verbose = verbose
+        self.feature_cols = []
+        if self.use_hour:
+            self.feature_cols.append("hour")
+        if self.use_gas:
+            self.feature_cols.append("normalized_gas")
+        self.value_range = {"hour": 86400.0}
+        if self.use_gas:
+            self.value_range["normalized_gas"] = float(events_df["normalized_gas"].max())
+        self._accumulate(events_df)
+
+    def _discretize(self, values, col, num_bins):
+        interval = self.value_range[col] / num_bins
+        return (values // interval).astype("int64")
+
+    def _accumulate(self, events_df):
+        """Calculate accumulators for each (bucket, address) pair in one pass over the events"""
+        events = events_df[["from","hash","timeStamp"]+self.feature_cols].copy()
+        events["bucket"] = bucket_ids(events["timeStamp"], self.bucket_size)
+        self.buckets = sorted(events["bucket"].unique())
+        agg_map = {"hash":["count"]}
+        for col in self.feature_cols:
+            events[col+"_sq"] = np.square(events[col].astype("float64"))
+            agg_map[col] = ["sum","min","max"]
+            agg_map[col+"_sq"] = ["sum"]
+        moments = events.groupby(["bucket","from"]).agg(agg_map)
+        moments.columns = ["%s_%s" % (col, agg) for col, agg in moments.columns]
+        self.moments = moments.reset_index()
+        # histograms in long format: (bucket, from, bin, count) for each feature
+        self.median_hist = {}
+        self.distrib_hist = {}
+        for col in self.feature_cols:
+            if "median" in self.aggregations:
+                self.median_hist[col] = self._histogram(events, col, self.median_resolution)
+            num_bins = self.hour_bins if col == "hour" else self.gas_bins
+            if num_bins > 0:
+                self.distrib_hist[col] = self._histogram(events, col, num_bins)
+        if self.verbose:
+            print("Number of time buckets:", len(self.buckets))
+            print("Number of (bucket, address) accumulators:", len(self.moments))
+
+    def _histogram(self, events, col, num_bins):
+        tmp = events[["bucket","from"]].copy()
+        tmp["bin"] = self._discretize(events[col], col, num_bins)
+        return tmp.groupby(["bucket","from","bin"]).size().rename("count").reset_index()
+
+    def _merge_hist(self, hist, first, last, addresses):
+        sel = hist[(hist["bucket"] >= first) & (hist["bucket"] <= last)]
+        sel = sel[sel["from"].isin(addresses)]
+        return sel.groupby(["from","bin"])["count"].sum().reset_index()
+
+    def _median(self, col, first, last, counts):
+        """Estimate medians from the merged histogram (centers of the bins that contain the middle elements)"""
+        hist = self._merge_hist(self.median_hist[col], first, last, counts.index)
+        hist = hist.sort_values(["from","bin"])
+        hist["cum"] = hist.groupby("from")["count"].cumsum()
+        cnt = hist["from"].map(counts)
+        interval = self.value_range[col] / self.median_resolution
+        middle_bins = []
+        # positions of the two middle elements (the same for odd number of transactions)
+        for pos in [(cnt + 1) // 2, cnt // 2 + 1]:
+            middle_bins.append(hist[hist["cum"] >= pos].groupby("from")["bin"].first())
+        return ((middle_bins[0] + middle_bins[1]) / 2.0 + 0.5) * interval
+
+    def _window_stats(self, first, last):
+        sel = self.moments[(self.moments["bucket"] >= first) & (self.moments["bucket"] <= last)]
+        agg_map = {"hash_count":"sum"}
+        for col in self.feature_cols:
+            agg_map.update({col+"_sum":"sum", col+"_min":"min", col+"_max":"max", col+"_sq_sum":"sum"})
+        merged = sel.groupby("from").agg(agg_map)
+        merged = merged[merged["hash_count"] >= self.min_tx_cnt]
+        counts = merged["hash_count"]
+        stats = {("from",""): merged.index.values, ("hash","count"): counts.values}
+        for col in self.feature_cols:
+            mean = merged[col+"_sum"] / counts
+            for agg in self.aggregations:
+                if agg == "mean":
+                    values = mean
+                elif agg == "median":
+                    values = self._median(col, first, last, counts).reindex(merged.index)
+                elif agg == "std":
+                    # sample standard deviation (undefined for a single transaction)
+                    var = (merged[col+"_sq_sum"] - counts * np.square(mean)) / (counts - 1)
+                    values = np.sqrt(np.maximum(var, 0.0)).where(counts > 1)
+                else:
+                    values = merged["%s_%s" % (col, agg)]
+                stats[(col, agg)] = np.asarray(values, dtype="float64")
+        filtered_stats = pd.DataFrame(stats)
+        filtered_stats.columns = pd.MultiIndex.from_tuples(filtered_stats.columns)
+        return filtered_stats
+
+    def _window_distrib(self, first, last, filtered_stats, full_layout=False):
+        addresses = filtered_stats["from"]
+        parts = []
+        for col in self.feature_cols:
+            if not col in self.distrib_hist:
+                continue
+            hist = self._merge_hist(self.distrib_hist[col], first, last, addresses)
+            pivot = hist.pivot(index="from", columns="bin", values="count")
+            if full_layout:
+                num_bins = self.hour_bins if col == "hour" else self.gas_bins
+                pivot = pivot.reindex(columns=range(num_bins+1))
+            parts.append(pivot.reindex(addresses).fillna(0.0).values)
+        if len(parts) > 0:
+            B = np.concatenate(parts, axis=1)
+            tx_counts = np.array(filtered_stats[("hash","count")])
+            B = B / tx_counts.reshape(-1,1)
+        else:
+            B = np.array([])
+        return B
+
+    def window(self, first, last=None, full_layout=False):
+        """Assemble the Address2Vec representation for the buckets between 'first' and 'last' (inclusive). With full_layout=True every distribution bin is kept (even unobserved ones) so that windows share the same feature layout."""
+        if last is None:
+            last = first
+        filtered_stats = self._window_stats(first, last)
+        B = self._window_distrib(first, last, filtered_stats, full_layout)
+        return WindowAddress2Vec(filtered_stats, B, self.feature_cols, (first, last), norm_type=self.norm_type, min_tx_cnt=self.min_tx_cnt, gas_bins=self.gas_bins, hour_bins=self.hour_bins, use_hour=self.use_hour, use_gas=self.use_gas, use_stats=self.use_stats, use_distrib=self.use_distrib, aggregations=self.aggregations, verbose=self.verbose)
+
+    def sliding_windows(self, length=1, step=1, full_layout=False):
+        """Generate representations for windows of 'length' consecutive buckets shifted with 'step' buckets"""
+        first_bucket, last_bucket = self.buckets[0], self.buckets[-1]
+        for first in range(first_bucket, last_bucket-length+2, step):
+            yield self.window(first, first+length-1, full_layout)
+
+def cross_window_ranks(a2v_a, a2v_b, addresses=None):
+    """Rank the representation of each address in window 'b' among every window 'b' representation, measured from its own representation in window 'a'. Windows must be built with norm_type=None and full_layout=True; the joint matrix is normalized with ptp normalization."""
+    if a2v_a.X.shape[1] != a2v_b.X.shape[1]:
+        raise RuntimeError("Windows have different feature layouts! Use full_layout=True.")
+    common = set(a2v_a.addr2idx).intersection(a2v_b.addr2idx)
+    if addresses is not None:
+        common = common.intersection(addresses)
+    common = sorted(common)
+    X = np.concatenate([a2v_a.X, a2v_b.X], axis=0).astype("float64")
+    ptp = X.max(0) - X.min(0)
+    ptp[ptp == 0] = 1.0
+    X = (X - X.min(0)) / ptp
+    Xa, Xb = X[:a2v_a.X.shape[0]], X[a2v_a.X.shape[0]:]
+    records = []
+    for addr in common:
+        dist = np.sqrt(np.sum(np.square(Xb - Xa[a2v_a.addr2idx[addr]]), axis=1))
+        own_dist = dist[a2v_b.addr2idx[addr]]
+        rank = 1 + int(np.sum(dist < own_dist))
+        records.append((addr, rank, own_dist, len(dist)))
+    return pd.DataFrame(records, columns=["address", "rank", "dist", "set_size"])
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+def token_incidence(token_txs, addresses=None, endpoints=["from"], weighting="log", idf=True, max_token_share=None):
+    """Sparse address x token matrix of token transfers. Entries are transfer counts ('count'), usage indicators ('binary') or 1+log(count) ('log'), optionally multiplied by the inverse document frequency of the tokens. Tokens used by more than 'max_token_share' of the addresses (e.g. stablecoins) are dropped. Returns the CSR matrix and the address and token lists of its rows and columns."""
+    if not weighting in ["binary", "count", "log"]:
+        raise RuntimeError("Invalid weighting: %s" % weighting)
+    parts = []
+    for col in endpoints:
+        part = token_txs[[col, "contractAddress"]].dropna()
+        part.columns = ["address", "token"]
+        parts.append(part)
+    usage = pd.concat(parts)
+    if addresses is not None:
+        usage = usage[usage["address"].isin(set(addresses))]
+    counts = usage.groupby(["address", "token"]).size().reset_index(name="cnt")
+    if addresses is None:
+        addresses = sorted(counts["address"].unique())
+    addresses = list(addresses)
+    row_of = dict(zip(addresses, range(len(addresses))))
+    if max_token_share is not None:
+        num_users = counts["token"].value_counts()
+        popular = set(num_users[num_users > max_token_share * len(addresses)].index)
+        counts = counts[~counts["token"].isin(popular)]
+    tokens = sorted(counts["token"].unique())
+    col_of = dict(zip(tokens, range(len(tokens))))
+    if weighting == "binary":
+        values = np.ones(len(counts))
+    elif weighting == "count":
+        values = counts["cnt"].values.astype("float64")
+    else:
+        values = 1.0 + np.log(counts["cnt"].values)
+    cols = counts["token"].map(col_of).values
+    if idf and len(counts) > 0:
+        num_users = np.bincount(cols, minlength=len(tokens))
+        values = values * np.log(len(addresses) / num_users)[cols]
+    M = sp.csr_matrix((values, (counts["address"].map(row_of).values, cols)), shape=(len(addresses), len(tokens)))
+    M.eliminate_zeros()
+    return M, addresses, tokens
+
+def _row_top_k(S, query_rows, k):
+    """Top-k columns and values of each row of a sparse score matrix (query rows are excluded from their own results)"""
+    S = S.tocsr()
+    indices = np.full((S.shape[0], k), -1, dtype="int64")
+    scores = np.zeros((S.shape[0], k))
+    for i in range(S.shape[0]):
+        cols = S.indices[S.indptr[i]:S.indptr[i+1]]
+        vals = S.data[S.indptr[i]:S.indptr[i+1]]
+        keep = (cols != query_rows[i]) & (vals > 0)
+        cols, vals = cols[keep], vals[keep]
+        if len(cols) > k:
+            selected = np.argpartition(-vals, k-1)[:k]
+            cols, vals = cols[selected], vals[selected]
+        # descending score, ascending index for ties
+        order = np.lexsort((cols, -vals))
+        indices[i,:len(cols)] = cols[order]
+        scores[i,:len(cols)] = vals[order]
+    return indices, scores
+
+class TokenCoUsage():
+    """Token co-usage similarity of addresses based on the token transfers of the EntityAPI (the sender-token links of the contract graph by default).
+
+    Top-k neighbors are calculated for blocks of query addresses with sparse matrix products, so only address pairs that share a token are scored. Similarities are cosine similarity of the weighted usage vectors or weighted Jaccard similarity (sum of minimum / sum of maximum weights)."""
+    def __init__(self, api, addresses=None, endpoints=["from"], weighting="log", idf=True, max_token_share=None, max_time=None, verbose=True):
+        _, token_txs = api._time_filter(None, max_time)
+        self.M, self.addresses, self.tokens = token_incidence(token_txs, addresses, endpoints, weighting, idf, max_token_share)
+        self.addr2row = dict(zip(self.addresses, range(len(self.addresses))))
+        self._csc = self.M.tocsc()
+        norms = np.sqrt(np.asarray(self.M.multiply(self.M).sum(axis=1)).ravel())
+        self._normalized = sp.diags(1.0 / np.where(norms > 0, norms, 1.0)) @ self.M
+        self._row_sums = np.asarray(self.M.sum(axis=1)).ravel()
+        self.verbose = verbose
+        if self.verbose:
+            print("Token incidence matrix:", self.M.shape, "non-zeros:", self.M.nnz)
+
+    def _sum_min(self, rows):
+        """Sum of the element-wise minimum weights of the given rows and every address"""
+        block = self.M[rows].tocoo()
+        starts, ends = self._csc.indptr[block.col], self._csc.indptr[block.col+1]
+        counts = ends - starts
+        total = int(counts.sum())
+        # positions of the column entries of each non-zero of the block
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+        values = np.minimum(np.repeat(block.data, counts), self._csc.data[offsets])
+        return sp.coo_matrix((values, (np.repeat(block.row, counts), self._csc.indices[offsets])), shape=(len(rows), self.M.shape[0])).tocsr()
+
+    def similarity_block(self, rows, metric="cosine"):
+        """Sparse (len(rows) x addresses) similarity matrix"""
+        if metric == "cosine":
+            return self._normalized[rows] @ self._normalized.T
+        elif metric == "jaccard":
+            S = self._sum_min(rows).tocoo()
+            union = self._row_sums[rows][S.row] + self._row_sums[S.col] - S.data
+            return sp.coo_matrix((S.data / union, (S.row, S.col)), shape=S.shape).tocsr()
+        else:
+            raise RuntimeError("Invalid metric: %s" % metric)
+
+    def top_k(self, query_addresses=None, k=10, metric="cosine", block_size=1024):
+        """Top-k most similar addresses for each query address (every address by default). Returns a DataFrame with query_addr, candidate_addr, score and rank columns."""
+        if query_addresses is None:
+            query_addresses = self.addresses
+        query_addresses = [addr for addr in query_addresses if addr in self.addr2row]
+        rows = np.array([self.addr2row[addr] for addr in query_addresses], dtype="int64")
+        parts = []
+        for start in range(0, len(rows), block_size):
+            block_rows = rows[start:start+block_size]
+            indices, scores = _row_top_k(self.similarity_block(block_rows, metric), block_rows, k)
+            query_idx = np.repeat(block_rows, k)
+            ranks = np.tile(np.arange(1, k+1), len(block_rows))
+            found = indices.ravel() >= 0
+            parts.append(pd.DataFrame({"query_idx": query_idx[found], "candidate_idx": indices.ravel()[found], "score": scores.ravel()[found], "rank": ranks[found]}))
+            if self.verbose:
+                print("Processed %i/%i queries" % (min(start+block_size, len(rows)), len(rows)))
+        if len(parts) == 0:
+            return pd.DataFrame(columns=["query_addr", "candidate_addr", "score", "rank"])
+        df = pd.concat(parts, ignore_index=True)
+        addresses = np.array(self.addresses, dtype=object)
+        df["query_addr"] = addresses[df["query_idx"].values]
+        df["candidate_addr"] = addresses[df["candidate_idx"].values]
+        return df[["query_addr", "candidate_addr", "score", "rank"]]
+
+    def features(self, dim=32, seed=0):
+        """Dense token usage features (truncated SVD of the L2 normalized incidence matrix) in the node embedding format of Address2Vec (dimension columns and an 'address' column). Euclidean distances of the features approximate the cosine co-usage distance."""
+        from scipy.sparse.linalg import svds
+        dim = min(dim, min(self.M.shape) - 1)
+        if dim < 1:
+            raise RuntimeError("Too few addresses or tokens for token features!")
+        v0 = np.random.RandomState(seed).rand(min(self.M.shape))
+        U, s, _ = svds(self._normalized, k=dim, v0=v0)
+        order = np.argsort(-s)
+        features = pd.DataFrame(U[:,order] * s[order], columns=["token_%i" % i for i in range(dim)])
+        features["address"] = self.addresses
+        return features
+
+def candidate_recall(candidates_df, pairs_df, k_values=[1, 5, 10]):
+    """Share of the (query_addr, target_addr) pairs (e.g. ENS address pairs or Tornado withdraw-deposit pairs) with the target among the top-k candidates of the query"""
+    merged = pairs_df[["query_addr", "target_addr"]].drop_duplicates().merge(candidates_df, left_on=["query_addr", "target_addr"], right_on=["query_addr", "candidate_addr"], how="left")
+    return pd.Series(dict(("recall@%i" % k, float((merged["rank"] <= k).mean())) for k in k_values))
@@ -1,6 +1,6 @@
 import pandas as pd
-from tqdm import tqdm
 import json
+from .tornado_history import get_history_store
 
 def load_address_topics(path_to_json, removed_topics=["News", "Security", "Heists", "Sports", "Investment", "Retail", "Real Estate"]):
     """Load relevant service categories from a prepared JSON file"""
@@ -53,6 +53,7 @@ def get_in_out_connections_for_addr(entity_api, address, is_contract, is_ens_res
 
 def get_in_out_ens_connections(entity_api, selected_addr_info):
     """Collect entities that were in connection to the addresses of interest"""
+    from tqdm import tqdm
     inbound, outbound = {}, {}
     indices = list(selected_addr_info.index)
     for idx in tqdm(indices):
@@ -102,11 +103,9 @@ def addresses_of_interest(entity_api, with_tornado=True, with_hd=True, verbose=T
     if verbose:
         print("Number of ENS names:", len(entity_api.ens_pairs["name"].unique()))
         print("Number of ENS addresses:", len(ens_addresses))
-    tornado_file_ids = ["0.1","1","10","100"]
-    tornado_parts = [pd.read_csv("%s/tornadoFullHistoryMixer_%sETH.csv" % (entity_api.data_dir, part)) for part in tornado_file_ids]
-    tornado_df = pd.concat(tornado_parts)
-    tornado_deposits = set(tornado_df[tornado_df["action"]=="d"]["account"])
-    tornado_withraws = set(tornado_df[tornado_df["action"]=="w"]["account"])
+    store = get_history_store(entity_api.data_dir)
+    tornado_deposits = store.accounts(action="d")
+    tornado_withraws = store.accounts(action="w")
     tornado_addresses = list(tornado_deposits.union(tornado_withraws))
     if verbose:
         print("Number of Tornado addresses:", len(tornado_addresses))
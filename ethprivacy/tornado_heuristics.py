@@ -0,0 +1,87 @@
+import os
+import pandas as pd
+from .tornado_history import TORNADO_MIXERS, get_history_store
+
+HEURISTIC_COLUMNS = ["sender", "receiver", "withdHash"]
+
+def _split_actions(history_df):
+    history_df = history_df[["txHash", "timeStamp", "action", "account"]]
+    deposits = history_df[history_df["action"] == "d"].drop("action", axis=1)
+    withdraws = history_df[history_df["action"] == "w"].drop("action", axis=1)
+    return deposits, withdraws
+
+def tx_gas_prices(txs_dfs):
+    """Gas price of each transaction hash (internal transactions have no gas price)"""
+    parts = [df[["hash", "gasPrice"]] for df in txs_dfs]
+    prices = pd.concat(parts).dropna().drop_duplicates("hash")
+    return prices.rename(columns={"hash": "txHash"})
+
+def unique_gas_price_heuristic(history_df, gas_prices, round_gas_price=None):
+    """Heuristic 2: link a withdrawal to the earlier deposit that used the same gas price, if this gas price was used by exactly one deposit and one withdrawal of the mixer. Gas prices that are multiples of 'round_gas_price' (e.g. 1 Gwei) are ignored if it is set."""
+    deposits, withdraws = _split_actions(history_df)
+    deposits = deposits.merge(gas_prices, on="txHash", how="inner")
+    withdraws = withdraws.merge(gas_prices, on="txHash", how="inner")
+    if round_gas_price is not None:
+        deposits = deposits[deposits["gasPrice"] % round_gas_price != 0]
+        withdraws = withdraws[withdraws["gasPrice"] % round_gas_price != 0]
+    deposits = deposits[~deposits["gasPrice"].duplicated(keep=False)]
+    withdraws = withdraws[~withdraws["gasPrice"].duplicated(keep=False)]
+    pairs = withdraws.merge(deposits, on="gasPrice", suffixes=("_w", "_d"))
+    pairs = pairs[pairs["timeStamp_d"] < pairs["timeStamp_w"]]
+    pairs = pairs.rename(columns={"account_d": "sender", "account_w": "receiver", "txHash_w": "withdHash"})
+    return pairs[HEURISTIC_COLUMNS].sort_values(["withdHash", "sender"]).reset_index(drop=True)
+
+def address_links(txs_dfs, endpoints=[("from", "to")]):
+    """Undirected address pairs with at least one transaction between them"""
+    parts = []
+    for df in txs_dfs:
+        for src, trg in endpoints:
+            links = df[[src, trg]].dropna()
+            links.columns = ["a", "b"]
+            parts.append(links)
+            parts.append(links.rename(columns={"a": "b", "b": "a"}))
+    links = pd.concat(parts).drop_duplicates()
+    return links[links["a"] != links["b"]]
+
+def linked_address_heuristic(history_df, links):
+    """Heuristic 3: link a withdrawal to the deposit addresses that have a transaction with the withdrawal address and deposited into the mixer before the withdrawal"""
+    deposits, withdraws = _split_actions(history_df)
+    # candidate deposit addresses of each withdrawal
+    candidates = withdraws.merge(links, left_on="account", right_on="a").rename(columns={"b": "sender", "account": "receiver", "txHash": "withdHash"})
+    candidates = candidates[candidates["sender"].isin(set(deposits["account"]))]
+    if len(candidates) == 0:
+        return pd.DataFrame(columns=HEURISTIC_COLUMNS)
+    # sorted time merge: latest earlier deposit of the candidate address
+    deposits = deposits.rename(columns={"account": "sender", "timeStamp": "depTime", "txHash": "depHash"})
+    candidates = candidates.sort_values("timeStamp")
+    deposits = deposits.sort_values("depTime")
+    candidates["timeStamp"] = candidates["timeStamp"].astype("int64")
+    deposits["depTime"] = deposits["depTime"].astype("int64")
+    matched = pd.merge_asof(candidates, deposits, left_on="timeStamp", right_on="depTime", by="sender", direction="backward", allow_exact_matches=False)
+    matched = matched[matched["depHash"].notnull()]
+    return matched[HEURISTIC_COLUMNS].drop_duplicates().sort_values(["withdHash", "sender"]).reset_index(drop=True)
+
+def compute_heuristics(api, data_folder, mixers=TORNADO_MIXERS, output_folder=None, round_gas_price=None, overwrite=False, verbose=True):
+    """Compute heuristic 2 and 3 withdraw-deposit pairs for each mixer from the mixer histories and the transactions of the EntityAPI. Results are exported to 'heuristic<id>Mixer_<mixer>ETH.csv' files (the format of the published data) if 'output_folder' is given. Existing files (e.g. the published heuristics in the data folder) are only replaced with overwrite=True."""
+    if output_folder is not None and not overwrite:
+        for mixer in mixers:
+            for heur_id in ["2", "3"]:
+                output_file = "%s/heuristic%sMixer_%sETH.csv" % (output_folder, heur_id, mixer)
+                if os.path.exists(output_file):
+                    raise RuntimeError("%s already exists! Set overwrite=True to replace it." % output_file)
+    store = get_history_store(data_folder)
+    gas_prices = tx_gas_prices([api.normal_txs, api.token_txs])
+    links = address_links([api.normal_txs, api.token_txs])
+    results = {}
+    for mixer in mixers:
+        history_df = store.history(mixer)
+        results[(mixer, "heur2")] = unique_gas_price_heuristic(history_df, gas_prices, round_gas_price)
+        results[(mixer, "heur3")] = linked_address_heuristic(history_df, links)
+        if verbose:
+            print("%sETH mixer - heuristic 2: %i pairs, heuristic 3: %i pairs" % (mixer, len(results[(mixer, "heur2")]), len(results[(mixer, "heur3")])))
+        if output_folder is not None:
+            if not os.path.exists(output_folder):
+                os.makedirs(output_folder)
+            for data_type in ["heur2", "heur3"]:
+                results[(mixer, data_type)].to_csv("%s/heuristic%sMixer_%sETH.csv" % (output_folder, data_type[-1], mixer), index=False)
+    return results
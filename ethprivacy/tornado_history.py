@@ -0,0 +1,109 @@
+import os
+import pandas as pd
+from .schema import read_table
+
+TORNADO_MIXERS = ["0.1","1","10","100"]
+
+def clean_heuristics(tornado_pairs, verbose):
+    """Removing loops and Tornado contract addresses from the set of heuristics"""
+    orig_size = len(tornado_pairs)
+    # removing loops
+    tornado_pairs = tornado_pairs[tornado_pairs["sender"]!=tornado_pairs["receiver"]]
+    if verbose:
+        print("Loops removed:", len(tornado_pairs) / orig_size)
+    # removing Tornado cash 0.1ETH address
+    tornado_pairs = tornado_pairs[tornado_pairs["receiver"]!="0x12d66f87a04a9e220743712ce6d9bb1b5616b8fc"]
+    if verbose:
+        print("Tornado address removed:", len(tornado_pairs) / orig_size)
+    return tornado_pairs
+
+class TornadoHistoryStore():
+    """Load each Tornado mixer history (and heuristics) file only once and index the events by mixer, action and account. Returned tables are shared, do not modify them inplace."""
+    def __init__(self, data_folder):
+        self.data_folder = data_folder
+        self._history = {}
+        self._hash_time = {}
+        self._accounts = {}
+        self._account_index = {}
+        self._heuristics = {}
+
+    def history(self, mixer):
+        """Mixer history sorted by time with the cumulative number of deposits"""
+        if not mixer in self._history:
+            history_df = read_table("%s/tornadoFullHistoryMixer_%sETH.csv" % (self.data_folder, mixer), "tornado_history")
+            history_df = history_df.sort_values("timeStamp")
+            history_df["contrib"] = (history_df["action"] == "d").astype("int64")
+            history_df["num_deps"] = history_df["contrib"].cumsum()
+            if "index" in history_df.columns:
+                history_df = history_df.drop("index", axis=1)
+            self._history[mixer] = history_df
+        return self._history[mixer]
+
+    def hash_time(self, mixer):
+        """Map transaction hashes of the mixer to timestamps"""
+        if not mixer in self._hash_time:
+            history_df = self.history(mixer)
+            self._hash_time[mixer] = dict(zip(history_df["txHash"], history_df["timeStamp"]))
+        return self._hash_time[mixer]
+
+    def accounts(self, mixer=None, action=None):
+        """Set of accounts with the given action ('d' or 'w') in the given mixer (all mixers and actions by default)"""
+        mixers = TORNADO_MIXERS if mixer is None else [mixer]
+        actions = ["d","w"] if action is None else [action]
+        res = set()
+        for m in mixers:
+            for a in actions:
+                if not (m, a) in self._accounts:
+                    history_df = self.history(m)
+                    self._accounts[(m, a)] = set(history_df[history_df["action"]==a]["account"])
+                res = res.union(self._accounts[(m, a)])
+        return res
+
+    def account_events(self, account, mixer=None, action=None):
+        """Mixer events of the given account"""
+        mixers = TORNADO_MIXERS if mixer is None else [mixer]
+        parts = []
+        for m in mixers:
+            if not m in self._account_index:
+                self._account_index[m] = self.history(m).groupby("account").indices
+            positions = self._account_index[m].get(account, [])
+            part = self.history(m).iloc[positions]
+            if action is not None:
+                part = part[part["action"]==action]
+            parts.append(part.assign(mixer=m))
+        return pd.concat(parts)
+
+    def heuristics(self, mixer, data_type="all"):
+        """Withdraw-deposit heuristic pairs ('heur2', 'heur3' or 'all') with withdrawal timestamps"""
+        key = (mixer, data_type)
+        if not key in self._heuristics:
+            if data_type in ["heur2", "heur3"]:
+                tornado_pairs = self._read_heuristic(data_type[-1], mixer)
+            else:
+                tornado_pairs = pd.concat([self._read_heuristic("2", mixer), self._read_heuristic("3", mixer)])
+            tornado_pairs = tornado_pairs.drop_duplicates()
+            tornado_pairs["timeStamp"] = tornado_pairs["withdHash"].map(self.hash_time(mixer))
+            self._heuristics[key] = tornado_pairs
+        return self._heuristics[key]
+
+    def _read_heuristic(self, heur_id, mixer):
+        return read_table("%s/heuristic%sMixer_%sETH.csv" % (self.data_folder, heur_id, mixer), "tornado_heuristics")
+
+    def heuristic_edges(self, max_time=None, mixers=TORNADO_MIXERS, data_type="all"):
+        """Unique (deposit, withdraw) address pairs of the cleaned heuristics"""
+        edges = set()
+        for mixer in mixers:
+            pairs = clean_heuristics(self.heuristics(mixer, data_type), False)
+            if max_time != None:
+                pairs = pairs[pairs["timeStamp"]<=max_time]
+            edges = edges.union(zip(pairs["sender"], pairs["receiver"]))
+        return list(edges)
+
+_STORES = {}
+
+def get_history_store(data_folder):
+    """Shared TornadoHistoryStore object for the given data folder"""
+    key = os.path.abspath(data_folder)
+    if not key in _STORES:
+        _STORES[key] = TornadoHistoryStore(data_folder)
+    return _STORES[key]
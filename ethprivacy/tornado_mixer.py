@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from bisect import bisect_left, bisect_right
+from .tornado_history import get_history_store, clean_heuristics
 
 def get_deposit_indices(a2v_obj, tq, tup, f_id):
     """Extract the possible set of deposit address candidates for each heuristic record given different temporal filtering options"""
@@ -22,19 +23,6 @@ def get_deposit_indices(a2v_obj, tq, tup, f_id):
             d_addr_idx.append(a2v_obj.addr2idx[addr])
     return d_addr_idx, anonymity_set_size
 
-def clean_heuristics(tornado_pairs, verbose):
-    """Removing loops and Tornado contract addresses from the set of heuristics"""
-    orig_size = len(tornado_pairs)
-    # removing loops
-    tornado_pairs = tornado_pairs[tornado_pairs["sender"]!=tornado_pairs["receiver"]]
-    if verbose:
-        print("Loops removed:", len(tornado_pairs) / orig_size)
-    # removing Tornado cash 0.1ETH address    
-    tornado_pairs = tornado_pairs[tornado_pairs["receiver"]!="0x12d66f87a04a9e220743712ce6d9bb1b5616b8fc"]
-    if verbose:
-        print("Tornado address removed:", len(tornado_pairs) / orig_size)
-    return tornado_pairs
-
 def temporal_filter(df, max_time):
     if max_time != None:
         return df[df["timeStamp"]<=max_time]
@@ -49,33 +37,103 @@ class TornadoQueries():
         self.max_time = max_time
         self.verbose = verbose
         self.history_df = temporal_filter(self._load_history(), self.max_time)
+        self._build_deposit_index()
         self.tornado_pairs = temporal_filter(self._load_heuristics(), self.max_time)
         self.tornado_tuples = list(zip(self.tornado_pairs["sender"], self.tornado_pairs["receiver"], self.tornado_pairs["withdHash"], self.tornado_pairs["timeStamp"]))
         if self.verbose:
             print("history", self.history_df.shape)
             print("pairs", self.tornado_pairs.shape)      
     
+    @property
+    def history_df(self):
+        """Mixer history including the appended events. The frame is extended once per batch of appended events and cached until the next append."""
+        if len(self._pending) > 0:
+            new_events = pd.DataFrame(self._pending, columns=["txHash","timeStamp","action","account"])
+            new_events["contrib"] = (new_events["action"] == "d").astype("int64")
+            if self._out_of_order:
+                history_df = pd.concat([self._history_df, new_events], ignore_index=True)
+                history_df = history_df.sort_values("timeStamp", kind="mergesort")
+                history_df["num_deps"] = history_df["contrib"].cumsum()
+            else:
+                # in order events only continue the cumulative deposit count
+                offset = int(self._history_df["num_deps"].iloc[-1]) if len(self._history_df) > 0 else 0
+                new_events["num_deps"] = new_events["contrib"].cumsum() + offset
+                history_df = pd.concat([self._history_df, new_events], ignore_index=True)
+            self._history_df = history_df
+            self._pending = []
+            self._out_of_order = False
+        return self._history_df
+    
+    @history_df.setter
+    def history_df(self, df):
+        self._history_df = df
+        self._pending = []
+        self._out_of_order = False
+    
+    def _build_deposit_index(self):
+        """Sorted deposit timestamps (and accounts) for binary search based candidate queries. Accounts are also indexed by the time of their first deposit to answer queries without a time interval."""
+        deposits = self.history_df[self.history_df["action"]=="d"]
+        self.deposit_times = list(deposits["timeStamp"])
+        self.deposit_accounts = list(deposits["account"])
+        self.last_time = self.history_df["timeStamp"].max() if len(self.history_df) > 0 else None
+        self.num_deps = len(self.deposit_times)
+        first = deposits.drop_duplicates(subset="account", keep="first")
+        self.first_deposit_times = list(first["timeStamp"])
+        self.first_deposit_accounts = list(first["account"])
+        self.first_deposit = dict(zip(self.first_deposit_accounts, self.first_deposit_times))
+
+    def _update_first_deposit(self, account, time_stamp):
+        """Move the account in the first deposit index if the new deposit precedes its known deposits"""
+        if account in self.first_deposit:
+            first_time = self.first_deposit[account]
+            if first_time <= time_stamp:
+                return
+            # rare for out of order events only
+            pos = bisect_left(self.first_deposit_times, first_time)
+            pos += self.first_deposit_accounts[pos:].index(account)
+            del self.first_deposit_times[pos]
+            del self.first_deposit_accounts[pos]
+        pos = bisect_right(self.first_deposit_times, time_stamp)
+        self.first_deposit_times.insert(pos, time_stamp)
+        self.first_deposit_accounts.insert(pos, account)
+        self.first_deposit[account] = time_stamp
+        
+    def append_events(self, events):
+        """Append new mixer events (records or DataFrame with txHash, timeStamp, action and account) and update the deposit index incrementally"""
+        if isinstance(events, pd.DataFrame):
+            events = events[["txHash","timeStamp","action","account"]].to_dict("records")
+        for event in events:
+            tx_hash, time_stamp, action, account = event["txHash"], int(event["timeStamp"]), event["action"], str(event["account"]).lower()
+            if self.last_time is not None and time_stamp < self.last_time:
+                self._out_of_order = True
+            else:
+                self.last_time = time_stamp
+            if action == "d":
+                if len(self.deposit_times) == 0 or time_stamp >= self.deposit_times[-1]:
+                    self.deposit_times.append(time_stamp)
+                    self.deposit_accounts.append(account)
+                else:
+                    pos = bisect_right(self.deposit_times, time_stamp)
+                    self.deposit_times.insert(pos, time_stamp)
+                    self.deposit_accounts.insert(pos, account)
+                self._update_first_deposit(account, time_stamp)
+                self.num_deps += 1
+            self.tornado_hash_time[tx_hash] = time_stamp
+            self._pending.append((tx_hash, time_stamp, action, account))
+    
     def _load_history(self):
-        history_df = pd.read_csv("%s/tornadoFullHistoryMixer_%sETH.csv" % (self.data_folder, self.mixer_str_value))
-        history_df = history_df.sort_values("timeStamp")
-        history_df["contrib"] = history_df["action"].apply(lambda x: 1 if x == "d" else 0)
-        history_df["num_deps"] = history_df["contrib"].cumsum()
-        if "index" in history_df.columns:
-            history_df = history_df.drop("index", axis=1)
-        self.tornado_hash_time = dict(zip(history_df["txHash"],history_df["timeStamp"]))
+        store = get_history_store(self.data_folder)
+        # copy as appended events update the map
+        self.tornado_hash_time = dict(store.hash_time(self.mixer_str_value))
+        history_df = store.history(self.mixer_str_value)
+        # accounts are matched in lowercase as in append_events (the shared table is not modified)
+        accounts = history_df["account"].str.lower()
+        if not accounts.equals(history_df["account"]):
+            history_df = history_df.assign(account=accounts)
         return history_df
     
     def _load_heuristics(self):
-        if self.data_type == "heur2":
-            tornado_pairs = pd.read_csv("%s/heuristic2Mixer_%sETH.csv" % (self.data_folder, self.mixer_str_value))
-        elif self.data_type == "heur3":
-            tornado_pairs = pd.read_csv("%s/heuristic3Mixer_%sETH.csv" % (self.data_folder, self.mixer_str_value))
-        else:
-            heur2 = pd.read_csv("%s/heuristic2Mixer_%sETH.csv" % (self.data_folder, self.mixer_str_value))
-            heur3 = pd.read_csv("%s/heuristic3Mixer_%sETH.csv" % (self.data_folder, self.mixer_str_value))
-            tornado_pairs = pd.concat([heur2,heur3])
-        tornado_pairs = tornado_pairs.drop_duplicates()
-        tornado_pairs["timeStamp"] = tornado_pairs["withdHash"].apply(lambda x: self.tornado_hash_time[x])
+        tornado_pairs = get_history_store(self.data_folder).heuristics(self.mixer_str_value, self.data_type)
         tornado_pairs = clean_heuristics(tornado_pairs, self.verbose)
         if "Unnamed: 0" in tornado_pairs.columns:
             tornado_pairs = tornado_pairs.drop("Unnamed: 0", axis=1)
@@ -83,6 +141,7 @@ class TornadoQueries():
             
     def plot_num_deposits(self, show_heuristics=True, linew=3, msize=10):
         """Visualize the temporal distribution of the found withdraw-deposit address pairs (show_heuristics=True) or the number of active deposits (show_heuristics=False)"""
+        import matplotlib.pyplot as plt
         df = self.history_df
         if show_heuristics:
             plt.plot(pd.to_datetime(self.tornado_pairs["timeStamp"], unit='s'), np.ones(len(self.tornado_pairs))*float(self.mixer_str_value),'x',label="%sETH" % self.mixer_str_value, linewidth=linew, markersize=msize)
@@ -93,7 +152,61 @@ class TornadoQueries():
     def get_possible_deposits(self, tornado_tuple, time_interval=None):
         """Get possible deposit address set for a withdraw transaction. Provide the 'time_interval' in seconds if you have some temporal assumption on the timestamp of the deposit."""
         d, w, h, time_bound  = tornado_tuple
-        filtered_df = self.history_df[(self.history_df["action"]=="d") & (self.history_df["timeStamp"]<=time_bound)]
-        if time_interval != None:
-            filtered_df = filtered_df[filtered_df["timeStamp"] >= (time_bound-time_interval)]
-        return list(filtered_df["account"].unique())
\ No newline at end of file
+        if time_interval == None:
+            # unique accounts in the order of their first deposit
+            return self.first_deposit_accounts[:bisect_right(self.first_deposit_times, time_bound)]
+        upper = bisect_right(self.deposit_times, time_bound)
+        lower = bisect_left(self.deposit_times, time_bound-time_interval)
+        return list(dict.fromkeys(self.deposit_accounts[lower:upper]))
+
+class StreamingTornadoLinker():
+    """Online withdraw-deposit linking: new mixer events are appended to the history of a TornadoQueries object and every new withdrawal is immediately answered with deposit candidates ranked by their distance in the given Address2Vec representation."""
+    def __init__(self, tq, a2v_obj, time_interval=None, top_k=None):
+        self.tq = tq
+        self.a2v = a2v_obj
+        self.time_interval = time_interval
+        self.top_k = top_k
+        
+    def rank_candidates(self, withdraw_addr, tx_hash, time_stamp):
+        """Rank the possible deposit addresses of a withdrawal"""
+        cols = ["withdHash","receiver","sender","rank","dist","set_size"]
+        candidates = self.tq.get_possible_deposits((None, withdraw_addr, tx_hash, time_stamp), self.time_interval)
+        set_size = len(candidates)
+        if not withdraw_addr in self.a2v.addr2idx:
+            return pd.DataFrame([], columns=cols)
+        w_idx = self.a2v.addr2idx[withdraw_addr]
+        cand_addrs = [addr for addr in candidates if addr in self.a2v.addr2idx and addr != withdraw_addr]
+        cand_idx = [self.a2v.addr2idx[addr] for addr in cand_addrs]
+        if len(cand_idx) == 0:
+            return pd.DataFrame([], columns=cols)
+        X = self.a2v.X
+        dist = np.sqrt(np.sum(np.square(X[cand_idx,:].astype("float64") - X[w_idx,:].astype("float64")), axis=1))
+        order = np.argsort(dist, kind="mergesort")
+        if self.top_k != None:
+            order = order[:self.top_k]
+        df = pd.DataFrame({
+            "withdHash": tx_hash,
+            "receiver": withdraw_addr,
+            "sender": [cand_addrs[i] for i in order],
+            "rank": np.arange(1, len(order)+1),
+            "dist": dist[order],
+            "set_size": set_size,
+        })
+        return df[cols]
+        
+    def process(self, event):
+        """Append a single mixer event. Ranked deposit candidates are returned for withdrawals (None for deposits)."""
+        self.tq.append_events([event])
+        if event["action"] == "w":
+            return self.rank_candidates(str(event["account"]).lower(), event["txHash"], int(event["timeStamp"]))
+        return None
+    
+    def process_many(self, events):
+        """Append multiple mixer events and concatenate the candidate rankings of the withdrawals"""
+        if isinstance(events, pd.DataFrame):
+            events = events[["txHash","timeStamp","action","account"]].to_dict("records")
+        results = [self.process(event) for event in events]
+        results = [res for res in results if res is not None]
+        if len(results) == 0:
+            return pd.DataFrame([], columns=["withdHash","receiver","sender","rank","dist","set_size"])
+        return pd.concat(results, ignore_index=True)
\ No newline at end of file
@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import asyncio
+import urllib.parse
+import urllib.request
+import numpy as np
+import pandas as pd
+from .schema import TABLE_SCHEMAS
+
+try:
+    import pyarrow
+    DEFAULT_FORMAT = "parquet"
+except ImportError:
+    DEFAULT_FORMAT = "pkl"
+
+# store table -> (schema of the raw table, columns that identify a record)
+STORE_TABLES = {
+    # internal transactions share the hash of their parent transaction
+    "normal_txs": ("raw_normal_txs", ["hash", "tx_type", "from", "to", "value"]),
+    # a token transaction can transfer multiple tokens
+    "token_txs": ("raw_token_txs", ["hash", "from", "to", "contractAddress", "value"]),
+}
+
+# Etherscan account action -> (store table, transaction type)
+ETHERSCAN_ACTIONS = {
+    "txlist": ("normal_txs", "normal"),
+    "txlistinternal": ("normal_txs", "internal"),
+    "tokentx": ("token_txs", None),
+}
+
+def day_of(timestamps):
+    return np.asarray(timestamps, dtype="int64") // 86400
+
+class TxStore():
+    """Day partitioned transaction table. Appended batches are merged into the partitions of their days and deduplicated on the key columns of the table, so time bounded reads only load the files of the relevant days. Partitions are stored in parquet format if pyarrow is installed and as pickled DataFrames otherwise."""
+    def __init__(self, root, table, file_format=None, lock_timeout=600, verbose=True):
+        if not table in STORE_TABLES:
+            raise RuntimeError("Invalid store table: %s" % table)
+        self.root = root
+        self.table = table
+        self.schema_table, self.key_columns = STORE_TABLES[table]
+        self.file_format = DEFAULT_FORMAT if file_format is None else file_format
+        if not self.file_format in ["parquet", "pkl"]:
+            raise RuntimeError("Invalid file format: %s" % self.file_format)
+        self.lock_timeout = lock_timeout
+        self.verbose = verbose
+        self.table_dir = os.path.join(root, table)
+        os.makedirs(self.table_dir, exist_ok=True)
+
+    def _path(self, day):
+        date = pd.to_datetime(int(day) * 86400, unit="s").strftime("%Y-%m-%d")
+        return os.path.join(self.table_dir, "day=%s.%s" % (date, self.file_format))
+
+    def days(self):
+        """Sorted day ids of the existing partitions"""
+        res = []
+        suffix = "." + self.file_format
+        for f_name in os.listdir(self.table_dir):
+            if f_name.startswith("day=") and f_name.endswith(suffix):
+                date = f_name[len("day="):-len(suffix)]
+                res.append(int(pd.Timestamp(date).value // 10**9 // 86400))
+        return sorted(res)
+
+    def _read_partition(self, day, columns=None):
+        path = self._path(day)
+        if self.file_format == "parquet":
+            return pd.read_parquet(path, columns=columns)
+        df = pd.read_pickle(path)
+        return df if columns is None else df[[col for col in columns if col in df.columns]]
+
+    def _write_partition(self, day, df):
+        path = self._path(day)
+        tmp_path = "%s.%i.tmp" % (path, os.getpid())
+        if self.file_format == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _lock(self):
+        lock_path = os.path.join(self.table_dir, "write.lock")
+        start = time.time()
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return lock_path
+            except FileExistsError:
+                if time.time() - start > self.lock_timeout:
+                    raise RuntimeError("Could not lock %s" % self.table_dir)
+                time.sleep(0.1)
+
+    def append(self, df):
+        """Merge a batch of transactions into the day partitions. Returns the number of new (not yet stored) records."""
+        if len(df) == 0:
+            return 0
+        for col in ["timeStamp"] + self.key_columns:
+            if not col in df.columns:
+                raise RuntimeError("Missing column '%s' for table %s" % (col, self.table))
+        df = df.reset_index(drop=True)
+        days = day_of(df["timeStamp"])
+        lock_path = self._lock()
+        try:
+            num_new = 0
+            existing_days = set(self.days())
+            for day, positions in pd.Series(np.arange(len(df))).groupby(days).groups.items():
+                batch = df.iloc[positions]
+                if day in existing_days:
+                    old = self._read_partition(day)
+                    merged = pd.concat([old, batch], ignore_index=True)
+                else:
+                    old = None
+                    merged = batch
+                merged = merged.drop_duplicates(subset=self.key_columns, keep="first")
+                merged = merged.sort_values("timeStamp", kind="mergesort").reset_index(drop=True)
+                num_new += len(merged) - (0 if old is None else len(old))
+                self._write_partition(day, merged)
+        finally:
+            os.remove(lock_path)
+        if self.verbose:
+            print("%s: %i new records in %i partitions" % (self.table, num_new, len(set(days))))
+        return num_new
+
+    def read(self, min_time=None, max_time=None, columns=None):
+        """Load the records of the given (inclusive) time interval reading only the partitions of the relevant days"""
+        days = self.days()
+        if min_time != None:
+            days = [day for day in days if day >= min_time // 86400]
+        if max_time != None:
+            days = [day for day in days if day <= max_time // 86400]
+        if columns is not None and not "timeStamp" in columns:
+            read_columns = list(columns) + ["timeStamp"]
+        else:
+            read_columns = columns
+        parts = [self._read_partition(day, read_columns) for day in days]
+        if len(parts) == 0:
+            return pd.DataFrame(columns=columns if columns is not None else ["timeStamp"] + self.key_columns)
+        df = pd.concat(parts, ignore_index=True)
+        # partitions are only pruned by day
+        if min_time != None:
+            df = df[df["timeStamp"] >= min_time]
+        if max_time != None:
+            df = df[df["timeStamp"] <= max_time]
+        return df if columns is None else df[list(columns)]
+
+    def read_table(self, min_time=None, max_time=None):
+        """Load the declared columns of the raw table schema with compact dtypes (similar to schema.read_table)"""
+        schema = TABLE_SCHEMAS[self.schema_table]
+        df = self.read(min_time, max_time).reset_index(drop=True)
+        for col, dtype in schema.items():
+            if not col in df.columns:
+                df[col] = np.nan
+        return df[list(schema.keys())].astype(schema)
+
+class TimeIndex():
+    """Sorted timestamps of an in-memory table for selecting time intervals with binary search instead of scanning every record"""
+    def __init__(self, timestamps):
+        timestamps = np.asarray(timestamps)
+        self.order = np.argsort(timestamps, kind="mergesort")
+        self.times = timestamps[self.order]
+
+    def positions(self, min_time=None, max_time=None):
+        """Positions of the records of the (inclusive) time interval in the original row order"""
+        start = 0 if min_time == None else np.searchsorted(self.times, min_time, side="left")
+        end = len(self.times) if max_time == None else np.searchsorted(self.times, max_time, side="right")
+        return np.sort(self.order[start:end])
+
+### Etherscan-like source ###
+
+class TokenBucket():
+    """Asyncio rate limiter: at most 'rate' requests per second with bursts of 'capacity' requests"""
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = None
+
+    async def acquire(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            now = loop.time()
+            if self.last is not None:
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class EtherscanClient():
+    """Asynchronous client for Etherscan-like account APIs. Requests are rate limited with a token bucket and at most 'concurrency' requests are in flight. Rate limit errors are retried with exponential backoff."""
+    def __init__(self, base_url="https://api.etherscan.io/api", api_key=None, rate=5.0, burst=1, concurrency=5, page_size=10000, max_retries=5, timeout=30, verbose=True):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.verbose = verbose
+        self.num_requests = 0
+
+    def _http_get(self, url):
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    async def request(self, params):
+        """Rate limited GET request. Returns the 'result' list of the response."""
+        if self.api_key is not None:
+            params = dict(params, apikey=self.api_key)
+        url = "%s?%s" % (self.base_url, urllib.parse.urlencode(params))
+        loop = asyncio.get_event_loop()
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            self.num_requests += 1
+            try:
+                data = await loop.run_in_executor(None, self._http_get, url)
+            except (OSError, ValueError) as e:
+                error = str(e)
+            else:
+                if str(data.get("status")) == "1":
+                    return data["result"]
+                if "no transactions found" in str(data.get("message", "")).lower():
+                    return []
+                error = str(data.get("result", data.get("message")))
+                if not "rate limit" in error.lower():
+                    raise RuntimeError("Request failed: %s (%s)" % (error, params))
+            if self.verbose:
+                print("Retrying request (%i): %s" % (attempt + 1, error))
+            await asyncio.sleep(0.5 * 2**attempt)
+        raise RuntimeError("Request failed after %i retries: %s" % (self.max_retries, params))
+
+    async def account_txs(self, address, action="txlist", start_block=0):
+        """Every transaction of an account from 'start_block'. Pages are requested from the last received block on."""
+        records = []
+        while True:
+            result = await self.request({"module": "account", "action": action, "address": address, "startblock": start_block, "endblock": 99999999, "sort": "asc", "page": 1, "offset": self.page_size})
+            records += result
+            if len(result) < self.page_size:
+                break
+            last_block = int(result[-1]["blockNumber"])
+            if last_block == start_block:
+                raise RuntimeError("More than %i transactions in block %i for %s" % (self.page_size, last_block, address))
+            # the last block may be incomplete, duplicates are removed by the store
+            start_block = last_block
+        return records
+
+    async def fetch(self, addresses, action="txlist", start_blocks={}):
+        """Fetch transactions of multiple accounts concurrently"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def fetch_one(address):
+            async with semaphore:
+                return await self.account_txs(address, action, start_blocks.get(address, 0))
+        results = await asyncio.gather(*[fetch_one(addr) for addr in addresses])
+        return records_to_df([rec for res in results for rec in res], action)
+
+def records_to_df(records, action):
+    """Convert Etherscan records into the raw transaction table format"""
+    table, tx_type = ETHERSCAN_ACTIONS[action]
+    df = pd.DataFrame(records)
+    if len(df) == 0:
+        return df
+    schema = TABLE_SCHEMAS[STORE_TABLES[table][0]]
+    for col in df.columns:
+        if col == "blockNumber" or (col in schema and not schema[col] in ["object", "category"]):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    for col in ["from", "to", "contractAddress"]:
+        if col in df.columns:
+            # missing endpoint (e.g. contract creation) is an empty string
+            df[col] = df[col].replace("", np.nan).str.lower()
+    if tx_type is not None:
+        df["tx_type"] = tx_type
+    return df
+
+class Ingestor():
+    """Incrementally ingest account transactions into day partitioned stores. The last ingested block of each (action, account) is kept in 'ingest_state.json', later refreshes only request newer blocks."""
+    def __init__(self, store_dir, client, actions=["txlist", "txlistinternal", "tokentx"], verbose=True):
+        for action in actions:
+            if not action in ETHERSCAN_ACTIONS:
+                raise RuntimeError("Invalid action: %s" % action)
+        self.store_dir = store_dir
+        self.client = client
+        self.actions = actions
+        self.verbose = verbose
+        self.stores = dict((table, TxStore(store_dir, table, verbose=verbose)) for table in set(ETHERSCAN_ACTIONS[a][0] for a in actions))
+        self.state_path = os.path.join(store_dir, "ingest_state.json")
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+
+    def _save_state(self):
+        tmp_path = "%s.%i.tmp" % (self.state_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    async def ingest(self, addresses, batch_size=100):
+        """Fetch new transactions of the given accounts and append them to the stores in batches"""
+        addresses = [str(addr).lower() for addr in addresses]
+        num_new = dict((action, 0) for action in self.actions)
+        for action in self.actions:
+            table = ETHERSCAN_ACTIONS[action][0]
+            last_blocks = self.state.setdefault(action, {})
+            for i in range(0, len(addresses), batch_size):
+                batch = addresses[i:i+batch_size]
+                df = await self.client.fetch(batch, action, last_blocks)
+                num_new[action] += self.stores[table].append(df)
+                if len(df) > 0:
+                    # transactions of an account are either sent or received by it
+                    for col in ["from", "to"]:
+                        max_blocks = df.groupby(col)["blockNumber"].max()
+                        for addr in set(batch).intersection(max_blocks.index):
+                            last_blocks[addr] = max(last_blocks.get(addr, 0), int(max_blocks[addr]))
+                self._save_state()
+                if self.verbose:
+                    print("%s: %i/%i accounts ingested" % (action, min(i+batch_size, len(addresses)), len(addresses)))
+        return num_new
@@ -16,12 +16,12 @@ python run_ens_experiment.py False 6 -1
 python run_ens_experiment.py False -1 50
 
 #for algo in {laplacian,netmf,role2vec,deepwalk,boostne,walklets,grarep,diff2vec,hope,nodesketch,nmfadmm,graphwave}; do
+# train models for multiple samples in parallel (the preprocessed graph is cached)
+python train_node_embeddings_parallel.py role2vec,diff2vec False 10
 for algo in {role2vec,diff2vec}; do
 # run for multiple samples
 for i in {0..9}; do
 echo $algo $i
-# train model
-python train_node_embedding.py $algo False $i;
 # create representation
 python run_ens_experiment.py True $algo $i;
 done;
@@ -34,11 +34,11 @@ python run_tornado_experiment.py False 6 -1
 # create gas price representation
 python run_tornado_experiment.py False -1 50
 
+# train models for multiple samples in parallel
+python train_node_embeddings_parallel.py diff2vec True 10
 # run for multiple samples
 for i in {0..9}; do
 echo $i
-# train model
-python train_node_embedding.py diff2vec True $i;
 # create representation
 python run_tornado_experiment.py True diff2vec $i;
 done;
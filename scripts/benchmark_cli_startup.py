@@ -0,0 +1,31 @@
+import subprocess, sys, time
+import numpy as np
+
+# heavy dependencies that are only needed by some of the subcommands
+HEAVY_MODULES = ["matplotlib", "seaborn", "tqdm", "karateclub", "networkx"]
+
+def timed_run(code, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    return np.median(durations)
+
+def loaded_modules(code):
+    check = code + "\nimport sys; print('HEAVY:' + ','.join(m for m in %s if m in sys.modules))" % str(HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, "-c", check]).decode("utf-8")
+    return [line for line in output.split("\n") if line.startswith("HEAVY:")][0][len("HEAVY:"):]
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cases = [
+        ("python interpreter", "pass"),
+        ("ethprivacy --help", "import sys; sys.argv=['ethprivacy','--help']\ntry:\n    from ethprivacy.cli import main; main()\nexcept SystemExit:\n    pass"),
+        ("import ethprivacy.address2vec", "import ethprivacy.address2vec"),
+        ("import ethprivacy.node_embeddings", "import ethprivacy.node_embeddings"),
+        ("eager imports (previous behaviour)", "import matplotlib.pyplot, tqdm, ethprivacy.address2vec"),
+    ]
+    print("%-36s %10s  %s" % ("case", "median_s", "heavy modules loaded"))
+    for name, code in cases:
+        print("%-36s %10.3f  %s" % (name, timed_run(code, repeats), loaded_modules(code)))
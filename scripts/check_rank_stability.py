@@ -0,0 +1,37 @@
+from ethprivacy.entity_api import EntityAPI
+from ethprivacy.address2vec import Address2Vec
+from ethprivacy.evaluation import rank_stability
+from ethprivacy.tornado_mixer import TornadoQueries
+from ethprivacy.experiments import load_filtered_data
+import sys
+
+data_dir = "../data"
+results_dir = "../results"
+
+def run(dtype, hour_bins, gas_bins, rtol):
+    api = EntityAPI(data_dir, lazy=True, compact=True)
+    max_time = api.events["timeStamp"].max()
+    filtered = load_filtered_data(results_dir)
+    use_hour = hour_bins != -1
+    use_gas = gas_bins != -1
+    # ENS experiment setup
+    ae = Address2Vec(filtered, min_tx_cnt=5, gas_bins=gas_bins, hour_bins=hour_bins, use_hour=use_hour, use_gas=use_gas)
+    idx_pairs, _ = ae.get_idx_pairs(api)
+    ens_summary, _ = rank_stability(ae, dtype, idx_pairs=idx_pairs, rtol=rtol)
+    print(ens_summary)
+    # Tornado experiment setup
+    queries = [TornadoQueries(mixer_str_value=mixer, data_folder=data_dir, max_time=max_time) for mixer in ["0.1", "1", "10"]]
+    ae = Address2Vec(filtered, min_tx_cnt=1, gas_bins=gas_bins, hour_bins=hour_bins, use_hour=use_hour, use_gas=use_gas)
+    tornado_summary, _ = rank_stability(ae, dtype, query_objects=queries, filters=["past", "week", "day"], rtol=rtol)
+    print(tornado_summary)
+    num_unstable = ens_summary["unstable"].sum() + tornado_summary["unstable"].sum()
+    print("Rank changes beyond ties:", num_unstable)
+    
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage:")
+        print("check_rank_stability.py <dtype> <hour_bins> <gas_bins> <rtol>")
+    else:
+        rtol = float(sys.argv[4]) if len(sys.argv) > 4 else 1e-4
+        run(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), rtol)
+        print("done")
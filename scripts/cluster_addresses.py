@@ -0,0 +1,25 @@
+from ethprivacy.entity_api import EntityAPI
+from ethprivacy.address2vec import Address2Vec
+from ethprivacy.address_clustering import all_pairs_top_k, cluster_addresses
+from ethprivacy.experiments import load_filtered_data
+import os, sys
+
+data_dir = "../data"
+results_dir = "../results"
+
+def run(k, num_workers, quantile):
+    api = EntityAPI(data_dir, lazy=True, compact=True)
+    filtered = load_filtered_data(results_dir)
+    ae = Address2Vec(filtered, min_tx_cnt=5, hour_bins=6, use_gas=False, verbose=False)
+    output_dir = "%s/neighbors/%s_k%i" % (results_dir, ae.id, k)
+    table = all_pairs_top_k(ae, k=k, output_dir=output_dir, num_workers=num_workers)
+    # calibrate the distance threshold on ENS address pairs
+    idx_pairs, _ = ae.get_idx_pairs(api)
+    clusters, summary = cluster_addresses(ae, table, idx_pairs=idx_pairs, quantile=quantile)
+    clusters.to_csv(os.path.join(output_dir, "clusters_q%s.csv" % quantile), index=False)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4:
+        run(int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3]))
+    else:
+        print("cluster_addresses.py <k> <num_workers> <ens_distance_quantile>")
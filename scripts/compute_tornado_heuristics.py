@@ -0,0 +1,15 @@
+import sys
+from ethprivacy.entity_api import EntityAPI
+from ethprivacy.tornado_heuristics import compute_heuristics
+
+data_dir = "../data"
+results_dir = "../results"
+
+if __name__ == "__main__":
+    # usage: compute_tornado_heuristics.py [<output_dir> <overwrite>]
+    # heuristics files are written next to the results, the published files in the data folder are only replaced with overwrite=True
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else "%s/heuristics" % results_dir
+    overwrite = len(sys.argv) > 2 and sys.argv[2] == "True"
+    api = EntityAPI(data_dir, lazy=True, compact=True)
+    compute_heuristics(api, data_dir, output_folder=output_dir, overwrite=overwrite)
+    print("done")
@@ -0,0 +1,24 @@
+import sys, asyncio
+import pandas as pd
+from ethprivacy.tx_store import EtherscanClient, Ingestor
+
+data_dir = "../data"
+
+if len(sys.argv) < 3:
+    print("Usage:ingest_transactions.py <address_file> <api_key> <base_url> <rate>")
+else:
+    # one address per line
+    address_file = sys.argv[1]
+    api_key = sys.argv[2]
+    base_url = sys.argv[3] if len(sys.argv) > 3 else "https://api.etherscan.io/api"
+    rate = float(sys.argv[4]) if len(sys.argv) > 4 else 5.0
+
+    addresses = list(pd.read_csv(address_file, header=None)[0].str.lower().unique())
+    print("Number of accounts:", len(addresses))
+
+    client = EtherscanClient(base_url=base_url, api_key=api_key, rate=rate)
+    ingestor = Ingestor("%s/tx_store" % data_dir, client)
+    num_new = asyncio.get_event_loop().run_until_complete(ingestor.ingest(addresses))
+    print(num_new)
+    print("Number of requests:", client.num_requests)
+    print("done")
@@ -0,0 +1,45 @@
+import os, sys
+import pandas as pd
+from ethprivacy.entity_api import EntityAPI
+from ethprivacy.node_embeddings import cached_node_embedder, karate_factory
+from ethprivacy.incremental_embedding import snapshot_edges, refresh_embedding, ens_quality_check
+from ethprivacy.experiments import load_filtered_data
+
+data_dir = "../data"
+results_dir = "../results"
+
+if len(sys.argv) < 3:
+    print("Usage:refresh_node_embedding.py <algo> <split_ratio> <hops>")
+    print("Trains <algo> on the first <split_ratio> share of the time interval, then approximates the embedding of the new edges by neighbor averaging (no retraining) and compares it with a full retrain on ENS pairs.")
+else:
+    algo = sys.argv[1]#"netmf"
+    # share of the time interval used for the initial training
+    split_ratio = float(sys.argv[2])
+    hops = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    DIM = 128
+    NWALKS = 10
+
+    api = EntityAPI(data_dir, lazy=True, compact=True)
+    min_time, max_time = api.events["timeStamp"].min(), api.events["timeStamp"].max()
+    split_time = int(min_time + split_ratio * (max_time - min_time))
+    cache_dir = "%s/graph_cache" % results_dir
+
+    # train on the earlier snapshot then refresh it with the new edges by neighbor averaging (no retraining)
+    ne = cached_node_embedder(api, cache_dir, max_time=split_time)
+    initial = ne.fit(karate_factory(algo, DIM, NWALKS, 1))
+    affected = ne.update(snapshot_edges(api, min_time=split_time+1))
+    refreshed = refresh_embedding(ne, initial, affected, hops=hops)
+
+    # full retrain for quality check
+    ne_full = cached_node_embedder(api, cache_dir)
+    retrained = ne_full.fit(karate_factory(algo, DIM, NWALKS, 1))
+
+    filtered = load_filtered_data(results_dir)
+    ens_result, summary = ens_quality_check(api, filtered, {"retrained": retrained, "refreshed": refreshed, "initial": initial})
+    print(ens_result.groupby("embedding_id")["rank"].mean())
+    print(summary)
+    output_dir = "%s/node_embeddings_refresh" % results_dir
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    refreshed.to_csv("%s/%s_split%s_hops%i.csv" % (output_dir, algo, sys.argv[2], hops), index=False)
+    print("done")
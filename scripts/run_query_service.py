@@ -0,0 +1,57 @@
+import asyncio, sys
+import numpy as np
+import pandas as pd
+from ethprivacy.entity_api import EntityAPI
+from ethprivacy.address2vec import Address2Vec
+from ethprivacy.query_service import QueryService, QueryClient
+
+data_dir = "../data"
+results_dir = "../results"
+
+def serve(socket_path, hour_bins=6, gas_bins=50, min_tx_cnt=5):
+    api = EntityAPI(data_dir, compact=True)
+    filtered = pd.read_csv("%s/filtered_data.csv" % results_dir)
+    ae = Address2Vec(filtered, min_tx_cnt=min_tx_cnt, gas_bins=gas_bins, hour_bins=hour_bins)
+    print("Representation id:", ae.id)
+    print("Representation shape:", ae.X.shape)
+    service = QueryService(api, ae)
+    service.serve_forever(path=socket_path, warm_up=True)
+
+async def benchmark(socket_path, num_requests=1000, concurrency=16):
+    client = await QueryClient(path=socket_path).connect()
+    # random mixture of query types
+    ens_names = list(pd.read_csv("%s/all_ens_pairs.csv" % data_dir)["name"].unique())
+    filtered = pd.read_csv("%s/filtered_data.csv" % results_dir, usecols=["from"])
+    addresses = list(filtered["from"].unique())
+    requests = []
+    for i in range(num_requests):
+        addr = addresses[np.random.randint(len(addresses))]
+        method = ["similar", "address_info", "neighbors", "ens_info"][i % 4]
+        if method == "ens_info":
+            params = {"name": ens_names[np.random.randint(len(ens_names))]}
+        elif method == "similar":
+            params = {"address": addr, "k": 10}
+        else:
+            params = {"address": addr}
+        requests.append((method, params))
+    client_stats = await client.benchmark(requests, concurrency=concurrency)
+    server_stats = (await client.request("stats"))["result"]
+    await client.close()
+    return client_stats, server_stats
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage:")
+        print("run_query_service.py serve <socket_path>")
+        print("OR")
+        print("run_query_service.py benchmark <socket_path> <num_requests> <concurrency>")
+    elif sys.argv[1] == "serve":
+        serve(sys.argv[2])
+    else:
+        num_requests = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+        concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+        loop = asyncio.new_event_loop()
+        client_stats, server_stats = loop.run_until_complete(benchmark(sys.argv[2], num_requests, concurrency))
+        print("client latency:", client_stats)
+        print("server latency:", server_stats)
+        print("done")
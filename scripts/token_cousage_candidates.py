@@ -0,0 +1,36 @@
+from ethprivacy.entity_api import EntityAPI
+from ethprivacy.address2vec import Address2Vec
+from ethprivacy.token_similarity import TokenCoUsage, candidate_recall
+from ethprivacy.tornado_mixer import TornadoQueries
+from ethprivacy.experiments import load_filtered_data
+import pandas as pd
+import sys
+
+data_dir = "../data"
+results_dir = "../results"
+
+def run(metric, k):
+    api = EntityAPI(data_dir, lazy=True, compact=True)
+    max_time = api.events["timeStamp"].max()
+    filtered = load_filtered_data(results_dir)
+    # ENS address pairs
+    ae = Address2Vec(filtered, min_tx_cnt=5, hour_bins=6, use_gas=False, verbose=False)
+    idx_pairs, _ = ae.get_idx_pairs(api)
+    ens_pairs = pd.DataFrame({"query_addr": [ae.idx2addr[pair[1]] for pair in idx_pairs], "target_addr": [ae.idx2addr[pair[0]] for pair in idx_pairs]})
+    tc = TokenCoUsage(api, addresses=ae.addr_to_embedd, max_time=max_time)
+    candidates = tc.top_k(ens_pairs["query_addr"].unique(), k=k, metric=metric)
+    print("ENS candidate recall")
+    print(candidate_recall(candidates, ens_pairs, [1, 5, k]))
+    # Tornado withdraw-deposit pairs
+    queries = [TornadoQueries(mixer_str_value=mixer, data_folder=data_dir, max_time=max_time) for mixer in ["0.1", "1", "10"]]
+    tornado_pairs = pd.concat([tq.tornado_pairs[["receiver", "sender"]] for tq in queries]).rename(columns={"receiver": "query_addr", "sender": "target_addr"})
+    tc = TokenCoUsage(api, max_time=max_time)
+    candidates = tc.top_k(tornado_pairs["query_addr"].unique(), k=k, metric=metric)
+    print("Tornado candidate recall")
+    print(candidate_recall(candidates, tornado_pairs, [1, 5, k]))
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3:
+        run(sys.argv[1], int(sys.argv[2]))
+    else:
+        print("token_cousage_candidates.py <metric: cosine|jaccard> <k>")
@@ -1,7 +1,8 @@
 import os, sys
 from ethprivacy.entity_api import EntityAPI
 from ethprivacy.node_embeddings import *
-from ethprivacy.tornado_mixer import TornadoQueries
+from ethprivacy.tornado_history import get_history_store
+from ethprivacy.schema import peak_rss_mb
 
 data_dir = "../data"
 output_dir = "../results"
@@ -31,19 +32,12 @@ else:
     else:
         f_name = "%s_dim%i.csv" % (algo, DIM)
 
-    api = EntityAPI(data_dir)
+    api = EntityAPI(data_dir, compact=True)
     max_time = api.events["timeStamp"].max()
 
     edges_to_remove = []
     if exclude_tornado:
-        tq0_1 = TornadoQueries(mixer_str_value="0.1", max_time=max_time)
-        tq1 = TornadoQueries(mixer_str_value="1", max_time=max_time)
-        tq10 = TornadoQueries(mixer_str_value="10", max_time=max_time)
-        tq100 = TornadoQueries(mixer_str_value="100", max_time=max_time)
-        for tq in [tq0_1, tq1, tq10, tq100]:
-            src, trg, _, _ = zip(*tq.tornado_tuples)
-            edges_to_remove += list(zip(src,trg))
-        edges_to_remove = list(set(edges_to_remove))
+        edges_to_remove = get_history_store(data_dir).heuristic_edges(max_time=max_time)
     print(len(edges_to_remove))
 
     ne = NodeEmbedder(api, edges_to_remove=edges_to_remove)
@@ -51,4 +45,5 @@ else:
     embedding = ne.fit(karate_obj)
     print(embedding.shape)
     embedding.to_csv("%s/%s" % (output_dir, f_name), index=False)
+    print("Peak memory usage: %.1f MB" % peak_rss_mb())
     print("done")
\ No newline at end of file
@@ -0,0 +1,20 @@
+import sys
+from ethprivacy.experiments import train_node_embeddings
+
+data_dir = "../data"
+output_dir = "../results"
+
+if len(sys.argv) < 4:
+    print("Usage:train_node_embeddings_parallel.py <algos> <exclude_tornado> <num_samples> <cpu_budget> <memory_budget_mb> <workers> <reseed>")
+else:
+    algos = sys.argv[1].split(",")#"role2vec,diff2vec"
+    exclude_tornado = sys.argv[2] == "True"
+    num_samples = int(sys.argv[3])
+    cpu_budget = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    memory_budget_mb = float(sys.argv[5]) if len(sys.argv) > 5 else None
+    workers = int(sys.argv[6]) if len(sys.argv) > 6 else 1
+    # samples are trained with the default seed of karateclub unless reseed is True
+    reseed = sys.argv[7] == "True" if len(sys.argv) > 7 else False
+    # the preprocessed graph is built only once for each set of removed edges
+    train_node_embeddings(data_dir, output_dir, algos, exclude_tornado, range(num_samples), workers=workers, cpu_budget=cpu_budget, memory_budget_mb=memory_budget_mb, reseed=reseed)
+    print("done")
@@ -8,6 +8,7 @@ install_requires = [
     'tqdm',
     'matplotlib',
     'seaborn',
+    'scipy',
 ]
 
 setup_requires = ['pytest-runner']
@@ -41,6 +42,7 @@ setup(name="ethprivacy",
       author_email="fberes@info.ilab.sztaki.hu",
       packages = find_packages(),
       install_requires=install_requires,
+      entry_points={"console_scripts": ["ethprivacy=ethprivacy.cli:main"]},
       setup_requires = setup_requires,
       tests_require = tests_require,
       keywords = keywords,
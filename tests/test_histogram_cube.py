@@ -0,0 +1,39 @@
+import pytest
+import numpy as np
+import pandas as pd
+from ethprivacy.address2vec import Address2Vec
+from ethprivacy.histogram_cube import HistogramCube
+
+def sample_events(seed=0):
+    rnd = np.random.RandomState(seed)
+    addresses = ["0x%02x" % i for i in range(30)]
+    tx_cnts = rnd.randint(1, 20, size=len(addresses))
+    senders = np.repeat(addresses, tx_cnts)
+    events = pd.DataFrame({
+        "from": senders,
+        "hash": ["h%i" % i for i in range(len(senders))],
+        "hour": rnd.randint(0, 86400, size=len(senders)),
+        "normalized_gas": rnd.exponential(1.0, size=len(senders)),
+    })
+    # the largest gas price belongs to an address that is not embedded
+    rare = pd.DataFrame({"from": ["0xrare"], "hash": ["h_rare"], "hour": [0], "normalized_gas": [events["normalized_gas"].max() * 3]})
+    return pd.concat([events, rare], ignore_index=True)
+
+@pytest.mark.parametrize("seed", [0, 7, 8])
+@pytest.mark.parametrize("hour_bins,gas_bins", [(6, 25), (24, 50), (8, 9), (4, -1), (-1, 10)])
+def test_cube_matches_dataframe(seed, hour_bins, gas_bins):
+    events = sample_events(seed)
+    min_tx_cnt = 5
+    cube = HistogramCube(events, min_tx_cnt=min_tx_cnt, verbose=False)
+    kwargs = dict(min_tx_cnt=min_tx_cnt, hour_bins=hour_bins, gas_bins=gas_bins, use_hour=hour_bins != -1, use_gas=gas_bins != -1, verbose=False)
+    a2v = Address2Vec(events, **kwargs)
+    a2v_cube = Address2Vec(events, cube=cube, **kwargs)
+    assert a2v.addr_to_embedd == a2v_cube.addr_to_embedd
+    assert a2v.X.shape == a2v_cube.X.shape
+    assert np.array_equal(a2v.X, a2v_cube.X)
+
+def test_cube_rejects_different_gas_range():
+    events = sample_events()
+    cube = HistogramCube(events, min_tx_cnt=1, verbose=False)
+    with pytest.raises(RuntimeError):
+        Address2Vec(events, min_tx_cnt=5, gas_bins=25, hour_bins=6, cube=cube, verbose=False)
@@ -0,0 +1,63 @@
+import pickle
+import numpy as np
+import pandas as pd
+import networkx as nx
+from ethprivacy.node_embeddings import NodeEmbedder
+from ethprivacy.incremental_embedding import refresh_embedding, ens_quality_check
+
+NUM_PAIRS = 20
+DIM = 8
+
+class ToyAPI():
+    """EntityAPI stand-in with ENS pairs (a_i, b_i)"""
+    def __init__(self):
+        names = ["name%i.eth" % i for i in range(NUM_PAIRS)]
+        self.ens_pairs = pd.DataFrame({"name": names + names, "address": ["a%i" % i for i in range(NUM_PAIRS)] + ["b%i" % i for i in range(NUM_PAIRS)]})
+
+def initial_graph(tmp_path):
+    """Chain of the known addresses a_i, each connected to the hub h"""
+    addresses = ["a%i" % i for i in range(NUM_PAIRS)] + ["h"]
+    node_map = dict((addr, idx) for idx, addr in enumerate(addresses))
+    G = nx.Graph()
+    G.add_edges_from((i, i+1) for i in range(NUM_PAIRS-1))
+    G.add_edges_from((i, node_map["h"]) for i in range(NUM_PAIRS))
+    path = str(tmp_path / "graph.pkl")
+    with open(path, "wb") as f:
+        pickle.dump({"G": G, "node_map": node_map}, f)
+    return NodeEmbedder.load(path, verbose=False)
+
+def embedding(vectors):
+    emb_df = pd.DataFrame(np.array(list(vectors.values())))
+    emb_df["address"] = list(vectors.keys())
+    return emb_df
+
+def quality_of_refresh(tmp_path, new_edges):
+    rnd = np.random.RandomState(0)
+    initial = dict(("a%i" % i, rnd.normal(size=DIM)) for i in range(NUM_PAIRS))
+    initial["h"] = rnd.normal(size=DIM)
+    # a retrained model places the new address b_i next to a_i
+    retrained = dict(initial)
+    retrained.update(("b%i" % i, initial["a%i" % i] + 0.01 * rnd.normal(size=DIM)) for i in range(NUM_PAIRS))
+    ne = initial_graph(tmp_path)
+    affected = ne.update(new_edges)
+    refreshed = refresh_embedding(ne, embedding(initial), affected, verbose=False)
+    # preprocessed events of the ENS experiment (side channels are not used by node embeddings)
+    events = pd.DataFrame({"from": sorted(retrained), "hash": ["h%i" % i for i in range(len(retrained))], "hour": 0, "normalized_gas": 1.0})
+    _, summary = ens_quality_check(ToyAPI(), events, {"retrained": embedding(retrained), "refreshed": refreshed}, min_tx_cnt=1)
+    return summary.loc["refreshed"]
+
+def test_quality_check_accepts_good_refresh(tmp_path):
+    # new addresses transact with their ENS pair
+    summary = quality_of_refresh(tmp_path, [("a%i" % i, "b%i" % i) for i in range(NUM_PAIRS)])
+    assert summary["num_queries"] == 2 * NUM_PAIRS
+    assert summary["mean_rank_a"] == 1.0
+    assert summary["mean_rank_b"] == 1.0
+    assert summary["worse"] == 0
+
+def test_quality_check_detects_degradation(tmp_path):
+    # new addresses only transact with the hub, so neighbor averaging gives them the same representation
+    summary = quality_of_refresh(tmp_path, [("h", "b%i" % i) for i in range(NUM_PAIRS)])
+    assert summary["num_queries"] == 2 * NUM_PAIRS
+    assert summary["mean_rank_a"] == 1.0
+    assert summary["mean_rank_b"] > 5.0
+    assert summary["worse"] == 2 * NUM_PAIRS
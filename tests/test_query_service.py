@@ -0,0 +1,134 @@
+import json
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+from ethprivacy.address2vec import Address2Vec
+from ethprivacy.query_service import QueryService, QueryClient
+
+class ToyAPI():
+    """EntityAPI stand-in that records its lookups"""
+    def __init__(self):
+        self.calls = []
+
+    def address_info(self, address_str, min_time=None, max_time=None):
+        address = str(address_str).lower()
+        self.calls.append(address)
+        time.sleep(0.01)
+        return {"address": address, "ens_names": ["%s.eth" % address[2:]]}
+
+def toy_a2v(seed=0):
+    rnd = np.random.RandomState(seed)
+    addresses = ["0x%02x" % i for i in range(30)]
+    senders = np.repeat(addresses, rnd.randint(3, 15, size=len(addresses)))
+    events = pd.DataFrame({
+        "from": senders,
+        "hash": ["h%i" % i for i in range(len(senders))],
+        "hour": rnd.randint(0, 86400, size=len(senders)),
+        "normalized_gas": rnd.exponential(1.0, size=len(senders)),
+    })
+    return Address2Vec(events, min_tx_cnt=3, verbose=False)
+
+def brute_force_top_k(a2v, address, k):
+    idx = a2v.addr2idx[address]
+    dist = np.sqrt(np.square(a2v.X - a2v.X[idx]).sum(axis=1))
+    dist[idx] = np.inf
+    return [a2v.idx2addr[i] for i in np.argsort(dist, kind="mergesort")[:k]]
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+async def start_service(service):
+    server = await service.start(port=0)
+    return server.sockets[0].getsockname()[1]
+
+def test_concurrent_similar_and_address_info():
+    a2v, api = toy_a2v(), ToyAPI()
+    service = QueryService(api, a2v, verbose=False)
+    async def main():
+        port = await start_service(service)
+        clients = [await QueryClient(port=port).connect() for _ in range(2)]
+        addresses = a2v.addr_to_embedd[:10]
+        requests = []
+        for i, addr in enumerate(addresses):
+            client = clients[i % 2]
+            requests.append(client.request("similar", address=addr, k=5))
+            requests.append(client.request("address_info", address=addr))
+        responses = await asyncio.gather(*requests)
+        for client in clients:
+            await client.close()
+        await service.stop()
+        return addresses, responses
+    addresses, responses = run(main())
+    for addr, similar, info in zip(addresses, responses[0::2], responses[1::2]):
+        assert [rec["address"] for rec in similar["result"]] == brute_force_top_k(a2v, addr, 5)
+        assert info["result"] == {"address": addr, "ens_names": ["%s.eth" % addr[2:]]}
+
+def test_similarity_requests_are_batched():
+    a2v = toy_a2v()
+    service = QueryService(ToyAPI(), a2v, batch_window=0.05, verbose=False)
+    batch_sizes = []
+    top_k = service.top_k
+    def recorded_top_k(query_indices, k=10):
+        batch_sizes.append(len(query_indices))
+        return top_k(query_indices, k)
+    service.top_k = recorded_top_k
+    async def main():
+        port = await start_service(service)
+        client = await QueryClient(port=port).connect()
+        # different k values in the same batch
+        responses = await asyncio.gather(*[client.request("similar", address=addr, k=1 + i % 3) for i, addr in enumerate(a2v.addr_to_embedd[:12])])
+        await client.close()
+        await service.stop()
+        return responses
+    responses = run(main())
+    assert sum(batch_sizes) == 12
+    assert len(batch_sizes) < 12
+    for i, (addr, response) in enumerate(zip(a2v.addr_to_embedd[:12], responses)):
+        assert [rec["address"] for rec in response["result"]] == brute_force_top_k(a2v, addr, 1 + i % 3)
+
+def test_cache_hits():
+    a2v, api = toy_a2v(), ToyAPI()
+    service = QueryService(api, a2v, verbose=False)
+    addr = a2v.addr_to_embedd[0]
+    async def main():
+        port = await start_service(service)
+        client = await QueryClient(port=port).connect()
+        first = await client.request("address_info", address=addr)
+        # case variants share the cache entry
+        second = await client.request("address_info", address=addr.upper().replace("0X", "0x"))
+        await client.request("similar", address=addr, k=3)
+        await client.request("similar", address=addr, k=3)
+        stats = await client.request("stats")
+        await client.close()
+        await service.stop()
+        return first, second, stats
+    first, second, stats = run(main())
+    assert first["result"] == second["result"]
+    assert api.calls == [addr]
+    assert stats["result"]["cache_hits"] == 2
+    assert stats["result"]["cache_misses"] == 2
+
+def test_oversized_request_line():
+    a2v = toy_a2v()
+    service = QueryService(ToyAPI(), a2v, verbose=False)
+    async def main():
+        port = await start_service(service)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        request = {"id": 1, "method": "address_info", "params": {"address": a2v.addr_to_embedd[0]}}
+        writer.write((json.dumps(request) + "\n" + "x" * (2**17) + "\n").encode("utf-8"))
+        await writer.drain()
+        responses = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            responses.append(json.loads(line))
+        writer.close()
+        await service.stop()
+        return responses
+    responses = sorted(run(main()), key=lambda res: res["id"] is None)
+    # the request in flight is answered before the connection is closed
+    assert len(responses) == 2
+    assert responses[0]["id"] == 1 and "result" in responses[0]
+    assert responses[1]["id"] is None and responses[1]["error"].startswith("Invalid request")
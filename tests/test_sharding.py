@@ -0,0 +1,58 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from ethprivacy.address2vec import Address2Vec
+from ethprivacy.sharding import ShardManifest, run_workers, run_sharded_ens
+
+def toy_a2v(seed=0):
+    rnd = np.random.RandomState(seed)
+    addresses = ["0x%02x" % i for i in range(20)]
+    senders = np.repeat(addresses, rnd.randint(3, 15, size=len(addresses)))
+    events = pd.DataFrame({
+        "from": senders,
+        "hash": ["h%i" % i for i in range(len(senders))],
+        "hour": rnd.randint(0, 86400, size=len(senders)),
+        "normalized_gas": rnd.exponential(1.0, size=len(senders)),
+    })
+    return Address2Vec(events, min_tx_cnt=3, verbose=False)
+
+def toy_pairs(a2v, seed=0):
+    rnd = np.random.RandomState(seed)
+    num_addresses = len(a2v.addr_to_embedd)
+    pairs = np.array([(i, j) for i in range(num_addresses) for j in range(num_addresses) if i != j], dtype="int64")
+    return pairs[rnd.permutation(len(pairs))[:50]]
+
+def failing_shard(start, end):
+    raise RuntimeError("Finished shards must not be computed again!")
+
+def test_forked_workers_match_unsharded_run(tmp_path):
+    a2v = toy_a2v()
+    idx_pairs = toy_pairs(a2v)
+    work_dir = str(tmp_path / "ens")
+    manifest = ShardManifest(work_dir, idx_pairs, shard_size=7, verbose=False)
+    run_workers(manifest, lambda start, end: a2v.run_ens(idx_pairs[start:end], a2v.id), num_workers=3)
+    assert manifest.pending_shards() == []
+    assert [name for name in os.listdir(work_dir) if name.endswith(".lock")] == []
+    expected = a2v.run_ens(idx_pairs, a2v.id)
+    pd.testing.assert_frame_equal(manifest.collect(), expected)
+    # a re-run with a new manifest object (e.g. on another host) skips every finished shard
+    manifest = ShardManifest(work_dir, idx_pairs, shard_size=7, verbose=False)
+    run_workers(manifest, failing_shard, num_workers=2)
+    pd.testing.assert_frame_equal(manifest.collect(), expected)
+
+def test_results_are_exported_once(tmp_path):
+    a2v = toy_a2v()
+    idx_pairs = toy_pairs(a2v)
+    exported = []
+    for exclusive in [True, True, False]:
+        result_df = run_sharded_ens(a2v, idx_pairs, a2v.id, str(tmp_path), shard_size=10, num_workers=2, exclusive=exclusive, export=exported.append, verbose=False)
+        pd.testing.assert_frame_equal(result_df, a2v.run_ens(idx_pairs, a2v.id))
+    assert len(exported) == 1
+
+def test_manifest_mismatch(tmp_path):
+    a2v = toy_a2v()
+    idx_pairs = toy_pairs(a2v)
+    ShardManifest(str(tmp_path), idx_pairs, shard_size=10, params={"sample_id": 0}, verbose=False)
+    with pytest.raises(RuntimeError):
+        ShardManifest(str(tmp_path), idx_pairs, shard_size=10, params={"sample_id": 1}, verbose=False)
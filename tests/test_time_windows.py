@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+from ethprivacy.address2vec import Address2Vec
+from ethprivacy.time_windows import WindowedAddress2Vec, bucket_ids
+
+DAY = 86400
+
+def sample_events(seed=0):
+    rnd = np.random.RandomState(seed)
+    addresses = ["0x%02x" % i for i in range(25)]
+    senders = np.repeat(addresses, rnd.randint(5, 40, size=len(addresses)))
+    time_stamps = 1577836800 + rnd.randint(0, 90*DAY, size=len(senders))
+    events = pd.DataFrame({
+        "from": senders,
+        "hash": ["h%i" % i for i in range(len(senders))],
+        "timeStamp": time_stamps,
+        "hour": time_stamps % DAY,
+        "normalized_gas": rnd.exponential(1.0, size=len(senders)),
+    })
+    return events.sort_values("timeStamp").reset_index(drop=True)
+
+def test_window_matches_address2vec_of_the_slice():
+    events = sample_events()
+    kwargs = dict(norm_type=None, min_tx_cnt=3, gas_bins=0, hour_bins=6, aggregations=["mean","std","min","max"], verbose=False)
+    windows = WindowedAddress2Vec(events, bucket_size="month", **kwargs)
+    buckets = bucket_ids(events["timeStamp"], "month")
+    for first, last in [(windows.buckets[0], windows.buckets[0]), (windows.buckets[1], windows.buckets[2])]:
+        a2v_window = windows.window(first, last)
+        a2v = Address2Vec(events[(buckets >= first) & (buckets <= last)], **kwargs)
+        assert a2v_window.addr_to_embedd == a2v.addr_to_embedd
+        assert a2v_window.X.shape == a2v.X.shape
+        assert np.allclose(a2v_window.X, a2v.X, rtol=1e-9, atol=1e-6)
+
+def test_window_medians_and_gas_distribution_are_approximations():
+    events = sample_events(1)
+    resolution = 100
+    kwargs = dict(norm_type=None, min_tx_cnt=3, gas_bins=10, hour_bins=6, aggregations=["median"], verbose=False)
+    windows = WindowedAddress2Vec(events, bucket_size="month", median_resolution=resolution, **kwargs)
+    buckets = bucket_ids(events["timeStamp"], "month")
+    # medians are estimated within half of a histogram bin
+    for first in windows.buckets:
+        a2v_window = windows.window(first)
+        a2v = Address2Vec(events[buckets == first], **kwargs)
+        assert a2v_window.addr_to_embedd == a2v.addr_to_embedd
+        for col in ["hour", "normalized_gas"]:
+            error = np.abs(a2v_window.filtered_stats[(col, "median")].values - a2v.filtered_stats[(col, "median")].values)
+            assert error.max() <= windows.value_range[col] / resolution / 2 + 1e-9
+    # gas price bins agree with Address2Vec only for windows that contain the maximal gas price
+    hour_cols = slice(2, 8)
+    a2v_window = windows.window(windows.buckets[0], windows.buckets[-1])
+    a2v = Address2Vec(events, **kwargs)
+    assert a2v_window.X.shape == a2v.X.shape
+    assert np.allclose(a2v_window.X[:,2:], a2v.X[:,2:])
+    max_bucket = buckets[events["normalized_gas"].values.argmax()]
+    other = [bucket for bucket in windows.buckets if bucket != max_bucket][0]
+    a2v_window = windows.window(other)
+    a2v = Address2Vec(events[buckets == other], **kwargs)
+    assert np.allclose(a2v_window.X[:,hour_cols], a2v.X[:,hour_cols])
+    assert not (a2v_window.X.shape == a2v.X.shape and np.allclose(a2v_window.X[:,8:], a2v.X[:,8:]))
@@ -0,0 +1,111 @@
+import json
+import asyncio
+import threading
+import socketserver
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+from ethprivacy.tx_store import TxStore, EtherscanClient, Ingestor
+
+DAY = 86400
+ALICE = "0x00000000000000000000000000000000000000a1"
+BOB = "0x00000000000000000000000000000000000000b2"
+CAROL = "0x00000000000000000000000000000000000000c3"
+
+def tx(block, time_stamp, tx_hash, sender, receiver, value, **kwargs):
+    record = {"blockNumber": str(block), "timeStamp": str(time_stamp), "hash": tx_hash, "nonce": "0", "from": sender, "to": receiver, "value": str(value), "gasPrice": "1000", "isError": "0"}
+    record.update(kwargs)
+    return record
+
+ACCOUNT_TXS = {
+    ("txlist", ALICE): [
+        tx(10, 10*DAY, "0xh1", ALICE, BOB, 5),
+        tx(11, 10*DAY+60, "0xh2", ALICE, CAROL, 7),
+        tx(12, 11*DAY, "0xh3", BOB, ALICE, 1),
+    ],
+    # two internal transfers of the same parent transaction
+    ("txlistinternal", ALICE): [
+        tx(11, 10*DAY+60, "0xh2", CAROL, ALICE, 3, traceId="0"),
+        tx(11, 10*DAY+60, "0xh2", CAROL, BOB, 4, traceId="1"),
+    ],
+}
+
+class MockEtherscan(BaseHTTPRequestHandler):
+    """Etherscan-like account API. The first 'rate_limited' requests of the server are answered with a rate limit error."""
+    def do_GET(self):
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+        server = self.server
+        server.requests.append(params)
+        if server.rate_limited > 0:
+            server.rate_limited -= 1
+            body = {"status": "0", "message": "NOTOK", "result": "Max rate limit reached"}
+        else:
+            records = [rec for rec in server.account_txs.get((params["action"], params["address"].lower()), []) if int(rec["blockNumber"]) >= int(params["startblock"])]
+            records = records[:int(params["offset"])]
+            if len(records) == 0:
+                body = {"status": "0", "message": "No transactions found", "result": []}
+            else:
+                body = {"status": "1", "message": "OK", "result": records}
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+@pytest.fixture
+def etherscan():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockEtherscan)
+    server.account_txs = ACCOUNT_TXS
+    server.requests = []
+    server.rate_limited = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def client_for(server, **kwargs):
+    return EtherscanClient(base_url="http://127.0.0.1:%i/api" % server.server_address[1], rate=1000.0, burst=10, verbose=False, **kwargs)
+
+def test_internal_txs_are_not_deduplicated_with_parent(etherscan, tmp_path):
+    ingestor = Ingestor(str(tmp_path), client_for(etherscan), actions=["txlist", "txlistinternal"], verbose=False)
+    num_new = run(ingestor.ingest([ALICE.upper()]))
+    assert num_new == {"txlist": 3, "txlistinternal": 2}
+    df = TxStore(str(tmp_path), "normal_txs", verbose=False).read()
+    assert len(df) == 5
+    parent = df[df["hash"] == "0xh2"]
+    assert sorted(parent["tx_type"]) == ["internal", "internal", "normal"]
+    assert sorted(parent["value"]) == [3, 4, 7]
+
+def test_refresh_only_requests_new_blocks(etherscan, tmp_path):
+    ingestor = Ingestor(str(tmp_path), client_for(etherscan), actions=["txlist", "txlistinternal"], verbose=False)
+    run(ingestor.ingest([ALICE]))
+    etherscan.requests.clear()
+    # the state is reloaded from the store folder
+    ingestor = Ingestor(str(tmp_path), client_for(etherscan), actions=["txlist", "txlistinternal"], verbose=False)
+    num_new = run(ingestor.ingest([ALICE]))
+    assert num_new == {"txlist": 0, "txlistinternal": 0}
+    assert dict((req["action"], int(req["startblock"])) for req in etherscan.requests) == {"txlist": 12, "txlistinternal": 11}
+    assert len(TxStore(str(tmp_path), "normal_txs", verbose=False).read()) == 5
+
+def test_pagination_and_rate_limit_retry(etherscan, tmp_path):
+    etherscan.rate_limited = 1
+    client = client_for(etherscan, page_size=2)
+    df = run(client.fetch([ALICE], "txlist"))
+    # the first request is retried, pages restart from the last received block
+    assert client.num_requests == 4
+    assert [int(req["startblock"]) for req in etherscan.requests] == [0, 0, 11, 12]
+    store = TxStore(str(tmp_path), "normal_txs", verbose=False)
+    assert store.append(df) == 3
+    assert list(store.read(min_time=10*DAY, max_time=10*DAY+60)["hash"]) == ["0xh1", "0xh2"]
+    assert len(store.read(min_time=11*DAY)) == 1